@@ -9,47 +9,75 @@ from os.path import join, exists
 from . import fetch_contact_matrix
 from . import get_data_home
 
-def get_contact_matrices(data_home=None, age_boundaries=[18, 65], update=False,
+PLACES = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
+
+
+def _build_contact_matrices(data, age_boundaries=(18, 65)):
+    """
+    Average contact matrices by vacation flag and place from the survey data
+    Participants are binned by their age in ]-1,b1], ]b1,b2], ..., ]bn,inf[ and contacts in the same groups with strict bounds,
+    contacts of each participant are summed in one groupby, then averaged over participants of each vacation flag
+    """
+    boundaries = [-1] + list(age_boundaries) + [np.inf]
+    n_groups = len(boundaries) - 1
+
+    data = data.copy()
+    data["duration"] = data["duration"].replace({"<5": 0.08, "5-15": 0.25, "15-1h": 0.75, "1h-4h": 3, ">4h": 4})
+    for column in ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos",
+               "autresLieuxClos(resto..)", "transport"]:
+        data[column] = data[column] * data["duration"]
+    data["ouvert"] = data["ouvert"] * data["duration"] * 0.2
+
+    contact_matrices = {}
+    for vacation in ["oui", "non"]:
+        data_temp = data[data.vacation == vacation]
+        n_participants = data_temp.ID.nunique()
+
+        # Age group of each participant (mean age over its lines) and of each contact
+        age1 = data_temp.groupby("ID")["age1"].transform("mean")
+        i = pd.cut(age1, boundaries, right=True, labels=False)
+        if i.isnull().any():
+            ids = data_temp.ID[i.isnull()].unique().tolist()
+            raise ValueError(f"Participants {ids} have no age in the age groups, they would lower every matrix entry")
+        j = pd.cut(data_temp.age2, boundaries, right=True, labels=False)
+        on_boundary = data_temp.age2.isin(boundaries)
+
+        # Sum of contacts by pair of age groups, then mean over participants
+        select = i.notnull() & j.notnull() & ~on_boundary
+        sums = data_temp[select].groupby([i[select].astype(int), j[select].astype(int)])[PLACES].sum()
+        full_index = pd.MultiIndex.from_product([range(n_groups), range(n_groups)])
+        sums = sums.reindex(full_index, fill_value=0.0)
+
+        contact_matrices[vacation] = {
+            place: (sums[place].values.reshape(n_groups, n_groups) / n_participants).tolist()
+            for place in PLACES
+        }
+
+    return contact_matrices
+
+
+def get_contact_matrices(data_home=None, age_boundaries=(18, 65), update=False,
                         return_matrices=True):
-
-
+    """
+    Build or load contact matrices by vacation flag and place for the given age boundaries
+    Matrices are saved in a json file per set of age boundaries, use load_contact_matrices for a cached access
+    Arguments:
+    ---------
+      - data_home: where to save file (default in covid.dataset.data)
+      - age_boundaries: boundaries of the age groups, e.g. (18, 65) for ]-1,18], ]18,65], ]65,inf[
+      - update [bool]: rebuild the matrices from the survey data
+      - return_matrices [bool]: return matrices or not
+    """
     data_home = get_data_home(data_home=data_home)
-    filepath = join(data_home, "contact_matrices.json")
+    age_boundaries = tuple(age_boundaries)
+    if age_boundaries == (18, 65):
+        filepath = join(data_home, "contact_matrices.json")
+    else:
+        filepath = join(data_home, f"contact_matrices_{'_'.join(str(b) for b in age_boundaries)}.json")
 
     if not exists(filepath) or update:
         data = fetch_contact_matrix(return_data=True)
-
-        data.duration.replace({"<5": 0.08, "5-15": 0.25, "15-1h": 0.75, "1h-4h": 3, ">4h": 4}, inplace=True)
-        for column in ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos",
-                   "autresLieuxClos(resto..)", "transport"]:
-            data[column] = data[column] * data["duration"]
-
-        data["ouvert"] = data["ouvert"] * data["duration"] * 0.2
-
-        vacations = ["oui", "non"]
-        places = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
-
-        age_boundaries.append(np.infty)
-        age_boundaries.insert(0, -1)
-        age_groups = [[x,y] for x,y in zip(age_boundaries[:-1], age_boundaries[1:])]
-
-        contact_matrices = {vacation: {place: [] for place in places} for vacation in vacations}
-        for vacation in vacations:
-            time_select = (data.vacation == vacation)
-            data_temp = data[time_select]
-            for Id in data_temp.ID.unique():
-                ind = data_temp["ID"] == Id
-                age1 =  data_temp.loc[ind,"age1"].mean()
-                i = np.where([group[0] < age1 and age1 <= group[1] for group in age_groups])[0].item()
-                for place in places:
-                    matrice = np.zeros((len(age_groups),len(age_groups)))
-                    for j in range(len(age_groups)):
-                        age_group2 = ((age_groups[j][0] < data_temp.age2) & (data_temp.age2 < age_groups[j][1]))
-                        matrice[i,j] = data_temp.loc[ind & age_group2, place].sum() 
-
-                    contact_matrices[vacation][place].append(matrice)
-
-            contact_matrices[vacation] = {k:np.mean(v, axis=0).tolist() for k,v in contact_matrices[vacation].items()}
+        contact_matrices = _build_contact_matrices(data, age_boundaries)
 
         with open(filepath, "w") as f:
             json.dump(contact_matrices, f)
@@ -66,6 +94,34 @@ def get_contact_matrices(data_home=None, age_boundaries=[18, 65], update=False,
 
         return matrices
 
+# Process-wide store of contact matrices, loaded once by age boundaries and vacation flag
+_CONTACT_MATRICES_CACHE = {}
+
+def load_contact_matrices(vacations="non", age_boundaries=(18, 65), data_home=None):
+    """
+    Cached access to contact matrices by place for a vacation flag.
+    The file is read and parsed only once per process, then the same read-only arrays are returned.
+    Use get_contact_matrices to rebuild the matrices from raw data.
+    Arguments:
+    ---------
+      - vacations ["oui" or "non"]: matrices during vacations or not
+      - age_boundaries: boundaries of the age groups
+      - data_home: where the file is saved (default in covid.dataset.data)
+    Example:
+    -------
+      $ from covid.dataset import load_contact_matrices
+      $ matrices = load_contact_matrices("non")
+    """
+    key = (data_home, tuple(age_boundaries), vacations)
+    if key not in _CONTACT_MATRICES_CACHE:
+        matrices = get_contact_matrices(data_home=data_home, age_boundaries=list(age_boundaries))
+        for vacation in matrices.keys():
+            for matrix in matrices[vacation].values():
+                matrix.setflags(write=False)
+            _CONTACT_MATRICES_CACHE[(data_home, tuple(age_boundaries), vacation)] = matrices[vacation]
+
+    return _CONTACT_MATRICES_CACHE[key]
+
 if __name__=="__main__":
     get_contact_matrices()
 
@@ -0,0 +1,155 @@
+"""
+Columnar on-disk cache for raw and processed datasets
+Datasets are stored as Parquet files (or pickle files if pyarrow is not installed) under get_data_home()/cache,
+with a manifest recording for each entry:
+  - source_hash: hash of the input the dataset was built from (raw file content or raw dataset hash)
+  - params: processing parameters used to build the dataset
+  - fetch_date: when the entry was written
+An entry is only valid if its source hash and processing parameters match the ones of the current call,
+so processed datasets are rebuilt when their inputs or their processing change, and loaded from disk otherwise.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from os.path import join, exists
+
+import pandas as pd
+
+from . import get_data_home
+
+try:
+    import pyarrow
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pickle"
+
+MANIFEST = "manifest.json"
+
+
+def get_cache_home(data_home=None):
+    cache_home = join(get_data_home(data_home=data_home), "cache")
+    if not exists(cache_home):
+        os.makedirs(cache_home)
+    return cache_home
+
+
+def hash_file(filepath):
+    """Hash of the content of a file"""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_data(data):
+    """Hash of the content of a dataframe, including index and column names"""
+    h = hashlib.sha256(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    h.update(json.dumps([str(c) for c in data.columns]).encode())
+    return h.hexdigest()
+
+
+def _hash_params(params):
+    return hashlib.sha256(json.dumps(params or {}, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _entry_name(name, params):
+    """Entries built with different processing parameters are kept side by side"""
+    return f"{name}-{_hash_params(params)[:12]}" if params else name
+
+
+def read_manifest(data_home=None):
+    filepath = join(get_cache_home(data_home), MANIFEST)
+    if not exists(filepath):
+        return {}
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest, data_home=None):
+    filepath = join(get_cache_home(data_home), MANIFEST)
+    with open(filepath + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def load_cache(name, source_hash=None, params=None, data_home=None, max_age=None):
+    """
+    Load a dataset from the cache if it is still valid, returns None otherwise
+    Arguments:
+    ---------
+      - name [str]: name of the cache entry
+      - source_hash [str]: hash of the input of the dataset, not checked if None
+      - params [dict]: processing parameters of the dataset
+      - max_age [pd.Timedelta]: maximum age of the entry, e.g. for remote files which can't be hashed before download
+    """
+    entry = read_manifest(data_home).get(_entry_name(name, params))
+    if entry is None:
+        return None
+
+    filepath = join(get_cache_home(data_home), entry["file"])
+    if not exists(filepath):
+        return None
+    if source_hash is not None and entry["source_hash"] != source_hash:
+        return None
+    if entry["params_hash"] != _hash_params(params):
+        return None
+    if max_age is not None and pd.Timestamp.now() - pd.Timestamp(entry["fetch_date"]) > max_age:
+        return None
+
+    logging.info(f"Loading {name} from cache at {filepath}")
+    if entry["format"] == "parquet":
+        data = pd.read_parquet(filepath)
+    else:
+        data = pd.read_pickle(filepath)
+    data.attrs["source_hash"] = entry["source_hash"]
+    data.attrs["fetch_date"] = entry["fetch_date"]
+    return data
+
+
+def save_cache(name, data, source_hash, params=None, data_home=None):
+    """
+    Save a dataset in the cache and record it in the manifest, returns the dataset
+    Parquet is used when pyarrow is available, columns with mixed types fall back to pickle
+    """
+    cache_home = get_cache_home(data_home)
+    name = _entry_name(name, params)
+    fmt = CACHE_FORMAT
+    filepath = join(cache_home, f"{name}.{fmt}")
+    if fmt == "parquet":
+        try:
+            data.to_parquet(filepath)
+        except Exception:
+            fmt = "pickle"
+            filepath = join(cache_home, f"{name}.{fmt}")
+    if fmt == "pickle":
+        data.to_pickle(filepath)
+
+    manifest = read_manifest(data_home)
+    manifest[name] = {
+        "file": os.path.basename(filepath),
+        "format": fmt,
+        "source_hash": source_hash,
+        "params": params or {},
+        "params_hash": _hash_params(params),
+        "fetch_date": str(pd.Timestamp.now()),
+    }
+    _write_manifest(manifest, data_home)
+
+    data.attrs["source_hash"] = source_hash
+    return data
+
+
+def cached(name, build, source_hash, params=None, data_home=None, update=False):
+    """
+    Load a dataset from the cache or build it with build() and cache it
+    Example:
+    -------
+      $ cases = cached("daily_cases_france", lambda: process(raw), raw.attrs["source_hash"], {"smooth": True})
+    """
+    data = None if update else load_cache(name, source_hash, params, data_home)
+    if data is None:
+        data = save_cache(name, build(), source_hash, params, data_home)
+    return data
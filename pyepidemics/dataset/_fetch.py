@@ -9,13 +9,17 @@ ToDo:
 """
 
 import logging
+import hashlib
 from os.path import join, exists
 
+import numpy as np
 import pandas as pd
 
 from . import get_data_home
 from . import download_file
-from ..utils import clean_series
+from ._cache import cached, load_cache, save_cache, hash_file, hash_data
+from ._ingest import ingest_daily_case, read_daily_case
+from ..utils import clean_frame
 
 CASE_URL = "https://raw.githubusercontent.com/opencovid19-fr/data/master/"\
     "dist/chiffres-cles.csv"
@@ -71,57 +75,53 @@ def fetch_contact_matrix(data_home=None, force_download=False, update=False, ret
 def _process_contact(raw_data, age_groups_boundaries=[18,65]):
     """
     Builds the contact matrices based on the raw_data
+    Each line of the survey holds two days, each with up to 40 contacts blocks of 14 columns.
+    All blocks are reshaped at once into a (lines x days x contacts x fields) array,
+    for each day only the contacts before the first empty block are kept.
 
     Arguments:
     ---------
       - data (pd.DateFrame): raw_data
       - age_groups_bondaries: [18, 65] => [0,18], ]18,65[, [65,)
     """
-    def parse_one_line(line):
-        """
-        Transforms one line of the data set into one dataset of contacts.
-        """
-        if line[1184] == 0:
-            return pd.DataFrame()
-
-        data_frames = []
-        departement, age1, sex1 = line[27], line[4], line[6]
-        for day_index in [54, 619]:
-            week_day, vacation = line[day_index+2], line[day_index+3]
-            contact = 0
-            contact_index = day_index + 5 + contact * 14
-            while contact<40 and not sum(line[contact_index+4: contact_index+11])==0\
-                and not pd.isnull(line[contact_index+2]):
-                df = pd.DataFrame({"ID": line[1],
-                                   "departement": departement,
-                                   "week_day": week_day, "vacation": vacation, 
-                                   "age1": age1, "sex1": sex1,
-                                   "age2": line[contact_index+2], 
-                                   "sex2": line[contact_index+3],
-                                   "domicile": line[contact_index+4],
-                                   "ecoles": line[contact_index+5],
-                                   "travailClos": line[contact_index+6],
-                                   "chezProchesLieuxClos": line[contact_index+7],
-                                   "autresLieuxClos(resto..)": line[contact_index+8],
-                                   "transport": line[contact_index+9],
-                                   "ouvert": line[contact_index+10],
-                                   "duration": line[contact_index+13]},
-                                  index=[0])
-
-                data_frames.append(df)
-                contact+=1
-                contact_index = day_index + 5 + contact * 14
-
-        if len(data_frames) > 0:
-            to_return = pd.concat(data_frames)
-
-        else: 
-            return pd.DataFrame()
-
-        return to_return
-
-    data = pd.concat([parse_one_line(raw_data.loc[i,:]) for i in range(raw_data.shape[0])])
-    data = data.dropna(axis=0).astype(int)
+    raw = raw_data.values
+    day_indexes = np.array([54, 619])
+    n_contacts, block_size = 40, 14
+
+    # Columns of each field of each contact block, shape (days x contacts x fields)
+    columns = day_indexes[:, None, None] + 5 + block_size * np.arange(n_contacts)[None, :, None] + np.arange(block_size)[None, None, :]
+    blocks = raw[:, columns]
+
+    # A contact is recorded if it has an age and places not all zeros, contacts after the first missing one are ignored
+    # Missing places do not end the day, the contact is dropped afterwards with other missing values
+    places = pd.DataFrame(blocks[..., 4:11].reshape(-1, 7)).apply(pd.to_numeric, errors="coerce").values.reshape(blocks.shape[:3] + (7,))
+    valid = (places.sum(axis=-1) != 0) & ~pd.isnull(blocks[..., 2])
+    valid = np.cumprod(valid, axis=2).astype(bool)
+    valid &= ~(raw[:, 1184] == 0)[:, None, None]
+
+    # Long format with one row per contact, ordered by line, day and contact
+    line, day, contact = np.nonzero(valid)
+    block = blocks[line, day, contact]
+    data = pd.DataFrame({
+        "ID": raw[line, 1],
+        "departement": raw[line, 27],
+        "week_day": raw[line, day_indexes[day] + 2],
+        "vacation": raw[line, day_indexes[day] + 3],
+        "age1": raw[line, 4],
+        "sex1": raw[line, 6],
+        "age2": block[:, 2],
+        "sex2": block[:, 3],
+        "domicile": block[:, 4],
+        "ecoles": block[:, 5],
+        "travailClos": block[:, 6],
+        "chezProchesLieuxClos": block[:, 7],
+        "autresLieuxClos(resto..)": block[:, 8],
+        "transport": block[:, 9],
+        "ouvert": block[:, 10],
+        "duration": block[:, 13],
+    })
+
+    data = data.dropna(axis=0).astype(int).reset_index(drop=True)
 
     data.departement = data.departement.astype("object")
     data.week_day = data.week_day.astype("object")
@@ -133,49 +133,86 @@ def _process_contact(raw_data, age_groups_boundaries=[18,65]):
 
     return data
 
-def fetch_daily_case(data_home=None, update=True, return_data=False,download = False):
+def fetch_daily_case(data_home=None, update=True, return_data=False,download = False, cache = True, incremental = False, granularite = None, url = None, max_age = None):
     """
     Download daily case in France per departement
     Can return dataframe or not
+    Raw data is stored in the columnar cache, with the hash of the downloaded file as source
     Arguments:
     ---------
       - data_home: where to save file (default in covid.dataset.data)
       - update [bool]: if already exists, update with more udpated data or use existing file
       - return_data [bool]: return dataframe or not
+      - cache [bool]: use the columnar cache
+      - max_age [str or pd.Timedelta]: serve the remote file from the cache if it was fetched less than max_age ago (e.g. "6h"),
+        by default the remote file is always read again
+      - incremental [bool]: only ingest new rows in a local store partitioned by granularite and month (see ingest_daily_case)
+      - granularite [str]: with incremental, only read the partitions of this granularite (e.g. "pays")
+      - url [str]: url, file:// url or local path of the case file, defaults to CASE_URL
     Example:
     -------
       $ from covid.dataset import fetch_daily_case
       $ data = fetch_daily_case(return_data=True)
     """
 
-    if download:
+    if url is None:
+        url = CASE_URL
+
+    if incremental:
+        if update:
+            ingest_daily_case(url, data_home=data_home)
+        if return_data:
+            return read_daily_case(granularite, data_home=data_home)
+
+    elif download:
 
         data_home = get_data_home(data_home=data_home)
         
         filepath = join(data_home, "daily_cases.csv")
         if exists(filepath):
             if update:
-                download_file(CASE_URL, filepath)
+                download_file(url, filepath)
             else:
                 logging.info(f"File already exists at {filepath} and update = False")
         else:
-                download_file(CASE_URL, filepath)
+                download_file(url, filepath)
         
         if return_data:
-            data = pd.read_csv(filepath)
-            return data
+            if not cache:
+                return pd.read_csv(filepath)
+            return cached("daily_cases", lambda: pd.read_csv(filepath), hash_file(filepath), data_home=data_home)
 
     else:
-        data = pd.read_csv(CASE_URL)
+        data = None
+        if cache and max_age is not None:
+            data = load_cache("daily_cases_remote", max_age=pd.Timedelta(max_age), data_home=data_home)
+            if data is not None:
+                logging.info(f"Daily cases served from the cache, fetched on {data.attrs['fetch_date']} (max_age = {max_age})")
+        if data is None:
+            data = pd.read_csv(url)
+            if cache:
+                data = save_cache("daily_cases_remote", data, hash_data(data), data_home=data_home)
         return data
 
 
+def _source_hash(raw):
+    """Hash of raw data, stored by the cache or computed on the content"""
+    return raw.attrs.get("source_hash") or hash_data(raw)
+
+
 
-def fetch_daily_case_france(return_data = True,smooth = True):
+def fetch_daily_case_france(return_data = True,smooth = True,incremental = False):
+    raw = fetch_daily_case(return_data = True,incremental = incremental,granularite = "pays")
+
+    # Processed cases are rebuilt only if the raw data or the processing parameters changed
+    return cached("daily_cases_france", lambda: _process_daily_case_france(raw, smooth = smooth), _source_hash(raw), {"smooth":smooth})
+
+
+def _process_daily_case_france(raw,smooth = True):
 
     # Get cases from utils function
     cases = (
-        fetch_daily_case(return_data = True)
+        raw
         .query("granularite =='pays'")
         .query("source_nom=='Ministère des Solidarités et de la Santé'")
         [["date","cas_confirmes","deces","gueris","hospitalises","reanimation"]]
@@ -192,13 +229,16 @@ def fetch_daily_case_france(return_data = True,smooth = True):
     date_range = pd.date_range(start,end,freq="D")
     cases = cases.reindex(date_range).interpolate()
 
-    # Clean and logsmooth
-    cases["I"] = clean_series(cases["cas_confirmes"],logsmooth = smooth)
-    cases["Is"] = clean_series(cases["cas_confirmes"] - (cases["deces"] + cases["gueris"]),logsmooth=smooth)
-    cases["D"] = clean_series(cases["deces"],logsmooth = smooth)
-    cases["R"] = clean_series(cases["gueris"],logsmooth = smooth)
-    cases["H"] = clean_series(cases["hospitalises"],logsmooth = smooth)
-    cases["ICU"] = clean_series(cases["reanimation"],logsmooth = smooth)
+    # Clean and logsmooth all series at once
+    series = pd.DataFrame({
+        "I":cases["cas_confirmes"],
+        "Is":cases["cas_confirmes"] - (cases["deces"] + cases["gueris"]),
+        "D":cases["deces"],
+        "R":cases["gueris"],
+        "H":cases["hospitalises"],
+        "ICU":cases["reanimation"],
+    })
+    cases[series.columns.tolist()] = clean_frame(series,logsmooth = smooth)
 
     return cases
 
@@ -217,31 +257,99 @@ def fetch_list_available_departements(without_prefix = True):
 
 
 
-def fetch_daily_case_departement(dep,return_data = True,smooth = True):
+DEPARTEMENT_SERIES = {"D":"deces","R":"gueris","H":"hospitalises","ICU":"reanimation"}
+
+
+def _process_daily_case_departements(raw_by_dep,smooth = True):
+    """Reindex, interpolate and clean the raw daily cases of departements
+    Series of all departements sharing the same dates are cleaned together in one (time x series) block
+    """
+    all_cases = {}
+    for dep,cases in raw_by_dep.items():
+        cases = (cases
+            [["date","deces","gueris","hospitalises","reanimation"]]
+            .drop_duplicates(subset = ["date"])
+            .fillna(0.0)
+            .assign(date = lambda x : pd.to_datetime(x["date"]))
+            .set_index("date")
+        )
+
+        # Reindex and interpolate
+        start,end = cases.index[0],cases.index[-1]
+        date_range = pd.date_range(start,end,freq="D")
+        all_cases[dep] = cases.reindex(date_range).interpolate()
+
+    # Clean and logsmooth by group of departements with the same dates
+    groups = {}
+    for dep,cases in all_cases.items():
+        groups.setdefault((cases.index[0],len(cases)),[]).append(dep)
+
+    for deps in groups.values():
+        block = pd.concat({dep:all_cases[dep][list(DEPARTEMENT_SERIES.values())] for dep in deps},axis = 1)
+        block = clean_frame(block,logsmooth = smooth)
+        for dep in deps:
+            all_cases[dep][list(DEPARTEMENT_SERIES.keys())] = block[dep].values
+
+    return all_cases
+
+
+def _process_daily_case_departement(cases,smooth = True):
+    """Reindex, interpolate and clean the raw daily cases of one departement
+    """
+    return _process_daily_case_departements({"dep":cases},smooth = smooth)["dep"]
+
+
+def fetch_daily_case_departement(dep,return_data = True,smooth = True,incremental = False):
 
     # Get cases from utils function
-    cases = (fetch_daily_case(return_data = True)
+    raw = fetch_daily_case(return_data = True,incremental = incremental,granularite = "departement")
+    cases = lambda : (raw
         .query(f"granularite=='departement' and maille_code=='DEP-{dep}'")
         .query("source_nom=='Santé publique France Data'")
-        [["date","deces","gueris","hospitalises","reanimation"]]
-        .drop_duplicates(subset = ["date"])
-        .fillna(0.0)
-        .assign(date = lambda x : pd.to_datetime(x["date"]))
-        .set_index("date")
     )
 
-    # Reindex and interpolate
-    start,end = cases.index[0],cases.index[-1]
-    date_range = pd.date_range(start,end,freq="D")
-    cases = cases.reindex(date_range).interpolate()
+    return cached(f"daily_cases_departement_{dep}", lambda: _process_daily_case_departement(cases(),smooth = smooth), _source_hash(raw), {"smooth":smooth})
 
-    # Clean and logsmooth
-    cases["D"] = clean_series(cases["deces"],logsmooth = smooth)
-    cases["R"] = clean_series(cases["gueris"],logsmooth = smooth)
-    cases["H"] = clean_series(cases["hospitalises"],logsmooth = smooth)
-    cases["ICU"] = clean_series(cases["reanimation"],logsmooth = smooth)
 
-    return cases
+def fetch_daily_case_departements(deps = None,data = None,smooth = True,incremental = False):
+    """
+    Daily cases for many departements at once
+    The national case file is read once and partitioned with a single groupby,
+    instead of reading and filtering it again for each departement
+    Arguments:
+    ---------
+      - deps [list]: departements codes without prefix, defaults to all available departements
+      - data [pd.DataFrame]: raw case file as returned by fetch_daily_case, downloaded if not given
+      - smooth [bool]: logsmooth the series
+      - incremental [bool]: ingest new rows and only read departement partitions of the local store
+    Example:
+    -------
+      $ from covid.dataset import fetch_daily_case_departements
+      $ cases = fetch_daily_case_departements(["75","92"])
+      $ cases["75"].head()
+    """
+    if data is None:
+        data = fetch_daily_case(return_data = True,incremental = incremental,granularite = "departement")
+    source_hash = _source_hash(data)
+
+    data = (data
+        .query("granularite=='departement'")
+        .query("source_nom=='Santé publique France Data'")
+        .assign(dep = lambda x : x["maille_code"].str.replace("DEP-","",regex = False))
+    )
+    if deps is not None:
+        data = data.loc[data["dep"].isin(deps)]
+
+    # Processed cases are shared with fetch_daily_case_departement in the cache
+    # Departements missing from the cache are processed together
+    params = {"smooth":smooth}
+    raw_by_dep = dict(tuple(data.groupby("dep")))
+    all_cases = {dep:load_cache(f"daily_cases_departement_{dep}", source_hash, params) for dep in raw_by_dep}
+    missing = {dep:raw_by_dep[dep] for dep,cases in all_cases.items() if cases is None}
+    for dep,cases in _process_daily_case_departements(missing,smooth = smooth).items():
+        all_cases[dep] = save_cache(f"daily_cases_departement_{dep}", cases, source_hash, params)
+
+    return all_cases
 
 
 def fetch_population(data_home=None, return_data=False, level='dpt', year=2020):
@@ -257,14 +365,20 @@ def fetch_population(data_home=None, return_data=False, level='dpt', year=2020):
     
     data_home = get_data_home(data_home=data_home)
 
-    filepath = join(data_home, f"pop_{level.lower()}_{str(year)}.csv")
-    if not exists(filepath):
-        data = pd.read_excel(POP_URL[level.upper()], sheet_name=str(year), header=3)
-        data = _format_pop(data)
-        data.to_csv(filepath, index=False, sep=',')
-    else:
-        logging.info(f"File already exists at {filepath}")
-        data = pd.read_csv(filepath)
+    def build():
+        filepath = join(data_home, f"pop_{level.lower()}_{str(year)}.csv")
+        if not exists(filepath):
+            data = pd.read_excel(POP_URL[level.upper()], sheet_name=str(year), header=3)
+            data = _format_pop(data)
+            data.to_csv(filepath, index=False, sep=',')
+        else:
+            logging.info(f"File already exists at {filepath}")
+            data = pd.read_csv(filepath)
+        return data
+
+    # Remote file of a given year does not change, its url is used as source
+    source_hash = hashlib.sha256(POP_URL[level.upper()].encode()).hexdigest()
+    data = cached(f"pop_{level.lower()}_{str(year)}", build, source_hash, data_home=data_home)
     
     if return_data:
         return data
@@ -5,6 +5,7 @@ import pandas as pd
 
 from . import get_data_home
 from . import download_file
+from ._cache import load_cache, save_cache, hash_file
 
 BED_URL = "https://drees.solidarites-sante.gouv.fr/IMG/xlsx/"\
     "drees_lits_reanimation_2013-2018.xlsx"
@@ -26,14 +27,23 @@ def fetch_bed(data_home=None, update=False, return_data=False):
     """
     data_home=get_data_home(data_home=data_home)
     filepath = join(data_home, "beds_dpt.csv")
-    if not exists(filepath) or update:
-        download_file(BED_URL, filepath)
-        data = pd.read_excel(filepath, sheet_name='Détails_statut_type_2018', header=9)
-        data = _format_bed(data)
-        data.to_csv(filepath, index=False, sep=',')
-    else:
-        logging.info(f"File already exists at {filepath}.")
-        data = pd.read_csv(filepath)
+
+    # Columnar cache is valid as long as the local file is unchanged
+    data = None
+    if exists(filepath) and not update:
+        data = load_cache("beds_dpt", hash_file(filepath), data_home=data_home)
+
+    if data is None:
+        if not exists(filepath) or update:
+            download_file(BED_URL, filepath)
+            data = pd.read_excel(filepath, sheet_name='Détails_statut_type_2018', header=9)
+            data = _format_bed(data)
+            data.to_csv(filepath, index=False, sep=',')
+        else:
+            logging.info(f"File already exists at {filepath}.")
+            data = pd.read_csv(filepath)
+        data = save_cache("beds_dpt", data, hash_file(filepath), data_home=data_home)
+
     if return_data:
         return data
 
@@ -0,0 +1,208 @@
+"""
+Incremental ingest of the daily case file
+The national case file only grows by a few hundred rows each day, so instead of downloading it again:
+  - only the bytes after the last ingested position are requested (HTTP Range request, or seek for local files)
+  - new rows are merged in a local append-only store partitioned by granularite and month of the date,
+    rows with the same date, maille_code and source replace the stored ones
+  - the end of the ingested content is checked at each ingest, if the file was rewritten upstream it is read in full again
+Readers only load the partitions they need.
+"""
+
+import io
+import os
+import re
+import json
+import hashlib
+import logging
+from os.path import join, exists
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+
+from . import get_data_home
+from ._cache import CACHE_FORMAT, hash_data
+
+STORE = "daily_cases_store"
+KEY = ["date", "maille_code", "source_nom"]
+TAIL_SIZE = 256
+
+
+def get_store_home(data_home=None):
+    store_home = join(get_data_home(data_home=data_home), STORE)
+    if not exists(store_home):
+        os.makedirs(store_home)
+    return store_home
+
+
+def _read_manifest(store_home):
+    filepath = join(store_home, "manifest.json")
+    if not exists(filepath):
+        return {"url": None, "offset": 0, "tail": "", "header": "", "partitions": {}}
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest, store_home):
+    filepath = join(store_home, "manifest.json")
+    with open(filepath + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def _read_from(url, start):
+    """
+    Read a local file, a file:// url or an http url from byte start
+    Returns the content and its actual start, which is 0 if the whole file had to be read
+    """
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "file"):
+        path = parsed.path if parsed.scheme == "file" else url
+        with open(path, "rb") as f:
+            size = f.seek(0, 2)
+            start = start if start <= size else 0
+            f.seek(start)
+            return f.read(), start
+
+    response = requests.get(url, headers={"Range": f"bytes={start}-"} if start > 0 else {})
+    if response.status_code == 416:
+        return b"", start
+    response.raise_for_status()
+    if response.status_code == 206:
+        return response.content, start
+    return response.content, 0
+
+
+def _read_partition(store_home, entry):
+    filepath = join(store_home, entry["file"])
+    if entry["format"] == "parquet":
+        return pd.read_parquet(filepath)
+    return pd.read_pickle(filepath)
+
+
+def _write_partition(store_home, name, data):
+    """Write a partition as parquet, or pickle if pyarrow is missing or columns have mixed types"""
+    granularite, month = name.split("/")
+    folder = join(store_home, f"granularite={granularite}")
+    if not exists(folder):
+        os.makedirs(folder)
+
+    fmt = CACHE_FORMAT
+    filepath = join(folder, f"date={month}.{fmt}")
+    if fmt == "parquet":
+        try:
+            data.to_parquet(filepath)
+        except Exception:
+            fmt = "pickle"
+            filepath = join(folder, f"date={month}.{fmt}")
+    if fmt == "pickle":
+        data.to_pickle(filepath)
+
+    return {"file": os.path.relpath(filepath, store_home), "format": fmt, "hash": hash_data(data)}
+
+
+def _partition_names(data):
+    clean = lambda x: re.sub(r"[^0-9A-Za-z_-]", "_", x)
+    granularite = data["granularite"].fillna("unknown").astype(str).map(clean)
+    month = data["date"].fillna("unknown").astype(str).str[:7].map(clean)
+    return granularite + "/" + month
+
+
+def ingest_daily_case(url, data_home=None):
+    """
+    Ingest new rows of the daily case file in the local store
+    Arguments:
+    ---------
+      - url: http url, file:// url or local path of the case file (e.g. CASE_URL)
+      - data_home: where the store is saved (default in covid.dataset.data)
+    Returns:
+    -------
+      - dict with the number of ingested rows and the updated partitions
+    Example:
+    -------
+      $ from covid.dataset import ingest_daily_case
+      $ ingest_daily_case("file:///tmp/chiffres-cles.csv")
+    """
+    store_home = get_store_home(data_home)
+    manifest = _read_manifest(store_home)
+
+    # Resume after the last ingested byte, re-reading the end of the previous content to check it did not change
+    tail = bytes.fromhex(manifest["tail"])
+    start = manifest["offset"] - len(tail) if manifest["url"] == url else 0
+    content, position = _read_from(url, start)
+    if position > 0 and not content.startswith(tail):
+        logging.info(f"File at {url} was rewritten, ingesting it in full")
+        content, position = _read_from(url, 0)
+
+    # Only complete lines are ingested, the header is kept for later partial reads
+    end = position + content.rfind(b"\n") + 1
+    if position == 0:
+        header = content[:content.find(b"\n") + 1]
+        body = content[len(header):end]
+        manifest["header"] = header.decode()
+    else:
+        header = manifest["header"].encode()
+        body = content[manifest["offset"] - position:end - position]
+
+    summary = {"rows": 0, "partitions": []}
+    if end > position and len(body) > 0:
+        new = pd.read_csv(io.BytesIO(header + body), dtype={k: str for k in KEY + ["granularite"]})
+        summary["rows"] = len(new)
+
+        # Merge new rows in the partitions they belong to, new or changed rows replace stored ones
+        for name, rows in new.groupby(_partition_names(new)):
+            entry = manifest["partitions"].get(name)
+            if entry is not None:
+                stored = _read_partition(store_home, entry)
+                rows = pd.concat([stored, rows], ignore_index=True).drop_duplicates(subset=KEY, keep="last")
+                if len(rows) == len(stored) and hash_data(rows.reset_index(drop=True)) == entry["hash"]:
+                    continue
+            manifest["partitions"][name] = _write_partition(store_home, name, rows.reset_index(drop=True))
+            summary["partitions"].append(name)
+
+    # Record the ingested position with the end of its content
+    if end > position:
+        manifest["offset"] = end
+        manifest["tail"] = content[max(0, end - position - TAIL_SIZE):end - position].hex()
+    manifest["url"] = url
+    _write_manifest(manifest, store_home)
+
+    logging.info(f"Ingested {summary['rows']} rows in {len(summary['partitions'])} partitions")
+    return summary
+
+
+def read_daily_case(granularite=None, start=None, end=None, data_home=None):
+    """
+    Read the daily cases from the local store, only loading the needed partitions
+    Arguments:
+    ---------
+      - granularite [str or list]: e.g. "pays" or "departement", all if None
+      - start, end [str]: range of months to read, e.g. "2020-03", all if None
+      - data_home: where the store is saved (default in covid.dataset.data)
+    """
+    store_home = get_store_home(data_home)
+    manifest = _read_manifest(store_home)
+    if isinstance(granularite, str):
+        granularite = [granularite]
+
+    names = []
+    for name in sorted(manifest["partitions"]):
+        g, month = name.split("/")
+        if granularite is not None and g not in granularite:
+            continue
+        if (start is not None and month < str(start)[:7]) or (end is not None and month > str(end)[:7]):
+            continue
+        names.append(name)
+
+    if len(names) == 0:
+        raise Exception(f"No partition in the store for granularite {granularite}, ingest the case file first")
+
+    data = pd.concat([_read_partition(store_home, manifest["partitions"][name]) for name in names], ignore_index=True)
+    data = data.sort_values("date", kind="stable").reset_index(drop=True)
+
+    # Version of the partitions read, used by the cache of processed datasets
+    h = hashlib.sha256()
+    for name in names:
+        h.update(manifest["partitions"][name]["hash"].encode())
+    data.attrs["source_hash"] = h.hexdigest()
+    return data
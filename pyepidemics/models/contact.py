@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class ContactOperator:
+    def __init__(self,factors):
+        """Contact matrix between granular compartments kept as Kronecker factors, one per dimension
+        For dimensions region x age, the full contact matrix is kron(C_region,C_age) but it is never materialized:
+        products are computed factor by factor on the vector reshaped as a (regions x ages) tensor.
+        Memory and time therefore grow with the size of the factors and not with (regions x ages)².
+        Factors can be numpy arrays or scipy sparse matrices.
+
+        Args:
+            factors (list): square contact matrices in the order of the model dimensions
+        """
+        self.factors = [f.tocsr() if sparse.issparse(f) else np.asarray(f,dtype = float) for f in factors]
+        self.sizes = [f.shape[0] for f in self.factors]
+        n = int(np.prod(self.sizes))
+        self.shape = (n,n)
+
+
+    def dot(self,x):
+        """Product of the contact matrix with a vector (dimensions,) or a batch of vectors (dimensions x runs)
+        """
+        x = np.asarray(x,dtype = float)
+        extra = x.shape[1:]
+        tensor = x.reshape(self.sizes + list(extra))
+
+        # Apply each factor along its own axis
+        for axis,factor in enumerate(self.factors):
+            tensor = np.moveaxis(tensor,axis,0)
+            shape = tensor.shape
+            tensor = (factor @ tensor.reshape(shape[0],-1)).reshape(shape)
+            tensor = np.moveaxis(tensor,0,axis)
+
+        return tensor.reshape(x.shape)
+
+    __matmul__ = dot
+
+
+    def row(self,i):
+        """Row i of the full contact matrix, ie the contacts of one combination of dimensions
+        """
+        positions = np.unravel_index(i,self.sizes)
+        row = np.ones(1)
+        for position,factor in zip(positions,self.factors):
+            factor_row = factor[position].toarray().ravel() if sparse.issparse(factor) else factor[position]
+            row = np.kron(row,factor_row)
+        return row
+
+
+    def toarray(self):
+        """Materialize the full dense contact matrix, only meant for inspection on small models
+        """
+        matrix = np.ones((1,1))
+        for factor in self.factors:
+            matrix = np.kron(matrix,factor.toarray() if sparse.issparse(factor) else factor)
+        return matrix
+
+
+
+class ContactMatrices(dict):
+    def __init__(self,matrices,operator,index):
+        """Contact matrices by dimension with the operator between all dimensions in "operator"
+        The dense contact matrix between all dimensions in "all" (pd.DataFrame indexed by joined dimensions names)
+        is only materialized on first access, as its size grows with the square of the number of combinations
+
+        Args:
+            matrices (dict): contact matrix of each dimension
+            operator (ContactOperator): contact operator between all dimensions
+            index (list): names of the combinations of dimensions, e.g. "paris_young"
+        """
+        super().__init__(matrices)
+        self["operator"] = operator
+        self.index = index
+
+
+    def __missing__(self,key):
+        if key != "all":
+            raise KeyError(key)
+        self["all"] = pd.DataFrame(self["operator"].toarray(),index = self.index,columns = self.index)
+        return self["all"]
@@ -4,7 +4,7 @@ import numpy as np
 
 from ..model import CompartmentalModel
 from ..params import Params
-from ...dataset import get_contact_matrices
+from ...dataset import load_contact_matrices
 
 
 class COVID19Category(CompartmentalModel):
@@ -28,7 +28,8 @@ class COVID19Category(CompartmentalModel):
                  contact_coeffs = None,
                  offset = None,
                  symptomatic_isolation=0.75,
-                 case_isolation=0):
+                 case_isolation=0,
+                 symbolic=False):
 
         # Prepare params
         dimensions = {"category":categories}
@@ -60,6 +61,7 @@ class COVID19Category(CompartmentalModel):
 
         # Parameters
         self.N = np.sum(N)
+        self._case_isolation = case_isolation
         case_isolation = self.make_callable(case_isolation) 
 
         # Prepare granular transition function
@@ -78,10 +80,11 @@ class COVID19Category(CompartmentalModel):
             beta = g("beta")
             beta = self.make_callable(beta)
             C = self.contact_matrix(dimensions)
+            N = np.array(self.params["N"])
 
             return {
                 "S":{
-                    "E":lambda y,t : beta(y,t) * y[S] * (1-case_isolation(y,t)) * (1/np.array(self.params["N"])) * C(y,t) @ (y["Ia"] + (1-p["symptomatic_isolation"])*y["Im"] + (1-p["symptomatic_isolation"])*y["Is"])
+                    "E":lambda y,t : beta(y,t) * y[S] * (1-case_isolation(y,t)) * ((C(y,t) / N) @ (y["Ia"] + (1-p["symptomatic_isolation"])*y["Im"] + (1-p["symptomatic_isolation"])*y["Is"]))
                 },
                 "E":{
                     "Ia":lambda y,t : 1/p["incubation_duration"] * (1 - p["proba_severe"] - p["proba_mild"]) * y[E],
@@ -108,19 +111,87 @@ class COVID19Category(CompartmentalModel):
                 }
             }
 
-        # Add transitions
-        self.transitions = transitions
-        self.add_transitions(transitions,granularity=True)
+        # Add transitions, as symbolic expressions compiled into a fused derivative if symbolic
+        # Parameters are then bound at construction
+        self.transitions = self.symbolic_transitions if symbolic else transitions
+        self.add_transitions(self.transitions,granularity=True)
+
+    def symbolic_transitions(self,dimensions):
+        """Same transitions as in __init__ written as symbolic expressions"""
+        y = self.symbols
+        case_isolation = self.param("case_isolation",self._case_isolation)
+
+        # Prepare helper getter function
+        g = lambda x,dimensions=dimensions : self.get(x,dimensions)
+
+        # Get compartment names and parmas 
+        S,E,Ia,Im,Is,H,ICU,R,D = g(["S","E","Ia","Im","Is","H","ICU","R","D"])
+
+        # Precompute parameters
+        p = {x:g(x) for x in self.params.columns}
+
+        # Make symbolic parameters
+        name = "_".join(dimensions)
+        beta = self.param(f"beta_{name}",g("beta"))
+        C = self.param(f"contact_{name}",self.contact_matrix(dimensions),size = len(self.dimensions["category"]))
+        N = np.array(self.params["N"])
+
+        return {
+            "S":{
+                "E":beta * y[S] * (1-case_isolation) * ((C / N) @ (y["Ia"] + (1-p["symptomatic_isolation"])*y["Im"] + (1-p["symptomatic_isolation"])*y["Is"]))
+            },
+            "E":{
+                "Ia":1/p["incubation_duration"] * (1 - p["proba_severe"] - p["proba_mild"]) * y[E],
+                "Im":1/p["incubation_duration"] * p["proba_mild"] * y[E],
+                "Is":1/p["incubation_duration"] * p["proba_severe"] * y[E],
+            },
+            "Ia":{
+                "R":1/p["recovery_duration_asymptomatic"] * y[Ia],
+            },
+            "Im":{
+                "R":1/p["recovery_duration_mild"] * y[Im],
+            },
+            "Is":{
+                "ICU":1/p["symptoms_to_icu_duration"] * p["proba_icu"] * y[Is],
+                "H":1/p["symptoms_to_hospital_duration"] * (1 - p["proba_icu"]) * y[Is],
+            },
+            "ICU":{
+                "R":1/p["recovery_duration_icu"]  * y[ICU],
+                "D":1/p["death_duration_icu"] * y[ICU],
+            },
+            "H":{
+                "R":1/p["recovery_duration_hospital"] * y[H],
+                "D":1/p["death_duration_hospital"] * y[H],
+            }
+        }
 
     def contact_matrix(self, dimensions, get_vacations=False):
         vacations = "oui" if get_vacations else "non"
-        matrices = get_contact_matrices()[vacations]
+        matrices = load_contact_matrices(vacations)
+        keys = list(matrices.keys())
+
+        # Select all matrices or only the row of the category
         if dimensions == "all":
-            return lambda y, t: np.sum([self.make_callable(self.coeffs[k])(y,t)*matrices[k] for k in matrices.keys()], axis=0)
+            rows = slice(None)
+        else:
+            rows = next(i for i,x in enumerate(self.dimensions["category"]) if x==dimensions[0])
+        stacked = np.stack([matrices[k][rows] for k in keys])
+
+        # Precompute weighted sum if coefficients are constant over time
+        if all(not callable(self.coeffs[k]) and not isinstance(self.coeffs[k],dict) for k in keys):
+            weighted = np.tensordot([self.coeffs[k] for k in keys], stacked, axes=1)
+            return lambda y, t: weighted
 
         else:
-            dim = next(i for i,x in enumerate(self.dimensions["category"]) if x==dimensions[0])
-            return lambda y, t: np.sum([self.make_callable(self.coeffs[k])(y,t)*matrices[k][dim,:] for k in matrices.keys()], axis=0)
+            coeffs = [self.make_callable(self.coeffs[k]) for k in keys]
+
+            # A vector of times gives one matrix per time
+            def contacts(y, t):
+                if np.ndim(t) == 0:
+                    return np.tensordot([coeff(y,t) for coeff in coeffs], stacked, axes=1)
+                values = np.array([np.broadcast_to(coeff(y,t), np.shape(t)) for coeff in coeffs])
+                return np.tensordot(values, stacked, axes=([0],[0]))
+            return contacts
 
     def r0(self):
         beta = np.diag(self.params["beta"])
@@ -136,3 +207,9 @@ class COVID19Category(CompartmentalModel):
         vals = np.linalg.eigvals(g @ self.contact_matrix("all")(None, 0) @ beta)
 
         return np.max(vals)
+
+    def r0_next_generation(self,t = 0):
+        """Basic reproduction number derived from the transitions with the next generation matrix
+        Unlike r0(), symptomatic compartments are weighted by 1 - symptomatic_isolation as in the transitions
+        """
+        return self.reproduction_number(["E","Ia","Im","Is"],t = t)
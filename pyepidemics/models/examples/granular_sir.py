@@ -11,8 +11,8 @@ class GranularSIR(CompartmentalModel):
     
         def StoI(dimensions):
             beta,N,I,S = self.get(["beta","N","I","S"],dimensions)
-            C = self.get_contact_vector(dimensions)
-            return lambda y,t: beta *  (y[S] / N) * C.dot(y["I"])
+            position = self.dimensions_product.index(tuple(dimensions))
+            return lambda y,t: beta *  (y[S] / N) * self.contact_product(y,"I")[position]
 
         def ItoR(dimensions):
             gamma,I = self.get(["gamma","I"],dimensions)
@@ -2,7 +2,10 @@ from ..model import CompartmentalModel
 
 
 class SEIR(CompartmentalModel):
-    def __init__(self,N,beta,delta,gamma):
+    def __init__(self,N,beta,delta,gamma,symbolic = False):
+        """Classical SEIR Model, with symbolic = True transitions are written as symbolic expressions
+        compiled into a fused derivative, parameters are then bound at construction
+        """
 
         # Define compartments name and number
         compartments = ["S","E","I","R"]
@@ -15,7 +18,13 @@ class SEIR(CompartmentalModel):
         self.delta = delta # Incubation period = 1/delta
 
         # Add transitions
-        self.add_transition("S","E",lambda y,t: self.beta * y["I"] * y["S"]/self.N)
-        self.add_transition("E","I",lambda y,t: self.delta * y["E"])
-        self.add_transition("I","R",lambda y,t: self.gamma * y["I"])
+        if symbolic:
+            y = self.symbols
+            self.add_transition("S","E",self.param("beta",beta) * y["I"] * y["S"]/self.N)
+            self.add_transition("E","I",self.param("delta",delta) * y["E"])
+            self.add_transition("I","R",self.param("gamma",gamma) * y["I"])
+        else:
+            self.add_transition("S","E",lambda y,t: self.beta * y["I"] * y["S"]/self.N)
+            self.add_transition("E","I",lambda y,t: self.delta * y["E"])
+            self.add_transition("I","R",lambda y,t: self.gamma * y["I"])
 
@@ -2,13 +2,15 @@ from ..model import CompartmentalModel
 
 
 class SIR(CompartmentalModel):
-    def __init__(self,N:int,beta:float,gamma:float):
+    def __init__(self,N:int,beta:float,gamma:float,symbolic:bool = False):
         """Classical SIR Model
 
         Args:
             N (int): Population considered
             beta (float): How many person each person infects per day
             gamma (float): Rate of infection, ie duration = 1/gamma
+            symbolic (bool): write transitions as symbolic expressions, compiled into a fused derivative.
+                Parameters are then bound at construction and changing self.beta or self.gamma has no effect
         """
         
         # Define compartments name and number
@@ -21,8 +23,13 @@ class SIR(CompartmentalModel):
         self.gamma = self.make_callable(gamma) # Rate of infection, duration = 1/gamma
         
         # Add transition
-        self.add_transition("S","I",lambda y,t: self.beta(y,t) * y["S"] * y["I"] / self.N)
-        self.add_transition("I","R",lambda y,t: self.gamma(y,t) * y["I"])
+        if symbolic:
+            y = self.symbols
+            self.add_transition("S","I",self.param("beta",beta) * y["S"] * y["I"] / self.N)
+            self.add_transition("I","R",self.param("gamma",gamma) * y["I"])
+        else:
+            self.add_transition("S","I",lambda y,t: self.beta(y,t) * y["S"] * y["I"] / self.N)
+            self.add_transition("I","R",lambda y,t: self.gamma(y,t) * y["I"])
 
 
     def R0(self) -> float:
@@ -0,0 +1,230 @@
+"""Optional numba backend for compiled symbolic networks
+The fused code generated from symbolic transitions is compiled with numba, and the fixed step (rk4, euler)
+and tau-leaping loops run over the whole horizon without returning to Python:
+    - parameters values are evaluated in Python beforehand on all the times needed by the loop
+    - generated kernels read them from a vector p instead of calling the parameters
+Networks with lambda transitions or static derivatives, or environments without numba, use the NumPy path.
+"""
+
+import numpy as np
+
+from ..policies.schedules import Schedule
+from .symbolic import CodePrinter
+from .stochastic import _check_network
+
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    numba = None
+    HAS_NUMBA = False
+
+
+# Compiled kernels by generated source, shared by networks with the same structure
+_KERNELS = {}
+
+
+def _njit(printer,name,arguments,body):
+    fn = printer.function(name,arguments,body)
+    if fn.source not in _KERNELS:
+        _KERNELS[fn.source] = numba.njit(fn)
+    return _KERNELS[fn.source]
+
+
+
+class JitSystem:
+    def __init__(self,system):
+        """Numba kernels generated from a SymbolicSystem
+        Generates derivative(y,p) and rates(y,p,out) writing in out for a vector of compartments y and a vector of parameters values p
+        """
+        self.system = system
+        self.n = system.n
+        self.source = system.source
+        self.target = system.target
+
+        # Layout of the parameters values vector, vector parameters (e.g. contact rows) take one slot per element
+        self.params,self.sizes,self.offsets,slots = system.parameters()
+
+        # Kernels
+        printer = CodePrinter(system.compartments,slots = slots)
+        body = []
+        for e,flow in enumerate(system.flows):
+            body.append(f"    rates[{e}] = {printer.emit(flow)}")
+        body.append("    return rates")
+        self.rates = _njit(printer,"rates","y,p,rates",body)
+
+        printer = CodePrinter(system.compartments,slots = slots)
+        terms = [[] for _ in range(self.n)]
+        for e,flow in enumerate(system.flows):
+            code = printer.emit(flow)
+            terms[system.target[e]].append((1,code))
+            terms[system.source[e]].append((-1,code))
+        for i,expr in system.static:
+            terms[i].append((1,printer.emit(expr)))
+        body = [f"    dydt = np.zeros({self.n})"]
+        for i in range(self.n):
+            if len(terms[i]) > 0:
+                body.append(f"    dydt[{i}] = {system._accumulate(printer,terms[i])}")
+        body.append("    return dydt")
+        self.derivative = _njit(printer,"derivative","y,p",body)
+
+
+    def parameters(self,times):
+        """Values of all parameters on the given times, as an array of shape (times x slots)
+        Callables are first evaluated on all distinct times at once (schedules and vectorized functions),
+        and time by time if they do not return one value per time
+        """
+        times,inverse = np.unique(np.asarray(times,dtype = float),return_inverse = True)
+        values = np.empty((len(times),self.offsets[-1]))
+        for param,size,offset in zip(self.params,self.sizes,self.offsets):
+            if callable(param.value):
+                value = _evaluate(param.value,times,size)
+            else:
+                value = np.ravel(param.value)
+            values[:,offset:offset + size] = value
+        return values[inverse]
+
+
+
+def _evaluate(fn,times,size):
+    if isinstance(fn,Schedule):
+        return np.reshape(fn.evaluate(times),(-1,size))
+    try:
+        value = np.asarray(fn(None,times),dtype = float)
+        if value.shape == (len(times),size) or (size == 1 and value.shape == (len(times),)):
+            return value.reshape(-1,size)
+    except Exception:
+        pass
+    return np.reshape([fn(None,t) for t in times],(-1,size))
+
+
+
+def get_jit_system(network):
+    """JitSystem of a compiled network, None if numba is not installed or if transitions are not all symbolic
+    Parameters should only depend on time and return scalars or vectors
+    """
+    if not HAS_NUMBA or network.system is None:
+        return None
+    if not hasattr(network,"_jit"):
+        network._jit = JitSystem(network.system)
+    return network._jit
+
+
+
+if HAS_NUMBA:
+
+    @numba.njit
+    def _rk4_loop(derivative,y,h,p0,pm,p1,record,n_records):
+        states = np.empty((n_records,len(y)))
+        states[0] = y
+        j = 1
+        for k in range(len(h)):
+            k1 = derivative(y,p0[k])
+            k2 = derivative(y + h[k]/2 * k1,pm[k])
+            k3 = derivative(y + h[k]/2 * k2,pm[k])
+            k4 = derivative(y + h[k] * k3,p1[k])
+            y = y + h[k]/6 * (k1 + 2*k2 + 2*k3 + k4)
+            if record[k]:
+                states[j] = y
+                j += 1
+        return states
+
+
+    @numba.njit
+    def _euler_loop(derivative,y,h,p0,record,n_records):
+        states = np.empty((n_records,len(y)))
+        states[0] = y
+        j = 1
+        for k in range(len(h)):
+            y = y + h[k] * derivative(y,p0[k])
+            if record[k]:
+                states[j] = y
+                j += 1
+        return states
+
+
+    @numba.njit
+    def _tau_leap_loop(rates,y,p,source,target,n_days,steps,dt,seed):
+        np.random.seed(seed)
+        n_runs,n = y.shape
+        n_edges = len(source)
+        trajectories = np.empty((n_days + 1,n_runs,n))
+        trajectories[0] = y
+        rate = np.empty(n_edges)
+        events = np.empty(n_edges)
+        outflow = np.empty(n)
+
+        for day in range(n_days):
+            for step in range(steps):
+                values = p[day * steps + step]
+                for r in range(n_runs):
+
+                    # Draw firings for each transition
+                    rates(y[r],values,rate)
+                    for e in range(n_edges):
+                        events[e] = np.random.poisson(rate[e] * dt) if rate[e] > 0 else 0.0
+
+                    # Avoid negative populations by scaling down the firings out of each compartment
+                    outflow[:] = 0
+                    for e in range(n_edges):
+                        outflow[source[e]] += events[e]
+                    for e in range(n_edges):
+                        i = source[e]
+                        if outflow[i] > y[r,i]:
+                            events[e] = np.floor(events[e] * y[r,i] / outflow[i])
+
+                    for e in range(n_edges):
+                        y[r,source[e]] -= events[e]
+                        y[r,target[e]] += events[e]
+
+            trajectories[day + 1] = y
+
+        return trajectories
+
+
+
+def integrate_fixed_step(system,y0,t,method = "rk4",step = 0.1):
+    """Fixed step integration on the time grid t with numba kernels, same steps as solvers.integrate_fixed_step
+
+    Args:
+        system (JitSystem): kernels of the compiled network
+        y0 (np.ndarray): initial state
+        t (np.ndarray): time grid where to record the states
+        method (str): "rk4" or "euler"
+        step (float): maximum length of a sub step
+
+    Returns:
+        np.ndarray: states of shape (time x compartments)
+    """
+    # Sub steps of each interval of the grid, the state is recorded at the end of each interval
+    starts,h,record = [],[],[]
+    for i in range(len(t) - 1):
+        n_steps = max(1,int(np.ceil((t[i+1] - t[i]) / step - 1e-9)))
+        length = (t[i+1] - t[i]) / n_steps
+        starts.extend(t[i] + np.arange(n_steps) * length)
+        h.extend([length] * n_steps)
+        record.extend([False] * (n_steps - 1) + [True])
+    starts,h,record = np.array(starts,dtype = float),np.array(h,dtype = float),np.array(record,dtype = bool)
+
+    y0 = np.asarray(y0,dtype = float)
+    if method == "rk4":
+        return _rk4_loop(system.derivative,y0,h,system.parameters(starts),system.parameters(starts + h/2),system.parameters(starts + h),record,len(t))
+    return _euler_loop(system.derivative,y0,h,system.parameters(starts),record,len(t))
+
+
+def tau_leap(system,y0,n_days,n_runs = 100,dt = 0.1,rng = None):
+    """Tau-leaping simulation with numba kernels, see stochastic.tau_leap
+    Runs are simulated one after the other inside the compiled loop, the seed of numba's generator is drawn from rng
+
+    Returns:
+        np.ndarray: populations of shape (days x compartments x runs)
+    """
+    _check_network(system.system)
+    rng = np.random.default_rng() if rng is None else rng
+    steps = int(round(1/dt))
+    dt = 1/steps
+
+    y = np.repeat(np.asarray(y0,dtype = float)[None,:],n_runs,axis = 0)
+    p = system.parameters(np.arange(n_days * steps) * dt)
+    trajectories = _tau_leap_loop(system.rates,y,p,system.source,system.target,n_days,steps,dt,int(rng.integers(2**31)))
+    return trajectories.transpose(0,2,1)
@@ -8,27 +8,65 @@ def ipython_info():
         ip = 'terminal'
     return ip
 
+import copy
+import types
 import numpy as np
 import time
 import pandas as pd
 import matplotlib.pyplot as plt
 import itertools
 from scipy.integrate import odeint
+from scipy import sparse
 if ipython_info() == "notebook":
     from tqdm import tqdm_notebook as tqdm
 else:
     from tqdm import tqdm
 
 # Custom library
-from .state import State
-from .states import CompartmentStates
-from .network import CompartmentNetwork
-from ..params.metrics import custom_loss
+from .state import State, ArrayState
+from .states import CompartmentStates, ArrayStates, BatchStates, ResumedStates
+from .network import CompartmentNetwork, CompiledNetworkBatch
+from .stochastic import tau_leap, gillespie
+from .solvers import integrate, integrate_windows, FIXED_STEP_SOLVERS
+from . import jit as jit_backend
+from .contact import ContactOperator, ContactMatrices
+from .symbolic import Expr, Param, Symbols, next_generation_matrix
+from ..params.metrics import custom_loss, ObservationLoss
+from optuna.exceptions import TrialPruned
 from ..params.optimizer import ParamsOptimizer
-from ..policies.utils import multiple_sigmoid_response
+from ..policies.schedules import Schedule, PiecewiseSchedule, SigmoidSchedule
             
 
 
+def _collect_breakpoints(obj,breakpoints,seen):
+    """Add the breakpoints of the schedules found in obj to the set breakpoints
+    Containers, symbolic expressions and the variables captured by functions are searched recursively,
+    visited objects are kept in the dict seen by id
+    """
+    if id(obj) in seen:
+        return
+    seen[id(obj)] = obj
+
+    if isinstance(obj,Schedule):
+        breakpoints.update(np.asarray(obj.breakpoints,dtype = float).tolist())
+    elif isinstance(obj,dict):
+        _collect_breakpoints(list(obj.values()),breakpoints,seen)
+    elif isinstance(obj,(list,tuple,set)):
+        for item in obj:
+            _collect_breakpoints(item,breakpoints,seen)
+    elif isinstance(obj,Param):
+        _collect_breakpoints(obj.value,breakpoints,seen)
+    elif isinstance(obj,Expr):
+        _collect_breakpoints(list(obj.params),breakpoints,seen)
+    elif isinstance(obj,types.FunctionType) and obj.__closure__ is not None:
+        for cell in obj.__closure__:
+            try:
+                _collect_breakpoints(cell.cell_contents,breakpoints,seen)
+            except ValueError:
+                pass
+
+
+
 class CompartmentalModel:
 
 
@@ -116,32 +154,69 @@ class CompartmentalModel:
         return pd.MultiIndex.from_product(self.states,*self.dimensions.values())
 
 
-    @staticmethod
-    def make_callable(value):   
-        if callable(value):
-            return value
+    @property
+    def breakpoints(self):
+        """Sorted times where time varying parameters are not smooth
+        Schedules returned by make_callable carry their breakpoints, they are collected in the model attributes,
+        the transitions and the variables captured by transitions functions (e.g. a schedule used in a lambda)
+        """
+        objects = [self.__dict__]
+        if "network" in self.__dict__:
+            objects += [list(self.network.graph.edges(data = "transition")),self.network.static]
+        breakpoints = set()
+        _collect_breakpoints(objects,breakpoints,{})
+        return np.array(sorted(breakpoints))
+
 
-        elif isinstance(value, dict):
+    @staticmethod
+    def make_callable(value):
+        """Convert a parameter into a callable with signature fn(y,t)
+            - callables and schedules are returned as is
+            - dictionaries {"dates":[...],"values":[...]} are converted to piecewise constant schedules
+            - other values are considered constant
+        Schedules carry their breakpoints as attribute, they are collected by .solve() so the solver can stop there
+        """
+        if isinstance(value,dict):
             assert "dates" in value.keys() and "values" in value.keys(), "You provided a dictionnary as values, it shouldhave two keys: dates and values"
-            return lambda y,t : value["values"][next(i for i,x in enumerate(value["dates"] + [np.infty]) if x>=t)-1]
+            return PiecewiseSchedule(value["dates"],value["values"])
+
+        elif callable(value):
+            return value
         
         else:
             return lambda y,t : value
 
     
-    def solve(self,n_days = 100,init_state = None,start_date = None,d = 1):
+    def solve(self,n_days = 100,init_state = None,start_date = None,d = 1,solver = "odeint",rtol = None,atol = None,dense_output = False,step = 0.1,checkpoints = None,as_array = False,t_eval = None,outputs = None,jit = False):
         """Main ODE solver function to predict future population values in each compartments
         The function will use the network created by transitions between compartments
             - Derivatives are computed using transitions 
-            - ODE system is integrated using scipy odeint solver
+            - If the model was compiled with .compile(), derivatives are computed on raw arrays
+            - Compiled models with symbolic transitions use a single generated derivative function,
+              with jit = True fixed step solvers run it with numba over the whole horizon if numba is installed
+            - ODE system is integrated using scipy odeint solver by default, or another solver backend
+            - Compiled models give a sparse Jacobian to the solver, estimated on groups of independent compartments
+            - The solver stops at breakpoints of time varying parameters to avoid steps across discontinuities
+        Statistics of the last solve (derivative evaluations, wall time) are stored in the solver_stats attribute
         
         Args:
             init_state (dict, list, tuple, numpy array): the first value to initialize the solver, ie init population
             n_days (int): number of days on which to run the solver, ie prediction horizon
             start_date (str or datetime): use real dates instead of just number of days
+            solver (str): "odeint", solve_ivp methods ("RK45","RK23","DOP853","LSODA","BDF","Radau") or fixed step ("rk4","euler")
+            rtol (float): relative tolerance for adaptive solvers
+            atol (float): absolute tolerance for adaptive solvers
+            dense_output (bool): keep a continuous solution in solver_stats["dense_output"], only for solve_ivp methods
+            step (float): maximum step length in days for fixed step solvers
+            checkpoints (list): days (or dates if start_date is given) where to store the full state vector for .resume()
+            as_array (bool): return a lightweight ArrayStates instead of building the pd.DataFrame
+            t_eval (list): only record these days (or dates if start_date is given), n_days and d are then ignored
+            outputs (list): only record these compartments or aggregated states (e.g. ["D","H","ICU"])
+            jit (bool): use the numba backend with "rk4" or "euler" solvers, the model is compiled if needed.
+                The NumPy path is used if numba is not installed or if the transitions are not symbolic, solver_stats["jit"] tells which one was used
 
         Returns:
-            states (States) - a custom pd.DataFrame with population by compartment over time
+            states (States) - a custom pd.DataFrame with population by compartment over time, or ArrayStates if as_array
         """
 
         # If init state is not given we use I0
@@ -158,41 +233,384 @@ class CompartmentalModel:
         assert len(init_state) == len(self.compartments)
         # assert hasattr(self,"N")
         # assert np.abs(init_state.sum() - self.N) < tol,f"Init state {init_state.values} does not sum to total population {self.N}"
-        assert n_days > self.offset
- 
         # Grid of time points (in days)
         # Take offset into account
         offset = self.offset
-        t = np.linspace(0, n_days - offset, (n_days - offset +1)*d)
+        if self.start_date is not None:
+            start_date = self.start_date
+
+        if t_eval is None:
+            assert n_days > offset
+            t = np.linspace(0, n_days - offset, (n_days - offset +1)*d)
+        else:
+            # Integrate only up to the requested days, adaptive solvers choose their own steps in between
+            if start_date is not None:
+                t_eval = (pd.to_datetime(t_eval) - pd.to_datetime(start_date)) / pd.Timedelta(days = 1)
+            days = np.asarray(t_eval)
+            t = np.unique(np.append(np.clip(days - offset,0,None),0))
 
         # Integrate the model equations over the time grid, t.
-        states = odeint(self.derivative, init_state, t)
+        # Compiled models provide the Jacobian sparsity to the solver
+        jacobian = {}
+        if self.compiled:
+            jacobian = {"jac":self.network.compiled.jacobian,"jac_sparsity":self.network.compiled.jacobian_sparsity()}
+
+        # Numba kernels integrate fixed step solvers without returning to Python
+        system = None
+        if jit and solver in FIXED_STEP_SOLVERS:
+            if not self.compiled:
+                self.compile()
+            system = jit_backend.get_jit_system(self.network.compiled)
+
+        if system is not None:
+            start = time.time()
+            states = jit_backend.integrate_fixed_step(system,init_state.values,t,method = solver,step = step)
+            self.solver_stats = {"solver":solver,"time":time.time() - start}
+        else:
+            states,self.solver_stats = integrate(self.derivative,init_state.values,t,solver = solver,rtol = rtol,atol = atol,dense_output = dense_output,step = step,tcrit = self.breakpoints,**jacobian)
+        self.solver_stats["jit"] = system is not None
 
-        # Converts to DataFrame and then to custom object
-        states = pd.DataFrame(states,columns = self.compartments)
-        if d > 1: 
-            states.index = states.index / d
+        if t_eval is None:
 
-        # Add offset into account
-        if offset > 0:
-            states.index = range(offset,n_days + 1)
-            states = states.reindex(range(0,n_days + 1))
-            states = states.fillna(method = "bfill")
-        elif offset < 0:
-            states.index = [x + offset for x in states.index]
+            # Days index of the solver output
+            days = np.arange(len(t)) / d if d > 1 else np.arange(len(t))
+
+            # Add offset into account, first values are backfilled with the initial state
+            if offset > 0:
+                states = np.concatenate([np.repeat(states[:1],offset,axis = 0),states])
+                days = np.arange(0,n_days + 1)
+            elif offset < 0:
+                days = days + offset
+        else:
+            # Requested days before the offset are backfilled with the initial state
+            states = states[np.searchsorted(t,np.clip(days - offset,0,None))]
+
+        # If start date is given, convert to dates
+        index = days
+        if start_date is not None:
+            index = pd.to_datetime(start_date) + pd.TimedeltaIndex(days,unit = "D")
 
         # Convert to custom object
-        states = CompartmentStates(states)
+        states = ArrayStates(states,self.compartments,index = index,states = self.states)
+
+        # Store full state vectors at checkpoints with their integration time
+        for checkpoint in (checkpoints or []):
+            if start_date is not None:
+                checkpoint = pd.to_datetime(checkpoint)
+            position = states.index.get_loc(checkpoint)
+            assert days[position] >= offset,f"Checkpoint {checkpoint} is before the offset of the model"
+            states.add_checkpoint(checkpoint,states.values[position],days[position] - offset)
+
+        # Keep only requested compartments and aggregated states
+        if outputs is not None:
+            values = np.stack([states.array(output) for output in outputs],axis = 1)
+            restricted = ArrayStates(values,outputs,index = states.index)
+            restricted.checkpoints = states.checkpoints
+            states = restricted
+
+        if not as_array:
+            states = states.to_frame()
+            
+        return states
+
+
+    def resume(self,from_states,t0,n_days = None,overrides = None,**kwargs):
+        """Integrate only the tail of a trajectory from one of its checkpoints
+        This is useful to compare scenarios which differ only after a given day, e.g. lockdown end dates
+
+        Args:
+            from_states (CompartmentStates): base trajectory returned by .solve(checkpoints = [...])
+            t0 (int or datetime): checkpoint from which to resume
+            n_days (int): number of days to integrate after t0, defaults to the end of the base trajectory
+            overrides (dict): parameters of the scenario given to .reset(), the current model is left untouched
+            **kwargs: solver options given to .solve()
+
+        Returns:
+            states (ResumedStates) - lazy concatenation of the base trajectory until t0 and the resumed tail
+        """
+
+        # Prepare the scenario model
+        model = self
+        if overrides is not None:
+            model = copy.copy(self)
+            model.reset(overrides)
+            if self.compiled:
+                model.compile()
+
+        # Get checkpoint and prepare time grid in integration time
+        if isinstance(from_states.index,pd.DatetimeIndex):
+            t0 = pd.to_datetime(t0)
+        y0,start = from_states.get_checkpoint(t0)
+        position = from_states.index.get_loc(t0)
+        if n_days is None:
+            n_days = len(from_states) - 1 - position
+        t = start + np.arange(0,n_days + 1)
+
+        # Integrate the tail
+        jacobian = {}
+        if model.compiled:
+            jacobian = {"jac":model.network.compiled.jacobian,"jac_sparsity":model.network.compiled.jacobian_sparsity()}
+        states,model.solver_stats = integrate(model.derivative,y0,t,tcrit = model.breakpoints,**jacobian,**kwargs)
+
+        # Convert to custom object with the same index type as the base trajectory
+        if isinstance(from_states.index,pd.DatetimeIndex):
+            index = t0 + pd.TimedeltaIndex(np.arange(0,n_days + 1),unit = "D")
+        else:
+            index = t0 + np.arange(0,n_days + 1)
+        states = CompartmentStates(states,columns = self.compartments,index = index)
         states.build_aggregates(self.states)
+        states.add_checkpoint(t0,y0,start)
+
+        return ResumedStates(from_states,states)
+
+
+    def solve_chunks(self,t_eval,chunk_size = 20,init_state = None,start_date = None,outputs = None,**kwargs):
+        """Integrate the ODE system on successive windows of chunk_size days
+        After each window the trajectory recorded so far is yielded, so the caller can stop the integration early,
+        e.g. to prune a calibration trial. The solver is not restarted between windows but resumes from its current
+        step (see solvers.integrate_windows), a trajectory integrated until the end costs about the same as .solve()
+
+        Args:
+            t_eval (list): days (or dates if start_date is given) to record
+            chunk_size (int): length of the windows in days
+            init_state (dict, list, tuple, numpy array): the first value to initialize the solver, ie init population
+            start_date (str or datetime): use real dates instead of just number of days
+            outputs (list): only record these compartments or aggregated states
+            **kwargs: solver options (solver, rtol, atol, step)
+
+        Yields:
+            states (ArrayStates) - trajectory on the days of t_eval until the end of the current window
+        """
+
+        # Initial state as in .solve()
+        if init_state is None:
+            assert self.start_state is not None
+            init_state = int(self.I0)
+        init_state = self.make_state(init_state)
+
+        # Days of each recorded point in model time
+        if self.start_date is not None:
+            start_date = self.start_date
+        if start_date is not None:
+            t_eval = pd.to_datetime(t_eval)
+            days = ((t_eval - pd.to_datetime(start_date)) / pd.Timedelta(days = 1)).values
+        else:
+            t_eval = np.asarray(t_eval)
+            days = t_eval
+
+        # Time grid in integration time, days before the offset are backfilled with the initial state and belong to the first window
+        offset = self.offset
+        t = np.unique(np.append(np.clip(days - offset,0,None),0))
+        rows = np.searchsorted(t,np.clip(days - offset,0,None))
+        windows = np.clip(days - offset,0,None) // chunk_size
+        ends = [rows[windows == window].max() for window in np.unique(windows)]
+
+        jacobian = {}
+        if self.compiled:
+            jacobian = {"jac":self.network.compiled.jacobian,"jac_sparsity":self.network.compiled.jacobian_sparsity()}
+
+        # Yield the trajectory recorded so far at the end of each window
+        for y,self.solver_stats in integrate_windows(self.derivative,init_state.values,t,ends,tcrit = self.breakpoints,**jacobian,**kwargs):
+            n = np.searchsorted(rows,len(y))
+            states = ArrayStates(y[rows[:n]],self.compartments,index = t_eval[:n],states = self.states)
+            if outputs is not None:
+                states = ArrayStates(np.stack([states.array(output) for output in outputs],axis = 1),outputs,index = states.index)
+            yield states
+
+
+    def solve_sensitivities(self,params,names,t_eval,init_state = None,start_date = None,eps = 1e-6,**kwargs):
+        """Solve the ODE system with forward sensitivities of the states to some parameters
+        Sensitivities S = dy/dp follow dS/dt = J(y,t) S + df/dp(y,t) and are integrated together with the states.
+        The model and its copies are compiled, J is the Jacobian of the compiled network (analytic for symbolic transitions).
+        Parameters are only known through the custom .reset() function, so df/dp is estimated by finite differences
+        on compiled copies of the model reset with each perturbed parameter. The model is left reset with params and compiled.
+        Integer parameters (e.g. the offset) do not change the derivatives and have zero sensitivities.
+
+        Args:
+            params (dict): parameters as given to .reset()
+            names (list): parameters for which to compute sensitivities
+            t_eval (list): days (or dates if start_date is given) to record
+            init_state (dict, list, tuple, numpy array): the first value to initialize the solver, ie init population
+            start_date (str or datetime): use real dates instead of just number of days
+            eps (float): relative step of finite differences
+            **kwargs: solver options given to the integration backend
+
+        Returns:
+            states (ArrayStates) - population by compartment on t_eval
+            sensitivities (np.ndarray) - derivatives of the states by parameter of shape (time x compartment x parameter)
+        """
+
+        # Base compiled network and one perturbed copy per parameter
+        perturbed = []
+        for name in names:
+            h = eps * max(1,abs(params[name]))
+            model = copy.copy(self)
+            model.reset({**params,name:params[name] + h})
+            perturbed.append((model.compile().network.compiled,h))
+        self.reset(params)
+        network = self.compile().network.compiled
+
+        # Initial state does not depend on parameters
+        if init_state is None:
+            init_state = int(self.I0)
+        y0 = self.make_state(init_state).values
+        n,n_params = len(y0),len(names)
+
+        # Days of each recorded point in integration time
+        offset = self.offset
+        if self.start_date is not None:
+            start_date = self.start_date
+        if start_date is not None:
+            t_eval = pd.to_datetime(t_eval)
+            days = ((t_eval - pd.to_datetime(start_date)) / pd.Timedelta(days = 1)).values
+        else:
+            days = np.asarray(t_eval)
+        t = np.unique(np.append(np.clip(days - offset,0,None),0))
+
+        def derivative(z,t):
+            y,S = z[:n],z[n:].reshape(n,n_params)
+            dSdt = network.jacobian(y,t) @ S
+            dydt = network.derivative(y,t)
+            for j,(perturbed_network,h) in enumerate(perturbed):
+                dSdt[:,j] += (perturbed_network.derivative(y,t) - dydt) / h
+            return np.concatenate([dydt,dSdt.ravel()])
+
+        z0 = np.concatenate([y0,np.zeros(n * n_params)])
+        z,self.solver_stats = integrate(derivative,z0,t,tcrit = self.breakpoints,**kwargs)
+
+        # Requested days before the offset are backfilled with the initial state
+        z = z[np.searchsorted(t,np.clip(days - offset,0,None))]
+        states = ArrayStates(z[:,:n],self.compartments,index = t_eval,states = self.states)
+        sensitivities = z[:,n:].reshape(len(z),n,n_params)
+        return states,sensitivities
+
+
+    def solve_batch(self,params_list,n_days = 100,init_state = None,start_date = None,batch_size = None):
+        """Solve the ODE system for many sets of parameters at once
+        Each set of parameters gives a compiled copy of the model using the custom .reset() function,
+        then all samples are stacked in a single (samples x compartments) state and integrated together.
+        Offsets of each sample are applied afterwards by shifting its trajectory on the days grid.
+
+        Args:
+            params_list (list of dict): sets of parameters as given to .reset()
+            n_days (int): number of days on which to run the solver, ie prediction horizon
+            init_state (dict, list, tuple, numpy array): the first value to initialize the solver, ie init population
+            start_date (str or datetime): use real dates instead of just number of days
+            batch_size (int): max number of samples integrated in the same ODE system, defaults to all samples
+
+        Returns:
+            states (BatchStates) - population by time x compartment x sample in a single numpy array
+        """
+
+        # Prepare one compiled model per set of parameters
+        # The current model is left untouched
+        models = []
+        for params in params_list:
+            model = copy.copy(self)
+            model.reset(params)
+            models.append(model.compile())
+
+        # Initial states and offsets for each sample
+        if init_state is None:
+            init_state = int(self.I0)
+        y0 = np.array([model.make_state(init_state).values for model in models],dtype = float)
+        offsets = np.array([model.offset for model in models])
+        assert n_days > offsets.max()
+
+        # Grid of time points common to all samples
+        horizon = n_days - min(offsets.min(),0)
+        t = np.arange(0,horizon + 1)
+        days = np.arange(0,n_days + 1)
+
+        # Integrate by batches of samples
+        # Jacobian is block diagonal as samples are independent, hence banded with a bandwidth of one sample
+        n = len(self.compartments)
+        batch_size = len(models) if batch_size is None else batch_size
+        values = np.empty((len(days),n,len(models)))
+
+        for start in range(0,len(models),batch_size):
+            end = min(start + batch_size,len(models))
+            network = CompiledNetworkBatch([model.network.compiled for model in models[start:end]])
+            tcrit = sorted(set().union(*[model.breakpoints for model in models[start:end]]))
+            states = odeint(network.derivative,y0[start:end].ravel(),t,ml = n - 1,mu = n - 1,tcrit = tcrit or None)
+            states = states.reshape(len(t),end - start,n)
+
+            # Shift each sample by its offset, first values are backfilled with the initial state
+            for k in range(end - start):
+                positions = np.clip(days - offsets[start + k],0,horizon)
+                values[:,:,start + k] = states[positions,k,:]
 
         # If start date is given, convert to dates
+        index = days
         if self.start_date is not None:
             start_date = self.start_date
         if start_date is not None:
-            index = pd.to_datetime(start_date) + pd.TimedeltaIndex(states.index,unit = "D")
-            states.index = index
-            
-        return states
+            index = pd.to_datetime(start_date) + pd.TimedeltaIndex(days,unit = "D")
+
+        return BatchStates(values,self.compartments,index = index,states = self.states)
+
+
+    def solve_stochastic(self,n_days = 100,init_state = None,start_date = None,method = "tau_leap",n_runs = 100,dt = 0.1,seed = None,jit = False):
+        """Stochastic simulation of the model using the transitions as propensities
+        This is meaningful for small populations where the ODE solution is not representative
+            - "tau_leap" draws Poisson firings for each transition on steps of length dt
+            - "gillespie" is the exact algorithm, one event at a time, meant for small populations
+        All runs are simulated at once, transitions functions should therefore accept vectors of populations
+
+        Args:
+            n_days (int): number of days on which to run the simulation, ie prediction horizon
+            init_state (dict, list, tuple, numpy array): the first value to initialize the simulation, rounded to integers
+            start_date (str or datetime): use real dates instead of just number of days
+            method (str): "tau_leap" or "gillespie"
+            n_runs (int): number of independent realizations
+            dt (float): leap duration in days for tau leaping
+            seed (int): seed of the random generator for reproducible runs
+            jit (bool): run tau leaping with the numba backend, the NumPy path is used if numba is not installed
+                or if the transitions are not symbolic
+
+        Returns:
+            states (BatchStates) - population by time x compartment x run, use .quantile() for summaries
+        """
+        assert method in ["tau_leap","gillespie"]
+
+        # Stochastic engines work on the compiled network
+        if not self.compiled:
+            self.compile()
+
+        # If init state is not given we use I0
+        if init_state is None:
+            assert self.start_state is not None
+            init_state = int(self.I0)
+        y0 = np.round(self.make_state(init_state).values)
+
+        # Simulate all runs
+        offset = self.offset
+        assert n_days > offset
+        horizon = n_days - min(offset,0)
+        rng = np.random.default_rng(seed)
+        system = jit_backend.get_jit_system(self.network.compiled) if jit and method == "tau_leap" else None
+        if system is not None:
+            trajectories = jit_backend.tau_leap(system,y0,horizon,n_runs = n_runs,dt = dt,rng = rng)
+        elif method == "tau_leap":
+            trajectories = tau_leap(self.network.compiled,y0,horizon,n_runs = n_runs,dt = dt,rng = rng)
+        else:
+            trajectories = gillespie(self.network.compiled,y0,horizon,n_runs = n_runs,rng = rng)
+
+        # Take offset into account, first values are backfilled with the initial state
+        days = np.arange(0,n_days + 1)
+        trajectories = trajectories[np.clip(days - offset,0,horizon)]
+
+        # Store populations with the smallest integer type
+        trajectories = trajectories.astype(np.min_scalar_type(int(trajectories.max())))
+
+        # If start date is given, convert to dates
+        index = days
+        if self.start_date is not None:
+            start_date = self.start_date
+        if start_date is not None:
+            index = pd.to_datetime(start_date) + pd.TimedeltaIndex(days,unit = "D")
+
+        return BatchStates(trajectories,self.compartments,index = index,states = self.states)
 
 
     def make_state(self,y):
@@ -281,8 +699,29 @@ class CompartmentalModel:
 
         return d
 
+    def compile(self):
+        """Compile the transitions network into integer index arrays for fast derivatives
+        Once compiled, derivatives are computed on raw numpy arrays without creating State objects
+        and .solve() uses it automatically. Adding a transition afterwards falls back to the default path
+        until the model is compiled again.
+
+        Returns:
+            self (CompartmentalModel): the compiled model to allow chaining, e.g. model.compile().solve()
+        """
+        self.network.compile(self.compartments)
+        return self
+
+    @property
+    def compiled(self):
+        return self.network.compiled is not None
+
+
     def derivative(self,y,t):
 
+        # Use compiled network if available
+        if self.compiled:
+            return self.network.compiled.derivative(y,t)
+
         # Transform init_state into state object
         # This is already done in .solve() method but scipy odeint convert it to numpy array
         y = self.make_state(y)
@@ -332,6 +771,77 @@ class CompartmentalModel:
                         self.network.add_transition(start_node,end_node,transition)
     
 
+    @property
+    def symbols(self):
+        """Symbolic state to write transitions as expressions instead of lambdas, e.g. self.symbols["S"]
+        Models where all transitions are expressions are compiled into a fused derivative with an analytic Jacobian
+        """
+        if "_symbols" not in self.__dict__:
+            self._symbols = Symbols(self.compartments)
+        return self._symbols
+
+
+    def param(self,name,value,size = None):
+        """Symbolic parameter to use in transitions expressions
+        Values are converted with make_callable except constants which are kept as is
+
+        Args:
+            name (str): name of the parameter
+            value (float, dict, callable): constant, {"dates":[...],"values":[...]} or callable fn(y,t) depending only on time
+            size (int): if the callable returns a vector, returns an object array of its elements
+
+        Returns:
+            Param: expression of the parameter, or np.ndarray of expressions if size is given
+        """
+        if callable(value) or isinstance(value,dict):
+            value = self.make_callable(value)
+        param = Param(name,value)
+        if size is None:
+            return param
+        vector = np.empty(size,dtype = object)
+        vector[:] = [param[i] for i in range(size)]
+        return vector
+
+
+    def next_generation_matrix(self,infected,t = 0,state = None):
+        """Next generation matrix derived from the transitions at the disease free state
+        New infections are the transitions entering an infected compartment from a non infected one
+        Symbolic transitions are differentiated exactly, lambda transitions by finite differences
+
+        Args:
+            infected (list): infected states or compartments, e.g. ["E","I"]
+            t (int): time at which time dependent parameters are evaluated
+            state (dict, list, np.ndarray): disease free state, defaults to the whole population in the initial state
+
+        Returns:
+            pd.DataFrame: next generation matrix with infected compartments as index and columns
+        """
+        infected = [c for c in self.compartments if c in infected or c.split("_")[0] in infected]
+        edges = list(self.network.graph.edges(data = "transition"))
+
+        if state is None:
+            state = self.make_init_state(self.initial_state)
+        y = ArrayState(self.compartments,self.make_state(state).values.astype(float))
+
+        position = {c:i for i,c in enumerate(self.compartments)}
+        K = next_generation_matrix(
+            self.compartments,
+            [transition for _,_,transition in edges],
+            [position[start] for start,_,_ in edges],
+            [position[end] for _,end,_ in edges],
+            infected,y,t,
+        )
+        return pd.DataFrame(K,index = infected,columns = infected)
+
+
+    def reproduction_number(self,infected,t = 0,state = None):
+        """Basic reproduction number as the spectral radius of the next generation matrix
+        See .next_generation_matrix() for arguments
+        """
+        K = self.next_generation_matrix(infected,t = t,state = state)
+        return np.max(np.abs(np.linalg.eigvals(K.values)))
+
+
     def show_network(self,**kwargs):
         self.network.show(**kwargs)
 
@@ -358,7 +868,12 @@ class CompartmentalModel:
 
 
     def prepare_contact_matrix(self,contact):
-
+        """Prepare contact matrices by dimension and the contact operator between all dimensions
+        The operator in self.contact["operator"] keeps one factor per dimension (Kronecker product) and is never
+        materialized as a dense matrix, the dense pd.DataFrame self.contact["all"] is only built if it is accessed.
+        Missing dimensions are supposed without contact, ie identity matrix.
+        Matrices can be given as lists, numpy arrays, DataFrames or scipy sparse matrices.
+        """
 
         if contact is not None:
             # Safety checks
@@ -368,9 +883,8 @@ class CompartmentalModel:
         else:
             contact = {}
 
-
-        # Matrix as dataframes
-        matrices_np = []
+        # Matrices as dataframes by dimension
+        factors = []
         for key in self.granularity:
 
             # Prepare individual matrix index and shape
@@ -378,34 +892,45 @@ class CompartmentalModel:
 
             # If there is a contact matrix
             # If there is not we suppose no contact ie, identity matrix
-            matrix = contact[key] if key in contact else np.identity(len(index))
+            matrix = contact[key] if key in contact else sparse.identity(len(index),format = "csr")
             
             # Convert to numpy if not the case and add to list and dictionary
-            if not isinstance(matrix,np.ndarray): matrix = np.array(matrix)
-            matrices_np.append(matrix)
-            contact[key] = pd.DataFrame(matrix,index = index,columns = index)
+            if not sparse.issparse(matrix):
+                matrix = np.array(matrix)
+                contact[key] = pd.DataFrame(matrix,index = index,columns = index)
+            else:
+                contact[key] = matrix
+            factors.append(matrix)
 
-        if len(matrices_np) > 1:
-    
-            # Create master matrix
-            dim = np.product([len(x) for x in matrices_np])
-            shape = (dim,dim)
-            matrix = np.multiply.outer(*matrices_np).swapaxes(1,2).reshape(*shape)
-            index = ["_".join(x) for x in self.dimensions_product]
-            matrix = pd.DataFrame(matrix,index = index,columns = index)
-            contact["all"] = matrix
+        # Create master contact operator
+        index = ["_".join(x) for x in self.dimensions_product]
+        self.contact = ContactMatrices(contact,ContactOperator(factors),index)
 
-        else:
-            contact["all"] = contact[key].copy()
 
-        # Store as attribute
-        self.contact = contact
+    def get_contact_vector(self,dimensions):
+        position = self.dimensions_product.index(tuple(dimensions))
+        return self.contact["operator"].row(position)
 
 
-    def get_contact_vector(self,dimensions):
-        key = "_".join(dimensions)
-        return self.contact["all"].loc[key].values
+    def contact_product(self,y,state = "I"):
+        """Product of the contact operator with the vector of a state for all dimensions at once
+        The result is cached on the state for the derivative evaluation (ie for the time step),
+        so all transitions share a single batched product instead of one row product each
 
+        Args:
+            y (State or ArrayState): state vector given to transitions
+            state (str): state on which to apply contacts, e.g. "I"
+
+        Returns:
+            np.ndarray: contacts by dimensions combination, in the order of dimensions_product
+        """
+        cache = getattr(y,"cache",None)
+        if cache is None:
+            return self.contact["operator"].dot(y[state])
+        key = ("contact",state)
+        if key not in cache:
+            cache[key] = self.contact["operator"].dot(y[state])
+        return cache[key]
 
 
 
@@ -421,18 +946,34 @@ class CompartmentalModel:
 
 
 
-    def objective(self,true,params,init_state = None,constraint = None,return_dict = False):
+    def objective(self,true,params,init_state = None,constraint = None,return_dict = False,loss = None,trial = None,chunk_size = None):
 
         # Reset model with params
         # Exception will be raised if no custom reset function is implemented
         self.reset(params)
 
-        # Make prediction
-        states = self.predict(true,init_state = init_state)
+        # Pass an ObservationLoss prepared once to avoid rebuilding observations at each trial
+        if not isinstance(loss,ObservationLoss):
+            loss = ObservationLoss(true,loss = "mse" if loss is None else loss)
 
-        # Compute and return loss
-        cols = true.columns.tolist()
-        loss,loss_dict = custom_loss(states.loc[true.index],true,cols = cols)
+        if trial is not None and chunk_size is not None:
+
+            # Integrate by windows of chunk_size days and report the loss on observations so far
+            # The Optuna pruner can then stop hopeless trials before the end of the horizon
+            chunks = self.solve_chunks(true.index,chunk_size = chunk_size,init_state = init_state,start_date = true.index[0],outputs = loss.cols)
+            for step,states in enumerate(chunks):
+                loss_value,loss_dict = loss(states,partial = True)
+                trial.report(loss_value,step)
+                if trial.should_prune():
+                    raise TrialPruned()
+            loss = loss_value
+
+        else:
+            # Make prediction recording only observed dates and columns
+            states = self.predict(true,init_state = init_state,outputs = loss.cols)
+
+            # Compute and return loss on the raw solver output
+            loss,loss_dict = loss(states)
 
         if constraint is not None:
             loss = constraint(self,loss) 
@@ -444,43 +985,51 @@ class CompartmentalModel:
 
 
 
-    def fit(self,true,space,init_state = None,n = 100,**kwargs):
+    def fit(self,true,space,init_state = None,n = 100,loss = "mse",weights = None,method = "tpe",**kwargs):
 
         # Initialize optimizer
         self.opt = ParamsOptimizer(self)
 
-        # Run optimizer
-        best = self.opt.run(true,space,init_state = init_state,n=n,**kwargs)
+        # Prepare observations and normalizers once for all trials
+        loss = ObservationLoss(true,loss = loss,weights = weights)
+
+        # Run optimizer, black box TPE search or gradient based L-BFGS-B started from a few TPE trials
+        assert method in ["tpe","lbfgs"],f"Calibration method {method} is not recognized among ['tpe','lbfgs']"
+        if method == "lbfgs":
+            best = self.opt.run_lbfgs(true,space,init_state = init_state,loss = loss,**kwargs)
+        else:
+            best = self.opt.run(true,space,init_state = init_state,n=n,loss = loss,**kwargs)
 
         # Reset with best parameters
         self.reset(best)
 
 
-    def predict(self,true,init_state = None,forecast_days = 0):
+    def predict(self,true,init_state = None,forecast_days = 0,as_array = True,outputs = None):
 
         # Prepare temporal variables
         start_date = true.index[0]
         n_days = len(true) - 1 + forecast_days
 
+        # Without forecast, only record the observed dates and the requested outputs
+        t_eval = true.index if forecast_days == 0 and outputs is not None else None
+
         # Make prediction using model
-        states = self.solve(init_state = init_state,start_date = start_date,n_days = n_days)
+        states = self.solve(init_state = init_state,start_date = start_date,n_days = n_days,as_array = as_array,t_eval = t_eval,outputs = outputs)
         return states
 
     
     def predict_interval(self,true,init_state,forecast_days = 0,n = 100,q = 0.25,norm_fit = False):
 
+        # Sample parameters from the calibration study
         all_params = self.opt.sample_params(n = n,q = q,norm_fit = norm_fit)
-        all_states = []
 
-        for i,params in enumerate(tqdm(all_params)):
-
-            self.reset(params)
-
-            states = self.predict(true,init_state,forecast_days)
-            states["sample"] = i
-            all_states.append(states) 
+        # Prepare temporal variables
+        start_date = true.index[0]
+        n_days = len(true) - 1 + forecast_days
 
-        all_states = pd.concat(all_states).reset_index().set_index(["index","sample"]).unstack("sample")
+        # Solve all samples as one batch and convert to (compartment,sample) columns
+        all_states = self.solve_batch(all_params,n_days = n_days,init_state = init_state,start_date = start_date)
+        all_states = all_states.to_frame()
         
         return all_states
 
@@ -563,7 +1112,7 @@ class CompartmentalModel:
             assert len(beta_values) == len(beta_dates)
 
             # Create multiple sigmoid response
-            beta = lambda y,t : multiple_sigmoid_response(t,beta_start,beta_values,beta_dates,beta_transitions)
+            beta = SigmoidSchedule(beta_start,beta_values,beta_dates,beta_transitions)
 
         # Make callable
         return self.make_callable(beta)
@@ -1,7 +1,12 @@
 
 
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
+from scipy import sparse
+
+from .state import ArrayState, TracingState
+from .symbolic import Expr, SymbolicSystem
 
 import warnings
 warnings.filterwarnings("ignore") 
@@ -10,6 +15,7 @@ class CompartmentNetwork:
     def __init__(self,nodes = None):
         self.graph = nx.DiGraph()
         self.static = {}
+        self.compiled = None
         if nodes is not None:
             self.add_nodes(nodes)
 
@@ -22,9 +28,11 @@ class CompartmentNetwork:
     def add_transition(self,start,end,transition):
         attributes = {"transition":transition}
         self.graph.add_edge(start,end,**attributes)
+        self.compiled = None
 
     def add_static_derivative(self,node,fn):
         self.static[node] = fn
+        self.compiled = None
 
     def get_static_derivative(self,node,y,t):
 
@@ -88,6 +96,14 @@ class CompartmentNetwork:
         return [self.compute_derivative(node,y,t) for node in compartments]
 
 
+    def compile(self,compartments):
+        """Freeze the network into integer index arrays for fast derivatives computation
+        The compiled network is stored as attribute and invalidated when a transition is added
+        """
+        self.compiled = CompiledNetwork(self,compartments)
+        return self.compiled
+
+
     def show(self,k = 1,layout = "spring",figsize = (15,4),separate_components = True,largest_component = True,node_size = 3000):
         assert layout in ["spring","kamada"]
 
@@ -116,3 +132,231 @@ class CompartmentNetwork:
         else:
             plot_network(self.graph)
             
+
+
+
+
+class CompiledNetwork:
+    def __init__(self,network,compartments):
+        """Array-backed version of a CompartmentNetwork
+        Each transition is stored as an edge (source index, target index, rate kernel)
+        Derivatives are then computed on raw numpy arrays without pandas allocation:
+            - rates of all transitions are evaluated in one pass over the kernels
+            - flows are aggregated by compartments with a sparse incidence matrix
+        Kernels are the same callables as in the network and receive an ArrayState instead of a State
+        If all transitions and static derivatives are symbolic expressions, rates, derivatives and Jacobian
+        are instead computed by functions generated from the expressions (see SymbolicSystem)
+        """
+
+        self.compartments = list(compartments)
+        self.n = len(self.compartments)
+        position = {c:i for i,c in enumerate(self.compartments)}
+
+        # Freeze edges into index arrays
+        edges = list(network.graph.edges(data = "transition"))
+        self.source = np.array([position[start] for start,_,_ in edges],dtype = int)
+        self.target = np.array([position[end] for _,end,_ in edges],dtype = int)
+        self.kernels = [transition for _,_,transition in edges]
+        self.n_edges = len(edges)
+
+        # Static derivatives by compartment index
+        self.static = [(position[node],fn) for node,fn in network.static.items()]
+
+        # Incidence matrix with +1 on target and -1 on source for each edge
+        data = np.concatenate([np.ones(self.n_edges),-np.ones(self.n_edges)])
+        rows = np.concatenate([self.target,self.source])
+        cols = np.concatenate([np.arange(self.n_edges)]*2)
+        self.incidence = sparse.csr_matrix((data,(rows,cols)),shape = (self.n,self.n_edges))
+
+        # Reusable state wrapper around the raw vector
+        self.state = ArrayState(self.compartments)
+
+        # Fused functions generated from symbolic transitions
+        self.system = None
+        if all(isinstance(fn,(Expr,int,float)) for fn in self.kernels + [fn for _,fn in self.static]):
+            self.system = SymbolicSystem(self.compartments,self.kernels,self.source,self.target,self.static)
+
+
+    def rates(self,y,t):
+        """Evaluate all transitions kernels
+        y can be a vector of compartments or a 2D array (compartments x runs)
+        Returns an array of shape (edges,) or (edges x runs)
+        """
+        y = np.asarray(y,dtype = float)
+        self.state.values = y
+        if self.system is not None:
+            return self.system.rates(y,t,self.state)
+        rates = np.empty((self.n_edges,) + y.shape[1:])
+        for i,kernel in enumerate(self.kernels):
+            rates[i] = kernel(self.state,t) if callable(kernel) else kernel
+        return rates
+
+
+    def derivative(self,y,t):
+        """Compute derivatives for all compartments on a raw numpy array
+        """
+        if self.system is not None:
+            y = np.asarray(y,dtype = float)
+            self.state.values = y
+            return self.system.derivative(y,t,self.state)
+
+        dydt = self.incidence @ self.rates(y,t)
+
+        # Add node derivatives
+        for i,fn in self.static:
+            dydt[i] += fn(self.state,t)
+
+        return dydt
+
+
+    def dependencies(self):
+        """Compartments each transition depends on, found by tracing the kernels on a unit state
+        Returns a sparse matrix of shape (edges x compartments) and a list of dependencies for static derivatives
+        """
+        if not hasattr(self,"_dependencies"):
+            state = TracingState(self.compartments,np.ones(self.n))
+
+            rows,cols = [],[]
+            for i,kernel in enumerate(self.kernels):
+                state.accessed = set()
+                if callable(kernel): kernel(state,0)
+                rows.extend([i]*len(state.accessed))
+                cols.extend(sorted(state.accessed))
+            edges = sparse.csr_matrix((np.ones(len(rows)),(rows,cols)),shape = (self.n_edges,self.n))
+
+            static = []
+            for i,fn in self.static:
+                state.accessed = set()
+                fn(state,0)
+                static.append((i,sorted(state.accessed)))
+
+            self._dependencies = (edges,static)
+        return self._dependencies
+
+
+    def jacobian_sparsity(self):
+        """Sparsity pattern of the Jacobian of the derivatives
+        Entry (i,j) is non zero only if a transition in or out of compartment i depends on compartment j
+        """
+        if not hasattr(self,"_jacobian_sparsity"):
+            edges,static = self.dependencies()
+            pattern = abs(self.incidence) @ edges
+            pattern = sparse.lil_matrix(pattern)
+            for i,positions in static:
+                pattern[i,positions] = 1
+            pattern = sparse.csc_matrix(pattern)
+            pattern.data[:] = 1
+            self._jacobian_sparsity = pattern
+        return self._jacobian_sparsity
+
+
+    def jacobian_groups(self):
+        """Group columns of the Jacobian which do not share any non zero row (greedy coloring)
+        All columns of a group are estimated with a single derivative evaluation
+        """
+        if not hasattr(self,"_jacobian_groups"):
+            pattern = self.jacobian_sparsity()
+            groups,rows_used = [],[]
+            for j in range(self.n):
+                rows = set(pattern.indices[pattern.indptr[j]:pattern.indptr[j+1]])
+                for k,used in enumerate(rows_used):
+                    if not (used & rows):
+                        groups[k].append(j)
+                        used |= rows
+                        break
+                else:
+                    groups.append([j])
+                    rows_used.append(rows)
+            self._jacobian_groups = [np.array(group) for group in groups]
+        return self._jacobian_groups
+
+
+    def jacobian(self,y,t):
+        """Jacobian of the derivatives estimated by finite differences on groups of independent columns
+        It costs one derivative evaluation per group instead of one per compartment
+        Symbolic networks use the analytic Jacobian instead
+        Returns a dense array of shape (compartments x compartments)
+        """
+        y = np.asarray(y,dtype = float)
+        if self.system is not None:
+            self.state.values = y
+            return self.system.jacobian(y,t,self.state)
+
+        pattern = self.jacobian_sparsity()
+        f0 = self.derivative(y,t)
+        jac = np.zeros((self.n,self.n))
+        h = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(y),1)
+
+        for group in self.jacobian_groups():
+            y_step = y.copy()
+            y_step[group] += h[group]
+            df = self.derivative(y_step,t) - f0
+            for j in group:
+                rows = pattern.indices[pattern.indptr[j]:pattern.indptr[j+1]]
+                jac[rows,j] = df[rows] / h[j]
+
+        return jac
+
+
+
+
+class CompiledNetworkBatch:
+    def __init__(self,networks):
+        """Stack of compiled networks sharing the same structure, one per set of parameters
+        The ODE state is a flat vector of shape (samples x compartments) integrated as a single system
+        If all networks are symbolic, the derivative is generated once from the expressions of the first network
+        and evaluated on the (compartments x samples) array in one call, parameters of all samples being read from
+        a (slots x samples) array of their values. Otherwise rates are evaluated with each network kernels
+        (they are bound to their own parameters) and flows for all samples are aggregated with a single sparse product
+        """
+        self.networks = networks
+        self.n = networks[0].n
+        self.n_samples = len(networks)
+        self.incidence = networks[0].incidence
+
+        # Safety checks on the structure of the networks
+        for network in networks[1:]:
+            assert network.n == self.n
+            assert np.array_equal(network.source,networks[0].source) and np.array_equal(network.target,networks[0].target),"All networks in a batch should have the same transitions"
+
+        # Parameters values by sample for symbolic networks, constants are filled once and callables at each evaluation
+        self.system = None
+        if all(network.system is not None for network in networks):
+            params,sizes,offsets,slots = networks[0].system.parameters()
+            self.system = networks[0].system._generate_derivative(slots)
+            self.values = np.empty((offsets[-1],self.n_samples))
+            self.callables,self._time = [],None
+            for k,network in enumerate(networks):
+                values = {param.name:param.value for param in network.system.parameters()[0]}
+                assert set(values) == set(param.name for param in params),"All networks in a batch should have the same parameters"
+                for param,size,offset in zip(params,sizes,offsets):
+                    if callable(values[param.name]):
+                        self.callables.append((k,slice(offset,offset + size),values[param.name]))
+                    else:
+                        self.values[offset:offset + size,k] = np.ravel(values[param.name])
+
+
+    def derivative(self,y,t):
+        y = np.asarray(y,dtype = float).reshape(self.n_samples,self.n)
+
+        # Evaluate time dependent parameters for each sample, then the derivatives of all samples at once
+        # Parameters only depend on time, they are not evaluated again when the solver calls the derivative at the same time
+        if self.system is not None:
+            if t != self._time:
+                for k,rows,fn in self.callables:
+                    self.networks[k].state.values = y[k]
+                    self.values[rows,k] = fn(self.networks[k].state,t)
+                self._time = t
+            return self.system(y.T,self.values).T.ravel()
+
+        # Evaluate rates for each sample and aggregate flows at once
+        rates = np.stack([network.rates(y[k],t) for k,network in enumerate(self.networks)],axis = 1)
+        dydt = (self.incidence @ rates).T
+
+        # Add node derivatives
+        for k,network in enumerate(self.networks):
+            network.state.values = y[k]
+            for i,fn in network.static:
+                dydt[k,i] += fn(network.state,t)
+
+        return dydt.ravel()
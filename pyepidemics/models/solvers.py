@@ -0,0 +1,218 @@
+"""ODE solvers backends
+All backends share the same signature and return the states on the time grid with per-solve statistics:
+    - "odeint" : scipy LSODA wrapper used by default
+    - "RK45", "RK23", "DOP853", "LSODA", "BDF", "Radau" : scipy solve_ivp methods with adaptive steps
+    - "rk4", "euler" : fixed step kernels, fast but without error control
+integrate_windows() integrates the same grid window by window for early stopping, without restarting adaptive solvers
+"""
+
+import time
+import numpy as np
+import scipy.integrate
+from scipy.integrate import odeint, solve_ivp, OdeSolution
+
+IVP_SOLVERS = ["RK45","RK23","DOP853","LSODA","BDF","Radau"]
+SPARSE_JACOBIAN_SOLVERS = ["BDF","Radau"]
+FIXED_STEP_SOLVERS = ["rk4","euler"]
+SOLVERS = ["odeint"] + IVP_SOLVERS + FIXED_STEP_SOLVERS
+
+
+def _rk4_step(fn,y,t,h):
+    k1 = fn(y,t)
+    k2 = fn(y + h/2 * k1,t + h/2)
+    k3 = fn(y + h/2 * k2,t + h/2)
+    k4 = fn(y + h * k3,t + h)
+    return y + h/6 * (k1 + 2*k2 + 2*k3 + k4)
+
+
+def _euler_step(fn,y,t,h):
+    return y + h * fn(y,t)
+
+
+def integrate_fixed_step(fn,y0,t,method = "rk4",step = 0.1):
+    """Fixed step integration on the time grid t
+    Each interval of the grid is split in sub steps of length at most step
+
+    Args:
+        fn (callable): derivative function with signature fn(y,t)
+        y0 (np.ndarray): initial state
+        t (np.ndarray): time grid where to record the states
+        method (str): "rk4" or "euler"
+        step (float): maximum length of a sub step
+
+    Returns:
+        np.ndarray: states of shape (time x compartments)
+    """
+    kernel = _rk4_step if method == "rk4" else _euler_step
+    derivative = lambda y,t : np.asarray(fn(y,t),dtype = float)
+    y = np.asarray(y0,dtype = float)
+    states = np.empty((len(t),) + y.shape)
+    states[0] = y
+
+    for i in range(len(t) - 1):
+        n_steps = max(1,int(np.ceil((t[i+1] - t[i]) / step - 1e-9)))
+        h = (t[i+1] - t[i]) / n_steps
+        for j in range(n_steps):
+            y = kernel(derivative,y,t[i] + j*h,h)
+        states[i+1] = y
+
+    return states
+
+
+def integrate(fn,y0,t,solver = "odeint",rtol = None,atol = None,dense_output = False,step = 0.1,jac = None,jac_sparsity = None,tcrit = None):
+    """Integrate an ODE system on the time grid t with the given solver backend
+
+    Args:
+        fn (callable): derivative function with signature fn(y,t)
+        y0 (np.ndarray): initial state
+        t (np.ndarray): time grid where to record the states
+        solver (str): solver backend among SOLVERS
+        rtol (float): relative tolerance for adaptive solvers, defaults to the backend default
+        atol (float): absolute tolerance for adaptive solvers, defaults to the backend default
+        dense_output (bool): keep a continuous solution, only available for solve_ivp methods
+        step (float): maximum step length in days for fixed step solvers
+        jac (callable): Jacobian function with signature jac(y,t) used by odeint and LSODA
+        jac_sparsity (sparse matrix): Jacobian sparsity pattern used by BDF and Radau
+        tcrit (list): breakpoints where the solution is not smooth, adaptive solvers do not step across them
+
+    Returns:
+        states (np.ndarray): states of shape (time x compartments)
+        stats (dict): solver, number of derivative evaluations, wall time and continuous solution if requested
+    """
+    assert solver in SOLVERS,f"Solver {solver} is not recognized among {SOLVERS}"
+    if dense_output and solver not in IVP_SOLVERS:
+        raise Exception(f"Dense output is only available for solvers {IVP_SOLVERS}")
+
+    # Count derivative evaluations
+    nfev = [0]
+    def counted(y,t):
+        nfev[0] += 1
+        return fn(y,t)
+
+    options = {k:v for k,v in {"rtol":rtol,"atol":atol}.items() if v is not None}
+    stats = {"solver":solver}
+    start = time.time()
+
+    # Keep only breakpoints strictly inside the integration interval
+    tcrit = np.array([] if tcrit is None else tcrit,dtype = float)
+    tcrit = tcrit[(tcrit > t[0]) & (tcrit < t[-1])]
+
+    if solver == "odeint":
+        states = odeint(counted,y0,t,Dfun = jac,tcrit = tcrit if len(tcrit) > 0 else None,**options)
+
+    elif solver in IVP_SOLVERS:
+        if jac_sparsity is not None and solver in SPARSE_JACOBIAN_SOLVERS:
+            options["jac_sparsity"] = jac_sparsity
+        elif jac is not None and solver == "LSODA":
+            options["jac"] = lambda t,y : jac(y,t)
+
+        # Integrate separately on each segment between breakpoints
+        bounds = np.concatenate([[t[0]],tcrit,[t[-1]]])
+        y = np.asarray(y0,dtype = float)
+        states,ts,interpolants = [],[bounds[0]],[]
+        stats["njev"] = 0
+        for i in range(len(bounds) - 1):
+
+            # Evaluate on grid points of the segment and on its end to restart the next segment
+            t_eval = np.append(t[(t >= bounds[i]) & (t < bounds[i+1])],bounds[i+1])
+            solution = solve_ivp(lambda t,y : counted(y,t),(bounds[i],bounds[i+1]),y,method = solver,t_eval = t_eval,dense_output = dense_output,**options)
+            if not solution.success:
+                raise Exception(f"Solver {solver} failed: {solution.message}")
+
+            y = solution.y[:,-1]
+            states.append(solution.y.T if i == len(bounds) - 2 else solution.y.T[:-1])
+            stats["njev"] += solution.njev
+            if dense_output:
+                ts.extend(solution.sol.ts[1:])
+                interpolants.extend(solution.sol.interpolants)
+
+        states = np.concatenate(states)
+        if dense_output:
+            stats["dense_output"] = OdeSolution(np.array(ts),interpolants)
+
+    else:
+        states = integrate_fixed_step(counted,y0,t,method = solver,step = step)
+
+    stats["nfev"] = nfev[0]
+    stats["time"] = time.time() - start
+
+    return states,stats
+
+
+
+def integrate_windows(fn,y0,t,windows,solver = "odeint",rtol = None,atol = None,step = 0.1,jac = None,jac_sparsity = None,tcrit = None):
+    """Integrate an ODE system on the time grid t and yield the states each time a window of the grid is completed
+    Adaptive solvers are stepped continuously across windows, their step size and order are kept from one window to the next,
+    so that integrating all windows costs as many derivative evaluations as a single solve.
+    "odeint" is stepped with the LSODA method of solve_ivp and the same default tolerances.
+
+    Args:
+        fn (callable): derivative function with signature fn(y,t)
+        y0 (np.ndarray): initial state
+        t (np.ndarray): strictly increasing time grid where to record the states
+        windows (list): position in t of the last grid point of each window, increasing
+        solver (str): solver backend among SOLVERS
+        rtol, atol, step, jac, jac_sparsity, tcrit: see integrate()
+
+    Yields:
+        states (np.ndarray): states of shape (time x compartments) on the grid until the end of the current window
+        stats (dict): solver, number of derivative evaluations and wall time so far
+    """
+    assert solver in SOLVERS,f"Solver {solver} is not recognized among {SOLVERS}"
+
+    # Count derivative evaluations
+    nfev = [0]
+    def counted(y,t):
+        nfev[0] += 1
+        return fn(y,t)
+
+    t = np.asarray(t,dtype = float)
+    states = np.empty((len(t),len(y0)))
+    states[0] = y0
+    stats = {"solver":solver,"nfev":0,"time":0}
+
+    # Fixed step solvers do not adapt their steps, restarting at the end of each window is exact
+    if solver in FIXED_STEP_SOLVERS:
+        done = 0
+        for end in windows:
+            start = time.time()
+            states[done:end+1] = integrate_fixed_step(counted,states[done],t[done:end+1],method = solver,step = step)
+            done = end
+            stats["nfev"],stats["time"] = nfev[0],stats["time"] + time.time() - start
+            yield states[:end+1],stats
+        return
+
+    # Solver class stepped manually and its options
+    if solver == "odeint":
+        method,options = scipy.integrate.LSODA,{"rtol":1.49012e-8,"atol":1.49012e-8}
+    else:
+        method,options = getattr(scipy.integrate,solver),{}
+    options.update({k:v for k,v in {"rtol":rtol,"atol":atol}.items() if v is not None})
+    if jac_sparsity is not None and solver in SPARSE_JACOBIAN_SOLVERS:
+        options["jac_sparsity"] = jac_sparsity
+    elif jac is not None and solver in ["odeint","LSODA"]:
+        options["jac"] = lambda t,y : jac(y,t)
+
+    # The solver is only restarted at breakpoints, it does not step across them
+    tcrit = np.array([] if tcrit is None else tcrit,dtype = float)
+    bounds = list(tcrit[(tcrit > t[0]) & (tcrit < t[-1])]) + [t[-1]]
+    stepper,i = None,1
+    for end in windows:
+        start = time.time()
+        while i <= end:
+            if stepper is None or stepper.status == "finished":
+                t0,y = (t[0],states[0]) if stepper is None else (stepper.t,stepper.y)
+                stepper = method(lambda t,y : counted(y,t),t0,y,bounds.pop(0),**options)
+            stepper.step()
+            if stepper.status == "failed":
+                raise Exception(f"Solver {solver} failed at t = {stepper.t}")
+
+            # Record grid points covered by the last step
+            if i < len(t) and t[i] <= stepper.t:
+                interpolant = stepper.dense_output()
+                while i < len(t) and t[i] <= stepper.t:
+                    states[i] = stepper.y if t[i] == stepper.t else interpolant(t[i])
+                    i += 1
+
+        stats["nfev"],stats["time"] = nfev[0],stats["time"] + time.time() - start
+        yield states[:end+1],stats
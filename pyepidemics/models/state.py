@@ -1,4 +1,4 @@
-
+import numpy as np
 import pandas as pd
 
 
@@ -6,6 +6,9 @@ import pandas as pd
 class State(pd.Series):
     def __init__(self,data):
         super().__init__(data)
+
+        # A new state is created at each derivative evaluation, transitions share intermediate results in the cache
+        self.cache = {}
         
     def __getitem__(self,key):
         if key in self.index:
@@ -13,3 +16,73 @@ class State(pd.Series):
         else:
             states = [x.split("_")[0] == key for x in self.index]
             return self.loc[states].values
+
+
+
+class ArrayState:
+    """Lightweight equivalent of State backed by a raw numpy array
+    It is used by compiled networks to avoid allocating a pd.Series at each derivative evaluation
+    Label lookups are resolved once at creation into integer indices, for example:
+        - y["S_young"] returns the value of the compartment S_young
+        - y["I"] returns the vector of all I compartments (by category if there is a granularity)
+    Values can also be 2D arrays (compartments x runs) to evaluate several trajectories at once
+    The cache dictionary is emptied each time values are set, it allows transitions to share
+    intermediate results (e.g. contact products) during one derivative evaluation
+    """
+    def __init__(self,compartments,values = None):
+        self.index = list(compartments)
+        self.values = values
+
+        # Precompute integer positions for compartments
+        # And for states prefixes when they are not a compartment themselves (granular models)
+        self._lookup = {c:i for i,c in enumerate(self.index)}
+        prefixes = {}
+        for i,c in enumerate(self.index):
+            prefixes.setdefault(c.split("_")[0],[]).append(i)
+        for prefix,positions in prefixes.items():
+            if prefix not in self._lookup:
+                self._lookup[prefix] = np.array(positions)
+
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self,values):
+        self._values = values
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            if key not in self._lookup:
+                raise KeyError(f"Key {key} is not a compartment or a state of the model")
+            key = self._lookup[key]
+        return self.values[key]
+
+
+
+class TracingState(ArrayState):
+    """ArrayState recording which compartments are accessed
+    It is used to find the compartments each transition depends on, ie the sparsity of the Jacobian
+    """
+    def __init__(self,compartments,values = None):
+        super().__init__(compartments,values)
+        self.accessed = set()
+
+    # Cache is disabled to trace the accesses of every transition
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self,values):
+        self._values = values
+        self.cache = None
+
+    def __getitem__(self,key):
+        position = self._lookup.get(key,key) if isinstance(key,str) else key
+        self.accessed.update(np.arange(len(self.index))[position].ravel().tolist())
+        return super().__getitem__(key)
@@ -1,4 +1,5 @@
 import datetime
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.express as px
@@ -10,12 +11,17 @@ plt.rcParams['axes.spines.right'] = False
 plt.rcParams['axes.spines.top'] = False
 
 class CompartmentStates(pd.DataFrame):
+    _metadata = ["_N","checkpoints"]
+
     def __init__(self,*args,**kwargs):
         super().__init__(*args,**kwargs)
 
         # Store total population
         self._N = int(self.sum(axis = 1).iloc[0])
 
+        # Full state vectors stored at chosen times to resume the integration
+        self.checkpoints = {}
+
 
     @property
     def N(self):
@@ -27,7 +33,6 @@ class CompartmentStates(pd.DataFrame):
         if isinstance(key,str):
             if key not in self.columns:
                 cols = [col for col in self.columns if (key in col.split("_") or ("_" in key and key in col))]
-                print(cols)
 
                 # Raise KeyError if no match
                 if len(cols) == 0:
@@ -41,6 +46,18 @@ class CompartmentStates(pd.DataFrame):
             return df
         return CompartmentStates(df)
 
+    def add_checkpoint(self,t,y,time):
+        """Store the full state vector y at index t with its integration time
+        """
+        self.checkpoints[t] = {"y":np.array(y,dtype = float),"t":float(time)}
+
+    def get_checkpoint(self,t):
+        """Returns the full state vector and the integration time stored at index t
+        """
+        if t not in self.checkpoints:
+            raise KeyError(f"No checkpoint at {t}, available checkpoints are {list(self.checkpoints.keys())}, use solve(checkpoints = [...])")
+        return self.checkpoints[t]["y"],self.checkpoints[t]["t"]
+
     def build_aggregates(self, states):
         """Build aggregated variables accros compartments if needed
         """
@@ -147,3 +164,220 @@ class CompartmentStates(pd.DataFrame):
     def find_peak(self,state = "I"):
         peak = self[state].idxmax()
         return peak
+
+
+
+class ArrayStates:
+    def __init__(self,values,compartments,index = None,states = None):
+        """Compact container for a single trajectory
+        Values are stored in a contiguous array of shape (time x compartment) with a map of compartments positions.
+        Aggregated states are computed lazily and pandas objects are only built on request:
+            - states["I"] returns a pd.Series for a compartment or an aggregated state
+            - states.array("I") returns the raw numpy array
+            - states.to_frame() returns the full CompartmentStates
+        Other attributes and methods of CompartmentStates (.show(), .iloc, ...) are delegated to the materialized frame.
+
+        Args:
+            values (np.ndarray): array of shape (time x compartment)
+            compartments (list): compartments names in the order of the second axis
+            index (list or pd.Index): time index, defaults to a range of days
+            states (list): states names used to aggregate granular compartments (e.g. "I" for I_young, I_senior)
+        """
+        assert values.ndim == 2 and values.shape[1] == len(compartments)
+        self.values = np.ascontiguousarray(values)
+        self.compartments = list(compartments)
+        self.index = pd.Index(index if index is not None else range(values.shape[0]))
+        self.states = list(states or [])
+        self.checkpoints = {}
+        self._positions = {c:i for i,c in enumerate(self.compartments)}
+        self._frame = None
+
+
+    @property
+    def N(self):
+        return int(self.values[0].sum())
+
+    @property
+    def columns(self):
+        return pd.Index(self.compartments + [x for x in self.states if x not in self._positions])
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def positions(self,key):
+        """Positions of the compartments of a compartment or an aggregated state
+        """
+        if key in self._positions:
+            return self._positions[key]
+        positions = [i for i,c in enumerate(self.compartments) if c.split("_")[0] == key]
+        if len(positions) == 0:
+            raise KeyError(f"Key {key} is missing from ArrayStates object")
+        return positions
+
+
+    def array(self,key):
+        """Raw numpy values of a compartment or of an aggregated state
+        """
+        positions = self.positions(key)
+        if isinstance(positions,list):
+            return self.values[:,positions].sum(axis = 1)
+        return self.values[:,positions]
+
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            try:
+                return pd.Series(self.array(key),index = self.index,name = key)
+            except KeyError:
+                pass
+        return self.to_frame()[key]
+
+
+    def __getattr__(self,name):
+        # Delegate other attributes to the materialized frame
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.to_frame(),name)
+
+
+    def select(self,index):
+        """Restrict to given index values without building any pandas object
+        """
+        positions = self.index.get_indexer(index)
+        if (positions < 0).any():
+            raise KeyError("Some values of the index are missing from ArrayStates object")
+        return ArrayStates(self.values[positions],self.compartments,index = self.index[positions],states = self.states)
+
+
+    def add_checkpoint(self,t,y,time):
+        """Store the full state vector y at index t with its integration time
+        """
+        self.checkpoints[t] = {"y":np.array(y,dtype = float),"t":float(time)}
+
+    def get_checkpoint(self,t):
+        """Returns the full state vector and the integration time stored at index t
+        """
+        if t not in self.checkpoints:
+            raise KeyError(f"No checkpoint at {t}, available checkpoints are {list(self.checkpoints.keys())}, use solve(checkpoints = [...])")
+        return self.checkpoints[t]["y"],self.checkpoints[t]["t"]
+
+
+    def to_frame(self):
+        """Materialize as a CompartmentStates with aggregated states, the frame is cached
+        """
+        if self._frame is None:
+            states = CompartmentStates(self.values,columns = self.compartments,index = self.index)
+            states.build_aggregates(self.states)
+            states.checkpoints = self.checkpoints
+            self._frame = states
+        return self._frame
+
+
+
+class BatchStates:
+    def __init__(self,values,compartments,index = None,states = None):
+        """Compact container for an ensemble of trajectories (one per parameters set or per run)
+        Values are stored in a single 3D array of shape (time x compartment x sample)
+        and are only converted to pandas on request with .to_frame() or .quantile()
+
+        Args:
+            values (np.ndarray): array of shape (time x compartment x sample)
+            compartments (list): compartments names in the order of the second axis
+            index (list or pd.Index): time index, defaults to a range of days
+            states (list): states names used to aggregate granular compartments (e.g. "I" for I_young, I_senior)
+        """
+        assert values.ndim == 3 and values.shape[1] == len(compartments)
+        self.values = values
+        self.compartments = list(compartments)
+        self.index = pd.Index(index if index is not None else range(values.shape[0]))
+        self.states = [x for x in (states or []) if x not in self.compartments]
+        self._positions = {c:i for i,c in enumerate(self.compartments)}
+
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def n_samples(self):
+        return self.values.shape[2]
+
+
+    def __getitem__(self,key):
+        """Returns an array (time x sample) for a compartment or the sum of compartments of a given state
+        """
+        if key in self._positions:
+            return self.values[:,self._positions[key],:]
+        else:
+            positions = [i for i,c in enumerate(self.compartments) if c.split("_")[0] == key]
+            if len(positions) == 0:
+                raise KeyError(f"Key {key} is missing from BatchStates object")
+            return self.values[:,positions,:].sum(axis = 1)
+
+
+    def to_frame(self):
+        """Convert to a pd.DataFrame with (compartment,sample) columns including aggregated states
+        """
+        names = self.compartments + self.states
+        values = np.concatenate([self.values] + [self[state][:,None,:] for state in self.states],axis = 1)
+        columns = pd.MultiIndex.from_product([names,range(self.n_samples)],names = [None,"sample"])
+        return pd.DataFrame(values.reshape(len(self.index),-1),index = self.index,columns = columns)
+
+
+    def quantile(self,q = 0.5):
+        """Quantiles over samples for each compartment and aggregated state
+
+        Args:
+            q (float or list): quantile or list of quantiles
+
+        Returns:
+            CompartmentStates for a single quantile, or a pd.DataFrame with (compartment,quantile) columns
+        """
+        if isinstance(q,(list,tuple,np.ndarray)):
+            names = self.compartments + self.states
+            values = np.concatenate([self.values] + [self[state][:,None,:] for state in self.states],axis = 1)
+            values = np.quantile(values,q,axis = 2).transpose(1,2,0)
+            columns = pd.MultiIndex.from_product([names,list(q)],names = [None,"quantile"])
+            return pd.DataFrame(values.reshape(len(self.index),-1),index = self.index,columns = columns)
+        else:
+            states = CompartmentStates(np.quantile(self.values,q,axis = 2),index = self.index,columns = self.compartments)
+            for state in self.states:
+                states[state] = np.quantile(self[state],q,axis = 1)
+            return states
+
+
+
+class ResumedStates:
+    def __init__(self,head,tail):
+        """Lazy concatenation of a base trajectory and a tail resumed from one of its checkpoints
+        The base trajectory is not copied, columns are concatenated only when they are accessed
+
+        Args:
+            head (CompartmentStates): base trajectory
+            tail (CompartmentStates): resumed trajectory, its first index is the checkpoint
+        """
+        self.head = head
+        self.tail = tail
+        self._position = head.index.get_loc(tail.index[0])
+
+    @property
+    def index(self):
+        return self.head.index[:self._position].append(self.tail.index)
+
+    @property
+    def columns(self):
+        return self.tail.columns
+
+    def __len__(self):
+        return self._position + len(self.tail)
+
+    def __getitem__(self,key):
+        return pd.concat([self.head[key].iloc[:self._position],self.tail[key]])
+
+    def to_frame(self):
+        """Materialize the full trajectory as a CompartmentStates
+        """
+        states = CompartmentStates(pd.concat([self.head[self.tail.columns].iloc[:self._position],self.tail]))
+        states.checkpoints = {**{k:v for k,v in self.head.checkpoints.items() if k in states.index[:self._position]},**self.tail.checkpoints}
+        return states
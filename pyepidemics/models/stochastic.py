@@ -0,0 +1,122 @@
+"""Stochastic simulation engines over compiled compartment networks
+Transitions rates are used as propensities, ie expected number of individuals moving per day.
+All runs are simulated at once as a (compartments x runs) integer array,
+rate kernels are evaluated on the whole batch so there is no Python overhead per run.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+def _check_network(network):
+    if len(network.static) > 0:
+        raise Exception("Static derivatives can't be used as propensities, stochastic simulation only supports transitions")
+
+
+def _outflow_matrix(network):
+    """Sparse matrix (compartments x edges) with 1 on the source of each edge
+    """
+    data = np.ones(network.n_edges)
+    return sparse.csr_matrix((data,(network.source,np.arange(network.n_edges))),shape = (network.n,network.n_edges))
+
+
+def tau_leap(network,y0,n_days,n_runs = 100,dt = 0.1,rng = None):
+    """Tau-leaping simulation
+    At each step of length dt, the number of firings of each transition is drawn from a Poisson distribution
+    If the firings would empty a compartment below zero, they are scaled down proportionally
+
+    Args:
+        network (CompiledNetwork): compiled network of the model
+        y0 (np.ndarray): initial state vector of integer populations
+        n_days (int): horizon of the simulation
+        n_runs (int): number of independent realizations
+        dt (float): leap duration in days, should divide one day
+        rng (np.random.Generator): random generator used for reproducibility
+
+    Returns:
+        np.ndarray: populations of shape (days x compartments x runs)
+    """
+    _check_network(network)
+    rng = np.random.default_rng() if rng is None else rng
+    outflow_matrix = _outflow_matrix(network)
+    steps = int(round(1/dt))
+    dt = 1/steps
+
+    y = np.repeat(np.asarray(y0,dtype = float)[:,None],n_runs,axis = 1)
+    trajectories = np.empty((n_days + 1,network.n,n_runs))
+    trajectories[0] = y
+
+    for day in range(n_days):
+        for step in range(steps):
+            t = day + step * dt
+
+            # Draw firings for each transition and each run
+            rates = np.clip(network.rates(y,t),0,None)
+            events = rng.poisson(rates * dt).astype(float)
+
+            # Avoid negative populations by scaling down the firings out of each compartment
+            outflow = outflow_matrix @ events
+            ratio = np.ones_like(y)
+            np.divide(y,outflow,out = ratio,where = outflow > y)
+            events = np.floor(events * ratio[network.source])
+
+            y += network.incidence @ events
+
+        trajectories[day + 1] = y
+
+    return trajectories
+
+
+def gillespie(network,y0,n_days,n_runs = 100,rng = None):
+    """Exact stochastic simulation algorithm (Gillespie)
+    All runs fire one event per iteration in parallel, and are synchronized at the end of each day
+    Time dependent parameters are evaluated at the beginning of each day and held constant during the day
+    The number of iterations grows with the number of events, it is meant for small populations
+
+    Args:
+        network (CompiledNetwork): compiled network of the model
+        y0 (np.ndarray): initial state vector of integer populations
+        n_days (int): horizon of the simulation
+        n_runs (int): number of independent realizations
+        rng (np.random.Generator): random generator used for reproducibility
+
+    Returns:
+        np.ndarray: populations of shape (days x compartments x runs)
+    """
+    _check_network(network)
+    rng = np.random.default_rng() if rng is None else rng
+
+    y = np.repeat(np.asarray(y0,dtype = float)[:,None],n_runs,axis = 1)
+    trajectories = np.empty((n_days + 1,network.n,n_runs))
+    trajectories[0] = y
+
+    for day in range(n_days):
+
+        time = np.full(n_runs,float(day))
+        active = np.arange(n_runs)
+
+        while len(active) > 0:
+
+            # Total propensity of each active run
+            rates = np.clip(network.rates(y[:,active],day),0,None)
+            total = rates.sum(axis = 0)
+
+            # Draw time to next event, runs without any possible event are stopped
+            with np.errstate(divide = "ignore"):
+                time[active] += rng.exponential(1,size = len(active)) / total
+            fire = time[active] < day + 1
+            active,rates,total = active[fire],rates[:,fire],total[fire]
+            if len(active) == 0:
+                break
+
+            # Choose which transition fires for each run
+            threshold = rng.random(len(active)) * total
+            edges = (np.cumsum(rates,axis = 0) < threshold).sum(axis = 0)
+            edges = np.minimum(edges,network.n_edges - 1)
+
+            y[network.source[edges],active] -= 1
+            y[network.target[edges],active] += 1
+
+        trajectories[day + 1] = y
+
+    return trajectories
@@ -0,0 +1,568 @@
+"""Symbolic transitions
+Transitions can be written as expressions on compartments and parameters instead of opaque lambdas:
+
+    S,I = model.symbols["S"],model.symbols["I"]
+    beta = model.param("beta",0.3)
+    model.add_transition("S","I",beta * S * I / N)
+
+Expressions are callables with the same signature fn(y,t) as lambdas, so they work everywhere a lambda does.
+When all transitions of a model are expressions, the compiled network generates a single fused derivative function
+(with common subexpressions computed once), an analytic Jacobian and the next generation matrix used for the R0.
+"""
+
+import numbers
+import numpy as np
+
+
+
+def _elementwise(operator):
+    """Let numpy apply operations with arrays elementwise, e.g. expr * array gives an object array of expressions"""
+    def wrapper(self,other):
+        if isinstance(other,np.ndarray) and other.ndim > 0:
+            return NotImplemented
+        return operator(self,other)
+    return wrapper
+
+
+
+class Expr:
+    """Base node of the expression tree
+    Each node has a structural key used to share identical subexpressions in the generated code
+    """
+    def __call__(self,y,t):
+        raise NotImplementedError
+
+    def diff(self,name):
+        """Symbolic derivative with respect to the compartment name"""
+        raise NotImplementedError
+
+    @property
+    def compartments(self):
+        """Names of the compartments the expression depends on"""
+        if not hasattr(self,"_compartments"):
+            self._compartments = frozenset().union(*[child.compartments for child in self.children])
+        return self._compartments
+
+    @property
+    def params(self):
+        """Parameters the expression depends on"""
+        return frozenset().union(*[child.params for child in self.children])
+
+    @property
+    def children(self):
+        return []
+
+    def _code(self,printer):
+        raise NotImplementedError
+
+    @_elementwise
+    def __add__(self,other):
+        return add(self,other)
+
+    @_elementwise
+    def __radd__(self,other):
+        return add(other,self)
+
+    @_elementwise
+    def __sub__(self,other):
+        return add(self,mul(-1,other))
+
+    @_elementwise
+    def __rsub__(self,other):
+        return add(other,mul(-1,self))
+
+    @_elementwise
+    def __mul__(self,other):
+        return mul(self,other)
+
+    @_elementwise
+    def __rmul__(self,other):
+        return mul(other,self)
+
+    @_elementwise
+    def __truediv__(self,other):
+        return mul(self,power(other,-1))
+
+    @_elementwise
+    def __rtruediv__(self,other):
+        return mul(other,power(self,-1))
+
+    def __neg__(self):
+        return mul(-1,self)
+
+    def __pow__(self,exponent):
+        return power(self,exponent)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self,other):
+        return isinstance(other,Expr) and self.key == other.key
+
+    def __repr__(self):
+        return self.name if hasattr(self,"name") else f"{type(self).__name__}{self.key[1:]}"
+
+
+
+class Const(Expr):
+    def __init__(self,value):
+        self.value = float(value)
+        self.key = ("const",self.value)
+
+    def __call__(self,y,t):
+        return self.value
+
+    def diff(self,name):
+        return ZERO
+
+    def _code(self,printer):
+        return repr(self.value) if self.value >= 0 else f"({self.value!r})"
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+ZERO = Const(0)
+ONE = Const(1)
+
+
+
+class Compartment(Expr):
+    def __init__(self,name):
+        self.name = name
+        self.key = ("compartment",name)
+
+    def __call__(self,y,t):
+        return y[self.name]
+
+    def diff(self,name):
+        return ONE if name == self.name else ZERO
+
+    @property
+    def compartments(self):
+        return frozenset([self.name])
+
+    def _code(self,printer):
+        return printer.assign(self,f"y[{printer.position[self.name]}]")
+
+
+
+class Param(Expr):
+    """Named parameter, either a constant or a time dependent callable fn(y,t) such as a schedule
+    Parameters are considered independent from compartments in the analytic Jacobian
+    Callables returning vectors (e.g. a row of a contact matrix) are indexed with param[i]
+    """
+    def __init__(self,name,value):
+        self.name = name
+        self.value = value
+        self.key = ("param",name,id(value))
+
+    def __call__(self,y,t):
+        return self.value(y,t) if callable(self.value) else self.value
+
+    def __getitem__(self,i):
+        return Index(self,i)
+
+    def diff(self,name):
+        return ZERO
+
+    @property
+    def params(self):
+        return frozenset([self])
+
+    def _code(self,printer):
+        if printer.slots is not None:
+            return f"p[{printer.slots[self.key]}]"
+        reference = printer.bind(self.value)
+        if callable(self.value):
+            return printer.assign(self,f"{reference}(state,t)")
+        return reference
+
+
+
+class Index(Expr):
+    def __init__(self,param,i):
+        self.param = param
+        self.i = int(i)
+        self.key = ("index",param.key,self.i)
+
+    def __call__(self,y,t):
+        return self.param(y,t)[self.i]
+
+    def diff(self,name):
+        return ZERO
+
+    @property
+    def params(self):
+        return frozenset([self.param])
+
+    def _code(self,printer):
+        if printer.slots is not None:
+            return f"p[{printer.slots[self.param.key] + self.i}]"
+        return printer.assign(self,f"{self.param._code(printer)}[{self.i}]")
+
+    def __repr__(self):
+        return f"{self.param.name}[{self.i}]"
+
+
+
+class Add(Expr):
+    def __init__(self,terms):
+        self.terms = terms
+        self.key = ("add",) + tuple(term.key for term in terms)
+
+    @property
+    def children(self):
+        return self.terms
+
+    def __call__(self,y,t):
+        return sum(term(y,t) for term in self.terms)
+
+    def diff(self,name):
+        return add(*[term.diff(name) for term in self.terms if name in term.compartments])
+
+    def _code(self,printer):
+        return printer.assign(self," + ".join(term._code(printer) for term in self.terms))
+
+    def __repr__(self):
+        return "(" + " + ".join(map(repr,self.terms)) + ")"
+
+
+
+class Mul(Expr):
+    def __init__(self,factors):
+        self.factors = factors
+        self.key = ("mul",) + tuple(factor.key for factor in factors)
+
+    @property
+    def children(self):
+        return self.factors
+
+    def __call__(self,y,t):
+        value = 1
+        for factor in self.factors:
+            value = value * factor(y,t)
+        return value
+
+    def diff(self,name):
+        # Product rule on the factors depending on the compartment
+        terms = []
+        for i,factor in enumerate(self.factors):
+            if name in factor.compartments:
+                terms.append(mul(*self.factors[:i],factor.diff(name),*self.factors[i+1:]))
+        return add(*terms)
+
+    def _code(self,printer):
+        return printer.assign(self," * ".join(factor._code(printer) for factor in self.factors))
+
+    def __repr__(self):
+        return " * ".join(map(repr,self.factors))
+
+
+
+class Pow(Expr):
+    def __init__(self,base,exponent):
+        self.base = base
+        self.exponent = float(exponent)
+        self.key = ("pow",base.key,self.exponent)
+
+    @property
+    def children(self):
+        return [self.base]
+
+    def __call__(self,y,t):
+        return self.base(y,t) ** self.exponent
+
+    def diff(self,name):
+        return mul(self.exponent,power(self.base,self.exponent - 1),self.base.diff(name))
+
+    def _code(self,printer):
+        base = self.base._code(printer)
+        if self.exponent == -1:
+            return printer.assign(self,f"1.0 / {base}")
+        return printer.assign(self,f"{base} ** {self.exponent!r}")
+
+    def __repr__(self):
+        return f"({self.base!r})**{self.exponent:g}"
+
+
+
+def as_expr(value):
+    if isinstance(value,Expr):
+        return value
+    if isinstance(value,numbers.Number) or (isinstance(value,np.ndarray) and value.ndim == 0):
+        return Const(value)
+    raise TypeError(f"Value {value!r} can't be used in a symbolic expression")
+
+
+def add(*terms):
+    """Sum of expressions, flattening nested sums and folding constants"""
+    flat,constant = [],0.0
+    for term in map(as_expr,terms):
+        for term in (term.terms if isinstance(term,Add) else [term]):
+            if isinstance(term,Const):
+                constant += term.value
+            else:
+                flat.append(term)
+    if constant != 0 or len(flat) == 0:
+        flat.append(Const(constant))
+    return flat[0] if len(flat) == 1 else Add(flat)
+
+
+def mul(*factors):
+    """Product of expressions, flattening nested products and folding constants"""
+    flat,constant = [],1.0
+    for factor in map(as_expr,factors):
+        for factor in (factor.factors if isinstance(factor,Mul) else [factor]):
+            if isinstance(factor,Const):
+                constant *= factor.value
+            else:
+                flat.append(factor)
+    if constant == 0:
+        return ZERO
+    if constant != 1 or len(flat) == 0:
+        flat.insert(0,Const(constant))
+    return flat[0] if len(flat) == 1 else Mul(flat)
+
+
+def power(base,exponent):
+    base = as_expr(base)
+    if isinstance(base,Const):
+        return Const(base.value ** exponent)
+    if exponent == 0:
+        return ONE
+    if exponent == 1:
+        return base
+    return Pow(base,exponent)
+
+
+def dot(weights,exprs):
+    """Sum of weights[i] * exprs[i], skipping null constant weights
+    Weights can be an array, a list of expressions or a vector Param
+    """
+    if isinstance(weights,Param):
+        weights = [weights[i] for i in range(len(exprs))]
+    return add(*[mul(w,e) for w,e in zip(weights,exprs) if not (isinstance(w,numbers.Number) and w == 0)])
+
+
+
+class Symbols:
+    """Symbolic counterpart of the state y given to transitions
+    symbols["S_young"] is the compartment expression, and for granular models symbols["S"] is
+    an object array of the expressions of all S compartments, so vector operations (e.g. contacts @ symbols["I"]) work
+    """
+    def __init__(self,compartments):
+        self.index = list(compartments)
+        self._symbols = {c:Compartment(c) for c in self.index}
+        prefixes = {}
+        for c in self.index:
+            prefixes.setdefault(c.split("_")[0],[]).append(self._symbols[c])
+        for prefix,symbols in prefixes.items():
+            if prefix not in self._symbols:
+                vector = np.empty(len(symbols),dtype = object)
+                vector[:] = symbols
+                self._symbols[prefix] = vector
+
+    def __getitem__(self,key):
+        if key not in self._symbols:
+            raise KeyError(f"Key {key} is not a compartment or a state of the model")
+        return self._symbols[key]
+
+
+
+class CodePrinter:
+    """Generate python source from expressions, each subexpression is assigned once to a local variable
+    If slots are given (parameter key -> position), parameters are read from a vector p of their values
+    instead of being called, which makes the code independent from parameter values (used by the numba backend)
+    """
+    def __init__(self,compartments,slots = None):
+        self.position = {c:i for i,c in enumerate(compartments)}
+        self.slots = slots
+        self.lines = []
+        self.names = {}
+        self.namespace = {"np":np}
+        self._bound = {}
+
+    def bind(self,value):
+        """Reference to a parameter value in the namespace of the generated function"""
+        if id(value) not in self._bound:
+            name = f"_p{len(self._bound)}"
+            self._bound[id(value)] = name
+            self.namespace[name] = value
+        return self._bound[id(value)]
+
+    def assign(self,expr,code):
+        if expr.key not in self.names:
+            name = f"_x{len(self.names)}"
+            self.names[expr.key] = name
+            self.lines.append(f"    {name} = {code}")
+        return self.names[expr.key]
+
+    def emit(self,expr):
+        return as_expr(expr)._code(self)
+
+    def function(self,name,arguments,body):
+        source = f"def {name}({arguments}):\n" + "\n".join(self.lines + body) + "\n"
+        exec(compile(source,f"<symbolic {name}>","exec"),self.namespace)
+        fn = self.namespace[name]
+        fn.source = source
+        return fn
+
+
+
+class SymbolicSystem:
+    def __init__(self,compartments,flows,source,target,static = None):
+        """Fused functions generated from symbolic transitions
+        Flows are the expressions of each edge, static the list of (compartment index, expression) of static derivatives
+        Generates:
+            - rates(y,t,state) returning the flows of all edges
+            - derivative(y,t,state) returning the derivatives of all compartments
+            - jacobian(y,t,state) returning the dense analytic Jacobian
+        y can be a vector of compartments or a 2D array (compartments x runs) for rates and derivative,
+        state is the ArrayState given to time dependent parameters
+        """
+        self.compartments = list(compartments)
+        self.n = len(self.compartments)
+        self.flows = [as_expr(flow) for flow in flows]
+        self.static = [(i,as_expr(expr)) for i,expr in (static or [])]
+        self.source = np.asarray(source,dtype = int)
+        self.target = np.asarray(target,dtype = int)
+
+        self.rates = self._generate_rates()
+        self.derivative = self._generate_derivative()
+        self.jacobian = self._generate_jacobian()
+
+
+    def _accumulate(self,printer,terms):
+        """Code of a sum of signed terms, e.g. [(1,"_x0"),(-1,"_x2")] gives "_x0 - _x2" """
+        code = ""
+        for sign,term in terms:
+            code += (" - " if sign < 0 else " + ") + term
+        return code[3:] if code.startswith(" + ") else "-" + code[3:]
+
+
+    def _generate_rates(self):
+        printer = CodePrinter(self.compartments)
+        body = ["    rates = np.empty((%d,) + np.shape(y)[1:])" % len(self.flows)]
+        for e,flow in enumerate(self.flows):
+            body.append(f"    rates[{e}] = {printer.emit(flow)}")
+        body.append("    return rates")
+        return printer.function("rates","y,t,state",body)
+
+
+    def parameters(self):
+        """Layout of the parameters values in a vector p, parameters are sorted by name
+        Vector parameters (e.g. contact rows) take one slot per element
+
+        Returns:
+            params (list): Param objects of all flows and static derivatives
+            sizes (list): number of slots of each parameter
+            offsets (np.ndarray): position of the first slot of each parameter, the last element is the total size
+            slots (dict): parameter key -> position, as given to CodePrinter
+        """
+        params = set()
+        for expr in self.flows + [expr for _,expr in self.static]:
+            params |= expr.params
+        params = sorted(params,key = lambda param:param.name)
+        sizes = [int(np.size(param(None,0))) for param in params]
+        offsets = np.concatenate([[0],np.cumsum(sizes)]).astype(int)
+        slots = {param.key:int(offset) for param,offset in zip(params,offsets)}
+        return params,sizes,offsets,slots
+
+
+    def _generate_derivative(self,slots = None):
+        # Each flow is computed once then added to its target and substracted from its source
+        # With slots, the generated function derivative(y,p) reads parameters values from p (see CodePrinter)
+        printer = CodePrinter(self.compartments,slots = slots)
+        terms = [[] for _ in range(self.n)]
+        for e,flow in enumerate(self.flows):
+            if flow == ZERO:
+                continue
+            code = printer.emit(flow)
+            terms[self.target[e]].append((1,code))
+            terms[self.source[e]].append((-1,code))
+        for i,expr in self.static:
+            terms[i].append((1,printer.emit(expr)))
+
+        body = ["    dydt = np.zeros(np.shape(y))"]
+        for i in range(self.n):
+            if len(terms[i]) > 0:
+                body.append(f"    dydt[{i}] = {self._accumulate(printer,terms[i])}")
+        body.append("    return dydt")
+        return printer.function("derivative","y,t,state" if slots is None else "y,p",body)
+
+
+    def _generate_jacobian(self):
+        # Partial derivatives of each flow are computed once and combined as for the derivative
+        position = {c:i for i,c in enumerate(self.compartments)}
+        printer = CodePrinter(self.compartments)
+        terms = {}
+        exprs = [(self.target[e],1,flow) for e,flow in enumerate(self.flows)] + [(self.source[e],-1,flow) for e,flow in enumerate(self.flows)]
+        for i,sign,expr in exprs + [(i,1,expr) for i,expr in self.static]:
+            for name in sorted(expr.compartments,key = position.get):
+                terms.setdefault((i,position[name]),[]).append((sign,printer.emit(expr.diff(name))))
+
+        body = [f"    jac = np.zeros(({self.n},{self.n}))"]
+        for (i,j),entry in sorted(terms.items()):
+            body.append(f"    jac[{i},{j}] = {self._accumulate(printer,entry)}")
+        body.append("    return jac")
+        return printer.function("jacobian","y,t,state",body)
+
+
+
+def _partial(flow,name,y,t):
+    """Partial derivative of a transition with respect to a compartment, at state y (ArrayState)
+    Symbolic transitions are differentiated exactly, lambdas by forward finite differences
+    """
+    if isinstance(flow,(Expr,numbers.Number)):
+        flow = as_expr(flow)
+        return flow.diff(name)(y,t) if name in flow.compartments else 0.0
+
+    values = y.values
+    i = y.index.index(name)
+    h = np.sqrt(np.finfo(float).eps) * max(1,abs(values[i]))
+    base = flow(y,t)
+    step = values.copy()
+    step[i] += h
+    y.values = step
+    value = (flow(y,t) - base) / h
+    y.values = values
+    return value
+
+
+def next_generation_matrix(compartments,flows,source,target,infected,y,t = 0):
+    """Next generation matrix K = F V^-1 of the infected compartments (van den Driessche & Watmough)
+    New infections are the flows entering an infected compartment from a non infected one,
+    all other flows in and out of infected compartments are transfers.
+
+    Args:
+        compartments (list): names of all compartments
+        flows (list): expressions or lambdas of the transitions
+        source,target (list): compartment index of the start and end of each transition
+        infected (list): names of the infected compartments
+        y (ArrayState): disease free state given to the transitions
+        t (float): time at which time dependent parameters are evaluated
+
+    Returns:
+        np.ndarray: next generation matrix of shape (infected x infected)
+    """
+    position = {c:i for i,c in enumerate(infected)}
+    m = len(infected)
+    F,V = np.zeros((m,m)),np.zeros((m,m))
+
+    for flow,s,e in zip(flows,source,target):
+        start,end = compartments[s],compartments[e]
+        if start not in position and end not in position:
+            continue
+        for name in infected:
+            value = _partial(flow,name,y,t)
+            j = position[name]
+            if end in position and start not in position:
+                F[position[end],j] += value
+            else:
+                if start in position:
+                    V[position[start],j] += value
+                if end in position:
+                    V[position[end],j] -= value
+
+    return F @ np.linalg.inv(V)
@@ -0,0 +1,108 @@
+"""Batch calibration of one model per departement
+The national case file is loaded once and partitioned by departement,
+then each calibration runs in a forked worker process and results are gathered in a single parameters table.
+"""
+
+import os
+import time
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from ..dataset import fetch_daily_case_departements
+
+
+# Calibration context held by each worker process
+# Workers are forked from the main process, so cases and the model factory are shared without pickling
+_worker_context = None
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _timeout_handler(signum,frame):
+    raise TimeoutError("Calibration exceeded its timeout")
+
+
+def _calibrate_worker(dep):
+    make_model,cases,space,cols,timeout,fit_kwargs = _worker_context
+    start = time.time()
+    row = {"departement":dep}
+
+    # Hard timeout on the whole task, the calibration is interrupted in the worker
+    if timeout is not None:
+        signal.signal(signal.SIGALRM,_timeout_handler)
+        signal.alarm(int(timeout))
+
+    try:
+        model = make_model(dep,cases[dep])
+        model.fit(cases[dep][cols],space,save = False,**fit_kwargs)
+        row.update({
+            "status":"ok",
+            "loss":float(model.opt.study.best_value),
+            "n_trials":len(model.opt.study.trials),
+            **model.opt.study.best_params,
+        })
+    except TimeoutError:
+        row["status"] = "timeout"
+    except Exception as e:
+        row.update({"status":"failed","error":repr(e)})
+    finally:
+        if timeout is not None:
+            signal.alarm(0)
+
+    row["duration"] = time.time() - start
+    return row
+
+
+def calibrate_departements(make_model,space,deps = None,cases = None,cols = ["D","H","ICU"],n_jobs = None,timeout = None,filename = None,**kwargs):
+    """Calibrate one model per departement on a pool of worker processes
+
+    Args:
+        make_model (callable): function make_model(dep,cases) returning the model to calibrate for a departement
+        space (dict): optimization space given to .fit()
+        deps (list): departements codes, defaults to all departements with cases (see fetch_list_available_departements)
+        cases (dict): cases by departement as returned by fetch_daily_case_departements, loaded once if not given
+        cols (list): observed columns used for calibration
+        n_jobs (int): number of worker processes, defaults to the number of CPUs
+        timeout (int): maximum duration in seconds of each calibration, unfinished ones are marked as "timeout"
+        filename (str): .csv parameters table where to write results, rows of already calibrated departements are replaced
+        **kwargs: other options given to .fit() (n, loss, method, ...)
+
+    Returns:
+        pd.DataFrame: one row per departement with status, loss, duration and calibrated parameters
+    """
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise Exception("Batch calibration requires forked processes to share data with workers, which is not available on this platform")
+
+    # Load and partition the case file once
+    if cases is None:
+        cases = fetch_daily_case_departements(deps)
+    if deps is None:
+        deps = list(cases.keys())
+
+    # Run calibrations across the pool, results are gathered as they complete
+    context = multiprocessing.get_context("fork")
+    rows = []
+    with ProcessPoolExecutor(n_jobs or os.cpu_count(),mp_context = context,initializer = _init_worker,initargs = ((make_model,cases,space,cols,timeout,kwargs),)) as pool:
+        futures = [pool.submit(_calibrate_worker,dep) for dep in deps]
+        for future in as_completed(futures):
+            row = future.result()
+            print(f"... Departement {row['departement']} calibrated with status {row['status']} in {row['duration']:.1f}s")
+            rows.append(row)
+
+    params = pd.DataFrame(rows).set_index("departement").loc[deps]
+
+    # Write a single consolidated table
+    if filename is not None:
+        if os.path.exists(filename):
+            previous = pd.read_csv(filename,dtype = {"departement":str}).set_index("departement")
+            params = pd.concat([previous.drop(params.index,errors = "ignore"),params])
+        params.to_csv(filename)
+        print(f"... Parameters saved in table {filename}")
+
+    return params
@@ -1,5 +1,6 @@
 
 import numpy as np
+from scipy.special import gammaln
 from sklearn.metrics import mean_squared_error
 
 
@@ -34,3 +35,132 @@ def custom_loss(pred,true,cols = None,normalize = True):
 
     return loss,loss_dict
 
+
+
+
+class ObservationLoss:
+    def __init__(self,true,cols = None,loss = "mse",normalize = True,weights = None,dispersion = 10):
+        """Loss on observations precomputed once per calibration
+        Observed values, normalizers and the positions of observed dates and compartments in the solver output
+        are prepared once, then each trial is a single vectorized reduction on a (time x observed column) slice
+
+        Args:
+            true (pd.DataFrame): observed values by date, columns are compartments or aggregated states
+            cols (list): columns on which to compute the loss, defaults to all columns
+            loss (str or callable): "mse", "weighted_mse", "poisson", "nb" or a function loss(pred,true) on arrays
+            normalize (bool): divide squared errors by the squared max of each column (mse losses)
+            weights (dict or list): weight of each column for "weighted_mse"
+            dispersion (float): dispersion parameter of the negative binomial distribution for "nb"
+        """
+        assert callable(loss) or loss in ["mse","weighted_mse","poisson","nb"]
+
+        self.cols = true.columns.tolist() if cols is None else list(cols)
+        self.index = true.index
+        self.true = true[self.cols].values.astype(float)
+        self.loss = loss
+        self.dispersion = dispersion
+
+        # Normalizers by column
+        self.scale = np.max(self.true,axis = 0)**2 if normalize else np.ones(len(self.cols))
+
+        # Weights by column
+        if isinstance(weights,dict):
+            weights = [weights.get(col,1) for col in self.cols]
+        self.weights = np.ones(len(self.cols)) if weights is None else np.array(weights,dtype = float)
+
+        # Positions in the solver output, prepared on the first call
+        self._key = None
+
+
+    def _prepare(self,states,partial = False):
+        """Positions of observed dates and aggregation matrix from compartments to observed columns
+        """
+        key = (len(states.index),states.index[0],tuple(states.compartments),partial)
+        if key != self._key:
+            rows = states.index.get_indexer(self.index)
+            if (rows < 0).any() and not partial:
+                raise KeyError("Some observed dates are missing from the prediction")
+            self.rows = rows[rows >= 0]
+            self.observed = self.true[rows >= 0]
+            self.aggregation = np.zeros((len(states.compartments),len(self.cols)))
+            for j,col in enumerate(self.cols):
+                self.aggregation[states.positions(col),j] = 1
+            self._key = key
+
+
+    def __call__(self,states,partial = False):
+        """Compute the loss on an ArrayStates prediction
+
+        Args:
+            states (ArrayStates): prediction of the model
+            partial (bool): only use observed dates covered by the prediction, e.g. during a chunked integration
+
+        Returns:
+            loss (float): total loss
+            loss_dict (dict): loss by column and total loss
+        """
+        self._prepare(states,partial)
+        pred,true = states.values[self.rows] @ self.aggregation,self.observed
+
+        if callable(self.loss):
+            loss = float(self.loss(pred,true))
+            return loss,{"loss":loss}
+
+        if self.loss in ["mse","weighted_mse"]:
+            losses = ((pred - true)**2).mean(axis = 0) / self.scale
+            if self.loss == "weighted_mse":
+                losses = losses * self.weights
+            loss = np.sqrt(losses.sum())
+
+        elif self.loss == "poisson":
+            mu = np.clip(pred,1e-9,None)
+            losses = (mu - true * np.log(mu) + gammaln(true + 1)).mean(axis = 0)
+            loss = losses.sum()
+
+        else:
+            mu,r = np.clip(pred,1e-9,None),self.dispersion
+            y = np.clip(true,0,None)
+            log_likelihood = gammaln(y + r) - gammaln(r) - gammaln(y + 1) + r * np.log(r / (r + mu)) + y * np.log(mu / (r + mu))
+            losses = -log_likelihood.mean(axis = 0)
+            loss = losses.sum()
+
+        # Convert to float over numpy float to ensure serialization
+        loss_dict = {f"loss_{col}":float(value) for col,value in zip(self.cols,losses)}
+        loss_dict["loss"] = float(loss)
+        return float(loss),loss_dict
+
+
+    def gradient(self,states,sensitivities):
+        """Compute the loss and its gradient with respect to parameters from forward sensitivities
+
+        Args:
+            states (ArrayStates): prediction of the model
+            sensitivities (np.ndarray): derivatives of the states with respect to parameters (time x compartment x parameter)
+
+        Returns:
+            loss (float): total loss
+            gradient (np.ndarray): gradient of the loss by parameter
+        """
+        if callable(self.loss):
+            raise Exception("Gradient is not available for custom loss functions")
+
+        loss,_ = self(states)
+        pred,true = states.values[self.rows] @ self.aggregation,self.observed
+        n_obs = len(true)
+
+        # Derivative of the loss with respect to each predicted value
+        if self.loss in ["mse","weighted_mse"]:
+            weights = self.weights if self.loss == "weighted_mse" else 1
+            dpred = weights * (pred - true) / (n_obs * self.scale * max(loss,1e-12))
+        elif self.loss == "poisson":
+            mu = np.clip(pred,1e-9,None)
+            dpred = (1 - true / mu) / n_obs
+        else:
+            mu,r = np.clip(pred,1e-9,None),self.dispersion
+            y = np.clip(true,0,None)
+            dpred = ((r + y) / (r + mu) - y / mu) / n_obs
+
+        # Chain rule through aggregation of compartments
+        dstates = dpred @ self.aggregation.T
+        gradient = np.einsum("tc,tcp->p",dstates,sensitivities[self.rows])
+        return loss,gradient
@@ -17,22 +17,57 @@ else:
     from tqdm import tqdm
 
 from scipy.stats import norm
+from scipy.optimize import minimize
 import yaml
 import time
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # Optuna imports
 import optuna
-from optuna.pruners import SuccessiveHalvingPruner
+from optuna.pruners import MedianPruner
 from optuna.pruners import HyperbandPruner
 from optuna.samplers import TPESampler
+from optuna.trial import TrialState, create_trial
+from optuna.distributions import UniformDistribution
 from optuna import visualization
 
+from .utils import read_yaml
+from .metrics import ObservationLoss
+
+
+class WindowMedianPruner(MedianPruner):
+    """Median pruner for the partial losses reported by a chunked integration
+    Partial losses grow as windows cover more observed dates, and MedianPruner compares the best value over all steps,
+    which would always be the first window. Only the loss of the last window is compared to the median of completed trials at the same window.
+    """
+    def prune(self,study,trial):
+        if trial.last_step is not None:
+            trial = copy.copy(trial)
+            trial.intermediate_values = {trial.last_step:trial.intermediate_values[trial.last_step]}
+        return super().prune(study,trial)
+
+
 
 class EarlyStoppingError(Exception):
     count = 0
 
 
 
+# Objective function held by each worker process in parallel optimization
+# Workers are forked from the main process, so each of them owns a copy of the model
+_worker_objective = None
+
+def _init_worker(objective_fn):
+    global _worker_objective
+    _worker_objective = objective_fn
+
+def _evaluate_worker(params):
+    return _worker_objective(params)
+
+
+
 class ParamsOptimizer:
 
     def __init__(self,model):
@@ -62,6 +97,35 @@ class ParamsOptimizer:
         return params
 
 
+    @staticmethod
+    def _warm_start_params(warm_start,space,n_best = 10):
+        """Parameters sets to enqueue in the study before sampling
+        Values outside of the space are clipped to its bounds and parameters missing from the space are ignored
+
+        Args:
+            warm_start (str, dict, list or optuna.Study): path to a .yaml file saved with save_params, 
+                parameters dict or list of dicts, or another study whose best trials are used
+            space (dict): optimization space
+            n_best (int): number of best trials to take from a study
+        """
+        if isinstance(warm_start,optuna.Study):
+            trials = [t for t in warm_start.get_trials(deepcopy = False) if t.state == TrialState.COMPLETE]
+            warm_start = [t.params for t in sorted(trials,key = lambda t : t.value)[:n_best]]
+        elif isinstance(warm_start,str):
+            warm_start = read_yaml(warm_start)["calibrated_params"]
+        if isinstance(warm_start,dict):
+            warm_start = [warm_start]
+
+        all_params = []
+        for params in warm_start:
+            params = {k:v for k,v in params.items() if k in space}
+            for key,value in params.items():
+                if isinstance(space[key],tuple):
+                    params[key] = min(max(float(value),space[key][0]),space[key][1])
+            all_params.append(params)
+        return all_params
+
+
     def save_params(self,filename:str = None,message:str = None,info:dict = None):
         """Save parameters in a .yaml file
 
@@ -113,29 +177,47 @@ class ParamsOptimizer:
         callbacks = None,
         show_progress_bar = True,
         n_jobs = 1,
+        seed = None,
+        loss = None,
+        storage = None,
+        study_name = None,
+        warm_start = None,
+        chunk_size = None,
+        pruner = None,
         info = None,
         save = True,
         filename = None,
     ):
 
-        # Verify n_jobs is equal to 1
-        assert n_jobs == 1, f"Parallel optimization is not implemented yet"
-
         # Disable default logging of Optuna
         optuna.logging.disable_default_handler()
 
         # Prepare Optuna objective function
+        # With a chunk size, the model is integrated by windows and intermediate losses are reported to the pruner
+        # Pruning is only available in sequential optimization, as workers don't have access to the trials
         if objective_fn is None:
-            objective_fn = lambda params : self.model.objective(true,params,init_state = init_state,constraint = constraint)
+            objective_fn = lambda params,trial = None : self.model.objective(true,params,init_state = init_state,constraint = constraint,loss = loss,trial = trial,chunk_size = chunk_size)
         def objective(trial):
             params = self._sample(trial,space)
+            if chunk_size is not None:
+                return objective_fn(params,trial = trial)
             return objective_fn(params)
 
         # Create Optuna study
         # Possibility here to change sampler and pruner
-        sampler = TPESampler()
-        pruner = HyperbandPruner()
-        self.study = optuna.create_study(direction= "minimize",pruner=SuccessiveHalvingPruner(),sampler = TPESampler())
+        # With a storage URL (e.g. "sqlite:///calibration.db") and a study name, an existing study is resumed and extended by n trials
+        sampler = TPESampler(seed = seed)
+        # By default a trial is pruned when its partial loss is worse than the median of completed trials at the same window,
+        # only after a few complete trials and once the first windows, where all trajectories are still close, are integrated
+        if pruner is None:
+            pruner = WindowMedianPruner(n_startup_trials = 10,n_warmup_steps = 2)
+        self.study = optuna.create_study(direction= "minimize",pruner=pruner,sampler = sampler,
+            storage = storage,study_name = study_name,load_if_exists = True)
+
+        # Warm start the sampler with previous results, they are evaluated first
+        if warm_start is not None:
+            for params in self._warm_start_params(warm_start,space):
+                self.study.enqueue_trial(params)
 
         # Create callback
         pbar = tqdm(range(0,n),desc = "Parameters Optimization")
@@ -154,15 +236,25 @@ class ParamsOptimizer:
         try:
             if callbacks is None: callbacks = []
 
-            self.study.optimize(
-                objective,
-                n_trials = n,
-                n_jobs = n_jobs,
-                show_progress_bar = False,
-                timeout = timeout,
-                gc_after_trial = False, # is it accelerating computation ?
-                callbacks = [custom_callback] + callbacks
-            )
+            if n_jobs == 1:
+                self.study.optimize(
+                    objective,
+                    n_trials = n,
+                    n_jobs = n_jobs,
+                    show_progress_bar = False,
+                    timeout = timeout,
+                    gc_after_trial = False, # is it accelerating computation ?
+                    callbacks = [custom_callback] + callbacks
+                )
+            else:
+                self._optimize_parallel(
+                    objective_fn,
+                    space,
+                    n_trials = n,
+                    n_jobs = n_jobs,
+                    timeout = timeout,
+                    callbacks = [custom_callback] + callbacks
+                )
 
         except EarlyStoppingError:
             print(f"... Early stopping - best value has not changed since {early_stopping} trials at {self.study.best_value}")
@@ -172,7 +264,127 @@ class ParamsOptimizer:
         print(f"... Found best solution {best} for value {self.study.best_value}")
 
         # Compute final loss
-        loss_dict = self.model.objective(true,best,init_state,return_dict = True)
+        loss_dict = self.model.objective(true,best,init_state,return_dict = True,loss = loss)
+        if info is None:
+            info = {}
+
+        # Save parameters
+        if save:
+            self.save_params(filename,message = "Parameters calibration",info = {
+                "on":true.columns.tolist(),
+                "init_state":init_state,
+                **loss_dict,
+                **info
+            })
+
+        return best
+
+
+    def run_lbfgs(self,true,space,init_state = None,n_seeds = 20,n_starts = 3,loss = None,maxiter = 50,seed = None,
+        integers = None,
+        maxiter_integers = 5,
+        info = None,
+        save = True,
+        filename = None,
+        **kwargs,
+    ):
+        """Gradient based calibration with bounded quasi-Newton (L-BFGS-B)
+        Gradients of the loss are computed from forward sensitivities of the model states, see model.solve_sensitivities
+        A short TPE search gives n_starts starting points, then each of them is refined with L-BFGS-B.
+        Integer parameters (e.g. the offset) have no gradient, they are held fixed at their rounded value during L-BFGS-B.
+        They are then searched by steps of 1 around the best solution as long as the loss improves, each neighbour
+        being warm started from the current solution with a few iterations, and the final solution is refined again.
+        The number of solves with sensitivities is stored in .n_solves and saved with the parameters.
+        The best solution is added to the study so that other methods (save_params, sample_params, ...) keep working.
+
+        Args:
+            true (pd.DataFrame): observed values by date
+            space (dict): optimization space, only uniform bounds (low,high) are supported
+            init_state (dict, list, tuple, numpy array): the first value to initialize the solver
+            n_seeds (int): number of TPE trials used to find starting points
+            n_starts (int): number of starting points refined with L-BFGS-B
+            loss (ObservationLoss): loss prepared on true, defaults to mse
+            maxiter (int): maximum number of L-BFGS-B iterations for each start
+            seed (int): random seed of the TPE sampler
+            integers (list): integer parameters of the space, defaults to ["offset"] if it is in the space
+            maxiter_integers (int): maximum number of L-BFGS-B iterations for each neighbour of the integer parameters
+            **kwargs: other options given to .run() for the TPE search (storage, warm_start, ...)
+
+        Returns:
+            dict: best parameters
+        """
+        assert all(isinstance(v,tuple) for v in space.values()),"Gradient based calibration only supports uniform (low,high) spaces"
+        if not isinstance(loss,ObservationLoss):
+            loss = ObservationLoss(true,loss = "mse" if loss is None else loss)
+
+        # Starting points from a short TPE search
+        self.run(true,space,init_state = init_state,n = n_seeds,loss = loss,seed = seed,save = False,**kwargs)
+        trials = [t for t in self.study.get_trials(deepcopy = False) if t.state == TrialState.COMPLETE]
+        starts = [t.params for t in sorted(trials,key = lambda t : t.value)[:n_starts]]
+
+        # Integer parameters are searched apart from the continuous ones
+        if integers is None:
+            integers = ["offset"] if "offset" in space else []
+        names = [name for name in space if name not in integers]
+        assert len(names) > 0,"Gradient based calibration needs at least one continuous parameter"
+        bounds = [space[name] for name in names]
+
+        # Loss and gradient from a single solve with sensitivities
+        def fun(x,fixed):
+            params = {**fixed,**dict(zip(names,x))}
+            states,sensitivities = self.model.solve_sensitivities(params,names,true.index,init_state = init_state,start_date = true.index[0])
+            return loss.gradient(states,sensitivities)
+
+        def refine(x0,fixed,maxiter):
+            result = minimize(fun,x0,args = (fixed,),jac = True,method = "L-BFGS-B",bounds = bounds,options = {"maxiter":maxiter})
+            result.params = {**fixed,**{name:float(value) for name,value in zip(names,result.x)}}
+            return result
+
+        # Refine each starting point with integer parameters held fixed
+        self.lbfgs_results = []
+        for params in tqdm(starts,desc = "L-BFGS-B refinement"):
+            fixed = {name:int(round(params[name])) for name in integers}
+            self.lbfgs_results.append(refine([params[name] for name in names],fixed,maxiter))
+        result = min(self.lbfgs_results,key = lambda r : r.fun)
+
+        # Then move integer parameters of the best solution by steps of 1 while it improves the loss,
+        # each neighbour is warm started from the current continuous optimum with a few iterations only
+        incumbent = result
+        visited = {tuple(result.params[name] for name in integers)}
+        improved = len(integers) > 0
+        while improved:
+            improved = False
+            for name,step in [(name,step) for name in integers for step in [-1,1]]:
+                fixed = {**{n:incumbent.params[n] for n in integers},name:incumbent.params[name] + step}
+                key = tuple(fixed[n] for n in integers)
+                if key in visited or not space[name][0] <= fixed[name] <= space[name][1]:
+                    continue
+                visited.add(key)
+                candidate = refine(incumbent.x,fixed,maxiter_integers)
+                self.lbfgs_results.append(candidate)
+                if candidate.fun < incumbent.fun:
+                    incumbent,improved = candidate,True
+                    break
+
+        # Full refinement at the new integer values
+        if incumbent is not result:
+            self.lbfgs_results.append(refine(incumbent.x,{name:incumbent.params[name] for name in integers},maxiter))
+        result = min(self.lbfgs_results,key = lambda r : r.fun)
+        best = result.params
+        self.n_solves = sum(r.nfev for r in self.lbfgs_results)
+        print(f"... Found best solution {best} for value {result.fun} in {self.n_solves} solves after {n_seeds} TPE trials")
+
+        # Add the solution to the study if it improves on TPE trials
+        if result.fun < self.study.best_value:
+            self.study.add_trial(create_trial(
+                params = best,
+                distributions = {name:UniformDistribution(*space[name]) for name in best},
+                value = float(result.fun),
+            ))
+        best = self.study.best_params
+
+        # Compute final loss
+        loss_dict = self.model.objective(true,best,init_state,return_dict = True,loss = loss)
         if info is None:
             info = {}
 
@@ -181,6 +393,8 @@ class ParamsOptimizer:
             self.save_params(filename,message = "Parameters calibration",info = {
                 "on":true.columns.tolist(),
                 "init_state":init_state,
+                "method":"lbfgs",
+                "n_solves":self.n_solves,
                 **loss_dict,
                 **info
             })
@@ -188,6 +402,71 @@ class ParamsOptimizer:
         return best
 
 
+    def _optimize_parallel(self,objective_fn,space,n_trials,n_jobs,timeout = None,callbacks = None):
+        """Run the optimization on a pool of worker processes
+        The study lives in the main process and uses the ask and tell interface:
+            - n_jobs trials are sampled and submitted to the workers
+            - as soon as a worker is free, the result of the oldest trial is told to the study, callbacks are called,
+              and a new trial is sampled and submitted without waiting for the other workers
+        Trial k is always sampled knowing exactly the results of trials 0 to k - n_jobs, so runs with a seeded sampler are reproducible
+        whatever the workers timing, a free worker only waits when trial k - n_jobs is still running
+        Each worker is forked with its own copy of the model, which is reset with the sampled params at each trial
+        """
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise Exception("Parallel optimization requires forked processes to share the model with workers, which is not available on this platform")
+
+        if callbacks is None: callbacks = []
+        context = multiprocessing.get_context("fork")
+        start = time.time()
+        trials = []
+        running = {}
+        completed = {}
+        n_told = 0
+
+        def tell_next():
+            nonlocal n_told
+            value = completed.pop(n_told).result()
+            frozen_trial = self.study.tell(trials[n_told],value)
+            n_told += 1
+            for callback in callbacks:
+                callback(self.study,frozen_trial)
+
+        with ProcessPoolExecutor(n_jobs,mp_context = context,initializer = _init_worker,initargs = (objective_fn,)) as pool:
+            try:
+                while True:
+
+                    # Submit trial k once the result of trial k - n_jobs is told, until n_trials are submitted or the timeout is reached
+                    while len(trials) < n_trials and (timeout is None or time.time() - start < timeout):
+                        if len(trials) - n_jobs == n_told:
+                            if n_told not in completed:
+                                break
+                            tell_next()
+                        trial = self.study.ask()
+                        running[pool.submit(_evaluate_worker,self._sample(trial,space))] = len(trials)
+                        trials.append(trial)
+
+                    # Once all trials are submitted, results are told as soon as all previous ones are told
+                    else:
+                        while n_told in completed:
+                            tell_next()
+                        if len(running) == 0:
+                            break
+
+                    # Collect completed trials, an error in a worker is raised when its result is told
+                    done,_ = wait(running,return_when = FIRST_COMPLETED)
+                    for future in done:
+                        completed[running.pop(future)] = future
+
+            except BaseException:
+                # Trials not told yet are not evaluated (errors, early stopping)
+                for future in running:
+                    future.cancel()
+                for trial in trials[n_told:]:
+                    self.study.tell(trial,state = TrialState.FAIL)
+                raise
+
+
     def show_contour(self,params = None):
         return visualization.plot_contour(self.study,params = params)
 
@@ -1,10 +1,9 @@
 import numpy as np
-from ..dataset import get_contact_matrices
+from ..dataset import load_contact_matrices
 
 
-matrices = get_contact_matrices()["non"]
-
 def contact_matrix_response(y, t, start, end, coeffs, coeffs_deconfinement=None, seniors=False):
+    matrices = load_contact_matrices("non")
     if t >= start and t < end:
         return {"category" : np.sum([coeffs[k]*matrices[k] for k in matrices.keys()],
                                    axis=0)}
@@ -24,6 +23,7 @@ def contact_matrix_response(y, t, start, end, coeffs, coeffs_deconfinement=None,
                                    axis=0)}
 
 def case_isolation_response(y, t, start, value, end=np.infty):
+    matrices = load_contact_matrices("non")
     if t < start:
         return 0
     else:
@@ -0,0 +1,80 @@
+"""Time varying parameters schedules
+Schedules are callables with the signature fn(y,t) used for parameters in transitions,
+they are backed by sorted numpy arrays and can be evaluated on a whole time vector at once.
+Breakpoints are the times where a schedule is not smooth, solvers can stop there to avoid step rejections.
+"""
+
+import numpy as np
+
+from .utils import SigmoidResponse
+
+
+class Schedule:
+    breakpoints = np.array([])
+
+    def __call__(self,y,t):
+        return self.evaluate(t)
+
+    def evaluate(self,t):
+        """Evaluate the schedule for a scalar time or a vector of times
+        """
+        raise NotImplementedError
+
+
+class PiecewiseSchedule(Schedule):
+    def __init__(self,dates,values):
+        """Piecewise constant schedule, values[i] is used for dates[i] < t <= dates[i+1] and the last value after the last date
+        Like the dictionaries parameters {"dates":[...],"values":[...]} it replaces, the last value is also used for t <= dates[0]
+
+        Args:
+            dates (list): dates where the value changes
+            values (list): values after each date
+        """
+        assert len(dates) == len(values),"Dates and values should have the same length"
+        order = np.argsort(dates,kind = "stable")
+        self.dates = np.asarray(dates,dtype = float)[order]
+        self.values = np.asarray(values,dtype = float)[order]
+        self.breakpoints = self.dates
+
+    def evaluate(self,t):
+        return self.values[np.searchsorted(self.dates,t,side = "left") - 1]
+
+
+class InterpolatedSchedule(Schedule):
+    def __init__(self,dates,values):
+        """Linear interpolation between values at given dates, values are constant outside of the dates range
+
+        Args:
+            dates (list): dates of the values
+            values (list): values at each date
+        """
+        assert len(dates) == len(values),"Dates and values should have the same length"
+        order = np.argsort(dates,kind = "stable")
+        self.dates = np.asarray(dates,dtype = float)[order]
+        self.values = np.asarray(values,dtype = float)[order]
+        self.breakpoints = self.dates
+
+    def evaluate(self,t):
+        return np.interp(t,self.dates,self.values)
+
+
+class SigmoidSchedule(Schedule):
+    def __init__(self,start,values,dates,durations = 4,interval = 0.95):
+        """Smooth transitions between values with sigmoid responses, see SigmoidResponse
+
+        Args:
+            start (float): value before the first date
+            values (list): values reached after each transition
+            dates (list): start dates of the transitions
+            durations (int or list): durations of the transitions
+            interval (float): intensity of the shift reached at the end of each transition
+        """
+        self.start = start
+        self.values = list(values)
+        self.dates = list(dates)
+        self.durations = durations
+        self.interval = interval
+        self.response = SigmoidResponse(start,values,dates,durations,interval)
+
+    def evaluate(self,t):
+        return self.response(t)
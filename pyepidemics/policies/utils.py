@@ -15,8 +15,50 @@ def sigmoid_response(t,start_date,start,end,duration,interval = 0.95):
     return (start-end) / (1 + np.exp(-k*(-t+inflection))) + end
 
 
-def multiple_sigmoid_response(t,start,values,dates,durations = 4,interval = 0.95):
+class SigmoidResponse:
+    def __init__(self,start,values,dates,durations = 4,interval = 0.95):
+        """Sum of sigmoid responses from start to each of the values, see sigmoid_response
+        Steepness k and inflection of every transition are precomputed as arrays,
+        so the response is evaluated for all transitions in one broadcasted expression,
+        for a scalar t or a whole time vector.
+        The sum telescopes to values[-1] + sum_i (previous_i - values_i) / (1 + exp(-k_i(-t+inflection_i)))
+        """
+        values = np.asarray(values,dtype = float)
+        dates = np.asarray(dates,dtype = float)
+        if not isinstance(durations,(list,tuple,np.ndarray)):
+            durations = [durations] * len(values)
+        durations = np.asarray(durations,dtype = float)
+
+        self.k = 2/durations * np.log(interval/(1 - interval))
+        self.inflection = dates + durations/2
+        self.amplitudes = np.concatenate([[start],values[:-1]]) - values
+        self.end = values[-1]
+
+    def __call__(self,t):
+        t = np.asarray(t,dtype = float)
+        yt = self.end + (self.amplitudes / (1 + np.exp(-self.k*(-t[...,None]+self.inflection)))).sum(axis = -1)
+        return yt if yt.ndim > 0 else float(yt)
+
+
+class PiecewiseResponse:
+    def __init__(self,start,values,dates):
+        """Piecewise constant response, start until the first date then each value from its date
+        Values are looked up with a binary search on the sorted dates, for a scalar t or a whole time vector
+        Times before 0 take the last value
+        """
+        self.dates = np.asarray([0]+list(dates),dtype = float)
+        self.values = np.asarray([start]+list(values),dtype = float)
+
+    def __call__(self,t):
+        t = np.asarray(t,dtype = float)
+        position = np.searchsorted(self.dates,t,side = "right") - 1
+        yt = np.where(position < 0,self.values[-1],self.values[np.clip(position,0,None)])
+        return yt if yt.ndim > 0 else float(yt)
+
 
+def multiple_sigmoid_response(t,start,values,dates,durations = 4,interval = 0.95):
+    """Sum of sigmoid responses evaluated directly, cheaper than building a SigmoidResponse for a single call
+    """
     duration = durations[0] if isinstance(durations,list) else durations
 
     yt = sigmoid_response(t,dates[0],start,values[0],duration,interval)
@@ -30,9 +72,10 @@ def multiple_sigmoid_response(t,start,values,dates,durations = 4,interval = 0.95
 
 
 def piecewise_response(t,start,values,dates):
+    """Piecewise constant response for a scalar t, see PiecewiseResponse for vectors of times
+    """
     all_dates = [0]+list(dates)
     all_values = [start]+list(values)
-    intervals = [(all_dates[i],all_dates[i+1]) for i in range(len(all_dates) - 1)]
     for i in range(len(all_dates) - 1):
         if all_dates[i] <= t < all_dates[i+1]:
             return all_values[i]
@@ -54,9 +97,9 @@ def make_dynamic_fn(values,transition = 4,sigmoid = True):
         raise Exception(f"Invalid values {values}")
 
     if sigmoid:
-        return lambda t : multiple_sigmoid_response(t,start,values,dates,transition)
+        return SigmoidResponse(start,values,dates,transition)
     else:
-        return lambda t : piecewise_response(t,start,values,dates)
+        return PiecewiseResponse(start,values,dates)
 
 
 
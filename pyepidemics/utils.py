@@ -5,36 +5,65 @@ import json
 import numpy as np
 import pandas as pd
 from scipy.signal import savgol_filter
-import statsmodels.api as sm
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+# Factorizations of the Hodrick Prescott system by series length and smoothing parameter
+_HP_FACTORIZATIONS = {}
+
+def _hp_factorization(n,p):
+    """Sparse LU factorization of (I + p D'D) with D the second order difference operator
+    """
+    if (n,p) not in _HP_FACTORIZATIONS:
+        D = sparse.diags([1.,-2.,1.],[0,1,2],shape = (n-2,n))
+        _HP_FACTORIZATIONS[(n,p)] = splu((sparse.eye(n) + p * (D.T @ D)).tocsc())
+    return _HP_FACTORIZATIONS[(n,p)]
+
+
+def smooth_block(Y,p = 6.25):
+    """Hodrick Prescott trend of each column of a (time x series) array
+    All series are smoothed with a single solve reusing one factorization of the penalty matrix
+    Series with less than 3 points have no second order difference and are returned unchanged, as with statsmodels
+    """
+    Y = np.asarray(Y,dtype = float)
+    if len(Y) < 3:
+        return Y.copy()
+    return _hp_factorization(len(Y),p).solve(Y)
+
 
 def smooth_series(y,p = 6.25):
     """Smooth a series in a dataframe using Hodrick Prescott Filter
     """
-    cycle, trend = sm.tsa.filters.hpfilter(y, p)
-    return trend
+    return pd.Series(smooth_block(y.values,p),index = y.index,name = y.name)
 
 
-def clean_series(y,smooth = False,p = 6.25,logsmooth = True):
-    """Clean outliers in a series in a dataframe
+def clean_frame(df,smooth = False,p = 6.25,logsmooth = True):
+    """Clean outliers in each column of a dataframe, see clean_series
+    All columns are smoothed at once on the (time x series) block
     """
 
     # Remove null values in the middle of the series using interpolate
     # First null values are not interpolated but later filled by 0.0
-    y = y.replace(0.0,np.NaN).interpolate().fillna(0.0)
+    df = df.replace(0.0,np.NaN).interpolate().fillna(0.0)
+    Y = df.values.astype(float)
 
     # Smooth using Hodrick Prescott filter with parameter p
     if smooth:
-        y = smooth_series(y,p)
-        y.loc[(y < 1) & (y > 0)] = 1
+        Y = smooth_block(Y,p)
+        Y[(Y < 1) & (Y > 0)] = 1
 
     if logsmooth:
-        y = y.map(lambda x : np.log(1+x))
-        y = smooth_series(y,p)
-        y = y.map(lambda x : np.exp(x) - 1)
-        y.loc[(y < 1) & (y > 0)] = 1
-        y.loc[y < 0] = 0
+        Y = np.expm1(smooth_block(np.log1p(Y),p))
+        Y[(Y < 1) & (Y > 0)] = 1
+        Y[Y < 0] = 0
+
+    return pd.DataFrame(Y,index = df.index,columns = df.columns)
+
 
-    return y
+def clean_series(y,smooth = False,p = 6.25,logsmooth = True):
+    """Clean outliers in a series in a dataframe
+    """
+    return clean_frame(y.to_frame(),smooth = smooth,p = p,logsmooth = logsmooth).iloc[:,0]
 
 def load_json(json_path):
     with open(json_path) as f:
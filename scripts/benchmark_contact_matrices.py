@@ -0,0 +1,49 @@
+"""Benchmark of the per-trial overhead of contact matrices loading in COVID19Category
+Before: contact matrices were read and parsed from disk at each call of get_contact_matrices
+After: they are loaded once per process with load_contact_matrices and weighted sums are precomputed
+"""
+import time
+import numpy as np
+
+import sys
+sys.path.append("../")
+
+from pyepidemics.models import COVID19Category
+from pyepidemics.dataset import get_contact_matrices, load_contact_matrices
+
+N = [13.45e6, 36.05e6, 15.39e6]
+places = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
+constant_coeffs = {k:1 for k in places}
+dynamic_coeffs = {k:{"dates":[0,53],"values":[1,0]} for k in places}
+n_trials = 100
+
+
+def timeit(fn,n = n_trials):
+    start = time.time()
+    for _ in range(n):
+        fn()
+    return (time.time() - start) / n * 1000
+
+
+# Loading overhead for one category node
+before = timeit(lambda : get_contact_matrices()["non"])
+after = timeit(lambda : load_contact_matrices("non"))
+print(f"Contact matrices loading: {before:.3f} ms before, {after:.3f} ms after")
+
+# Loading overhead of a reset in a calibration trial
+# Before, matrices were loaded once per category node, ie the loop below is timed as it ran at each reset
+categories = ["young","adult","senior"]
+before = timeit(lambda : [get_contact_matrices()["non"] for _ in categories])
+after = timeit(lambda : [load_contact_matrices("non") for _ in categories])
+print(f"Contact matrices loading per reset: {before:.3f} ms before, {after:.3f} ms after")
+
+# Duration of a reset (one model construction) with the current implementation
+reset = timeit(lambda : COVID19Category(N = N,beta = [0.3]*3,contact_coeffs = dynamic_coeffs))
+print(f"Model reset per trial: {reset:.3f} ms")
+
+# Contact matrix evaluation inside derivatives
+for name,coeffs in [("constant",constant_coeffs),("time varying",dynamic_coeffs)]:
+    model = COVID19Category(N = N,beta = [0.3]*3,contact_coeffs = coeffs)
+    C = model.contact_matrix(("adult",))
+    evaluation = timeit(lambda : C(None,10),n = 10000)
+    print(f"Contact matrix evaluation with {name} coefficients: {evaluation*1000:.2f} µs")
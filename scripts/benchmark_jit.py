@@ -0,0 +1,65 @@
+"""Benchmark of the numba backend against the NumPy path on compiled models with symbolic transitions (symbolic = True)
+Fixed step RK4 integration and tau leaping simulations are timed with jit = False and jit = True,
+the first jitted call includes numba compilation and is reported separately
+"""
+import time
+import numpy as np
+
+import sys
+sys.path.append("../")
+
+from pyepidemics.models import SIR, SEIR, COVID19Category
+from pyepidemics.models.jit import HAS_NUMBA
+
+if not HAS_NUMBA:
+    print("numba is not installed, jit = True falls back to the NumPy path and there is nothing to compare")
+    sys.exit(0)
+
+places = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
+coeffs = {k:{"dates":[0,53],"values":[1,0.3]} for k in places}
+n_days = 300
+n_runs = 200
+n_trials = 5
+
+
+def timeit(fn,n = n_trials):
+    start = time.time()
+    for _ in range(n):
+        fn()
+    return (time.time() - start) / n * 1000
+
+
+def make_models(N):
+    """Models of each type on a population N, with their initial state"""
+    categories = np.array([0.2,0.55,0.25]) * N
+    covid = COVID19Category(N = categories.tolist(),beta = [0.3]*3,contact_coeffs = coeffs,symbolic = True)
+    covid_init = {**{f"S_{c}":n for c,n in zip(covid.dimensions["category"],categories)},"E_adult":10}
+    covid_init["S_adult"] -= 10
+    return [
+        ("SIR",SIR(N,0.3,0.1,symbolic = True),{"S":N - 10,"I":10}),
+        ("SEIR",SEIR(N,0.5,0.2,0.25,symbolic = True),{"S":N - 10,"I":10}),
+        ("COVID19Category",covid,covid_init),
+    ]
+
+
+# Deterministic integration with fixed steps
+print(f"RK4 integration over {n_days} days")
+for name,model,init_state in make_models(67e6):
+    model.compile()
+    solve = lambda jit : model.solve(n_days,init_state = init_state,solver = "rk4",as_array = True,jit = jit)
+    compilation = timeit(lambda : solve(True),n = 1)
+    before = timeit(lambda : solve(False))
+    after = timeit(lambda : solve(True))
+    error = np.max(np.abs(solve(True).values - solve(False).values))
+    print(f"... {name}: {before:.1f} ms with NumPy, {after:.1f} ms with numba (x{before/after:.0f}), first call {compilation:.0f} ms, max difference {error:.1e}")
+
+
+# Stochastic simulations on a small population
+print(f"Tau leaping with {n_runs} runs over {n_days} days")
+for name,model,init_state in make_models(1e4):
+    model.compile()
+    simulate = lambda jit : model.solve_stochastic(n_days,init_state = init_state,n_runs = n_runs,seed = 0,jit = jit)
+    compilation = timeit(lambda : simulate(True),n = 1)
+    before = timeit(lambda : simulate(False),n = 1)
+    after = timeit(lambda : simulate(True),n = 1)
+    print(f"... {name}: {before:.0f} ms with NumPy, {after:.0f} ms with numba (x{before/after:.1f}), first call {compilation:.0f} ms")
@@ -19,7 +19,7 @@ setuptools.setup(
         "pandas>=1.0.0",
         "scikit_learn==0.23.1",
         "matplotlib==3.1.3",
-        "optuna==1.3.0",
+        "optuna>=2.7.0",
         "pydeck==0.3.0b2",
         "requests==2.22.0",
         "plotly==4.6.0",
@@ -29,6 +29,10 @@ setuptools.setup(
         "PyYAML==5.3.1",
         "xlrd >= 1.0.0",
     ],
+    extras_require={
+        "parquet": ["pyarrow"],
+        "jit": ["numba"],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         "Programming Language :: Python :: 3",
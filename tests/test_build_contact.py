@@ -0,0 +1,71 @@
+"""Equivalence of the grouped contact matrices construction with the previous loop over participants
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyepidemics.dataset._build import _build_contact_matrices, PLACES
+
+
+def build_contact_matrices_loop(data, age_boundaries=[18, 65]):
+    """Previous construction of the contact matrices, kept as reference"""
+    data = data.copy()
+    data.duration = data.duration.replace({"<5": 0.08, "5-15": 0.25, "15-1h": 0.75, "1h-4h": 3, ">4h": 4})
+    for column in PLACES[:-1]:
+        data[column] = data[column] * data["duration"]
+    data["ouvert"] = data["ouvert"] * data["duration"] * 0.2
+
+    age_boundaries = [-1] + list(age_boundaries) + [np.inf]
+    age_groups = [[x, y] for x, y in zip(age_boundaries[:-1], age_boundaries[1:])]
+
+    contact_matrices = {vacation: {place: [] for place in PLACES} for vacation in ["oui", "non"]}
+    for vacation in ["oui", "non"]:
+        data_temp = data[data.vacation == vacation]
+        for Id in data_temp.ID.unique():
+            ind = data_temp["ID"] == Id
+            age1 = data_temp.loc[ind, "age1"].mean()
+            i = np.where([group[0] < age1 and age1 <= group[1] for group in age_groups])[0].item()
+            for place in PLACES:
+                matrice = np.zeros((len(age_groups), len(age_groups)))
+                for j in range(len(age_groups)):
+                    age_group2 = ((age_groups[j][0] < data_temp.age2) & (data_temp.age2 < age_groups[j][1]))
+                    matrice[i, j] = data_temp.loc[ind & age_group2, place].sum()
+                contact_matrices[vacation][place].append(matrice)
+
+        contact_matrices[vacation] = {k: np.mean(v, axis=0).tolist() for k, v in contact_matrices[vacation].items()}
+    return contact_matrices
+
+
+def make_contacts(n_participants=80, seed=0):
+    """Synthetic parsed survey, with contacts ages on the groups boundaries"""
+    rng = np.random.default_rng(seed)
+    n_contacts = rng.integers(1, 12, n_participants)
+    ids = np.repeat(np.arange(n_participants), n_contacts)
+    data = pd.DataFrame({
+        "ID": ids,
+        "vacation": np.repeat(rng.choice(["oui", "non"], n_participants), n_contacts),
+        "age1": np.repeat(rng.integers(0, 90, n_participants), n_contacts),
+        "age2": rng.choice(np.r_[np.arange(0, 90), [18, 65] * 5], len(ids)),
+        "duration": rng.choice(["<5", "5-15", "15-1h", "1h-4h", ">4h"], len(ids)),
+    })
+    for place in PLACES:
+        data[place] = (rng.random(len(ids)) < 0.3).astype(int)
+    return data
+
+
+def test_build_contact_matrices_matches_loop():
+    data = make_contacts()
+    expected = build_contact_matrices_loop(data)
+    result = _build_contact_matrices(data)
+
+    for vacation in ["oui", "non"]:
+        for place in PLACES:
+            np.testing.assert_allclose(result[vacation][place], expected[vacation][place], rtol=1e-12)
+
+
+def test_build_contact_matrices_raises_on_missing_age():
+    data = make_contacts()
+    data.loc[data.ID == 3, "age1"] = np.nan
+    with pytest.raises(ValueError):
+        _build_contact_matrices(data)
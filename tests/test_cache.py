@@ -0,0 +1,55 @@
+"""Invalidation of the columnar cache of datasets
+"""
+
+import pandas as pd
+
+from pyepidemics.dataset._cache import cached, hash_data, load_cache, read_manifest, save_cache
+
+
+def make_data(value=1.0):
+    return pd.DataFrame({"date": pd.date_range("2020-03-01", periods=5).astype(str), "deces": [value] * 5})
+
+
+def test_entry_is_loaded_only_with_same_source_and_params(tmp_path):
+    data_home = str(tmp_path)
+    data = make_data()
+    source_hash = hash_data(data)
+    save_cache("cases", data, source_hash, {"smooth": True}, data_home=data_home)
+
+    loaded = load_cache("cases", source_hash, {"smooth": True}, data_home=data_home)
+    pd.testing.assert_frame_equal(loaded, data)
+    assert loaded.attrs["source_hash"] == source_hash
+    assert "fetch_date" in loaded.attrs
+
+    assert load_cache("cases", hash_data(make_data(2.0)), {"smooth": True}, data_home=data_home) is None
+    assert load_cache("cases", source_hash, {"smooth": False}, data_home=data_home) is None
+    assert load_cache("cases", source_hash, data_home=data_home) is None
+    assert load_cache("other", source_hash, {"smooth": True}, data_home=data_home) is None
+
+
+def test_entry_expires_after_max_age(tmp_path):
+    data_home = str(tmp_path)
+    save_cache("remote", make_data(), "hash", data_home=data_home)
+    assert load_cache("remote", max_age=pd.Timedelta("1h"), data_home=data_home) is not None
+    assert load_cache("remote", max_age=pd.Timedelta(0), data_home=data_home) is None
+
+
+def test_cached_rebuilds_when_inputs_change(tmp_path):
+    data_home = str(tmp_path)
+    builds = []
+
+    def build(value):
+        builds.append(value)
+        return make_data(value)
+
+    for value, smooth in [(1.0, True), (1.0, True), (2.0, True), (2.0, False), (2.0, True)]:
+        source_hash = hash_data(make_data(value))
+        result = cached("processed", lambda: build(value), source_hash, {"smooth": smooth}, data_home=data_home)
+        pd.testing.assert_frame_equal(result, make_data(value))
+
+    # Entries with other processing parameters are kept side by side
+    assert builds == [1.0, 2.0, 2.0]
+    assert len(read_manifest(data_home)) == 2
+
+    cached("processed", lambda: build(2.0), hash_data(make_data(2.0)), {"smooth": True}, data_home=data_home, update=True)
+    assert builds == [1.0, 2.0, 2.0, 2.0]
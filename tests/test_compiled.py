@@ -0,0 +1,70 @@
+"""Equivalence of compiled, symbolic and jitted derivatives with the previous derivative computed on the transitions network
+"""
+
+import numpy as np
+import pytest
+
+from pyepidemics.models import SIR, SEIR, COVID19Category
+
+PLACES = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
+COEFFS = {k: {"dates": [0, 53], "values": [1, 0.3]} for k in PLACES}
+
+
+def make_model(name, symbolic=False):
+    if name == "SIR":
+        return SIR(1e6, 0.3, 0.1, symbolic=symbolic)
+    elif name == "SEIR":
+        return SEIR(1e6, 0.5, 0.2, 0.25, symbolic=symbolic)
+    return COVID19Category(N=[1.4e7, 3.6e7, 1.7e7], beta=[0.3, 0.25, 0.2], contact_coeffs=COEFFS, symbolic=symbolic)
+
+
+def make_init_state(model):
+    """Initial state with a few infected in the first susceptible compartment"""
+    y0 = np.zeros(len(model.compartments))
+    susceptible = [i for i, c in enumerate(model.compartments) if c.startswith("S")]
+    y0[susceptible] = [1e6] if len(susceptible) == 1 else [1.4e7, 3.6e7, 1.7e7]
+    y0[susceptible[0]] -= 10
+    y0[model.compartments.index("I" if "I" in model.compartments else "E_young")] += 10
+    return y0
+
+
+def random_states(model, n=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0, 1e6, (n, len(model.compartments)))
+
+
+@pytest.mark.parametrize("name", ["SIR", "SEIR", "COVID19Category"])
+def test_compiled_derivative_matches_network(name):
+    model = make_model(name)
+    states = random_states(model)
+    times = np.linspace(0, 100, len(states))
+    expected = [model.derivative(y, t) for y, t in zip(states, times)]
+
+    model.compile()
+    assert model.compiled
+    for y, t, dydt in zip(states, times, expected):
+        np.testing.assert_allclose(model.derivative(y, t), dydt, rtol=1e-10, atol=1e-8)
+
+
+@pytest.mark.parametrize("name", ["SIR", "SEIR", "COVID19Category"])
+def test_symbolic_derivative_matches_lambda(name):
+    model, symbolic = make_model(name), make_model(name, symbolic=True).compile()
+    states = random_states(model)
+    times = np.linspace(0, 100, len(states))
+
+    for y, t in zip(states, times):
+        np.testing.assert_allclose(symbolic.derivative(y, t), model.derivative(y, t), rtol=1e-10, atol=1e-8)
+
+    y0 = make_init_state(model)
+    expected = model.solve(150, init_state=y0, as_array=True).values
+    np.testing.assert_allclose(symbolic.solve(150, init_state=y0, as_array=True).values, expected, rtol=1e-5, atol=1e-2)
+
+
+@pytest.mark.parametrize("name", ["SIR", "SEIR", "COVID19Category"])
+def test_jit_matches_numpy(name):
+    pytest.importorskip("numba")
+    model = make_model(name, symbolic=True).compile()
+    y0 = make_init_state(model)
+    expected = model.solve(150, init_state=y0, solver="rk4", as_array=True).values
+    result = model.solve(150, init_state=y0, solver="rk4", as_array=True, jit=True).values
+    np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-6)
@@ -0,0 +1,27 @@
+"""Regression of COVID19Category.r0() on fixed parameters against the values of the previous implementation
+The calibration constraint of scripts/national_category_calibration.py bounds r0(), which evaluates contacts at t = 0
+"""
+
+import pytest
+
+from pyepidemics.models import COVID19Category
+
+PLACES = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
+
+# Coefficients of the national calibration script, and a partial lockdown
+LOCKDOWN = {
+    "domicile": {"dates": [0], "values": [0.1]},
+    "ecoles": {"dates": [0, 43], "values": [1, 0]},
+    **{k: {"dates": [0, 53], "values": [1, 0]} for k in PLACES[2:]},
+}
+PARTIAL = {k: {"dates": [0, 53], "values": [1, 0.3]} for k in PLACES}
+
+
+@pytest.mark.parametrize("symbolic", [False, True])
+def test_r0_matches_previous_implementation(symbolic):
+    model = COVID19Category(N=[13.45e6, 36.05e6, 15.39e6], beta=[0.4, 0.2, 0.3], offset=3, proba_icu=[0, 0.36, 0.2],
+                            contact_coeffs=LOCKDOWN, symbolic=symbolic)
+    assert model.r0() == pytest.approx(0.6318331503202432, rel=1e-12)
+
+    model = COVID19Category(N=[1.4e7, 3.6e7, 1.7e7], beta=[0.3] * 3, contact_coeffs=PARTIAL, symbolic=symbolic)
+    assert model.r0() == pytest.approx(6.139036402430467, rel=1e-12)
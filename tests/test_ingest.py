@@ -0,0 +1,64 @@
+"""Equivalence of the incremental ingest of the daily case file with reading the whole file again
+"""
+
+import numpy as np
+import pandas as pd
+
+from pyepidemics.dataset._ingest import ingest_daily_case, read_daily_case, KEY
+
+
+def make_cases(dates, seed=0):
+    """Synthetic rows of the national case file for a few mailles and sources"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for date in dates:
+        for granularite, code in [("pays", "FRA"), ("departement", "DEP-75"), ("departement", "DEP-92")]:
+            for source in ["Santé publique France Data", "Ministère des Solidarités et de la Santé"]:
+                rows.append({"date": str(date.date()), "granularite": granularite, "maille_code": code, "source_nom": source,
+                             "deces": int(rng.integers(0, 1000)), "reanimation": int(rng.integers(0, 100))})
+    return pd.DataFrame(rows)
+
+
+def read_full(path):
+    """Previous reading of the whole file, the last row of each key wins"""
+    data = pd.read_csv(path, dtype={k: str for k in KEY + ["granularite"]})
+    data = data.drop_duplicates(subset=KEY, keep="last")
+    return data.sort_values(["date"] + KEY[1:]).reset_index(drop=True)
+
+
+def read_store(data_home, granularite=None):
+    data = read_daily_case(granularite, data_home=data_home)
+    return data.sort_values(["date"] + KEY[1:]).reset_index(drop=True)
+
+
+def test_incremental_ingest_matches_full_read(tmp_path):
+    path = tmp_path / "cases.csv"
+    data_home = str(tmp_path)
+    first = make_cases(pd.date_range("2020-03-25", "2020-04-05"))
+    first.to_csv(path, index=False)
+    ingest_daily_case(str(path), data_home=data_home)
+    pd.testing.assert_frame_equal(read_store(data_home), read_full(path))
+
+    # Appended rows, with corrections of rows already ingested in a previous month
+    corrections = first.iloc[:6].assign(deces=-1)
+    new = pd.concat([make_cases(pd.date_range("2020-04-06", "2020-04-12"), seed=1), corrections])
+    new.to_csv(path, mode="a", header=False, index=False)
+    summary = ingest_daily_case(str(path), data_home=data_home)
+    assert summary["rows"] == len(new)
+    pd.testing.assert_frame_equal(read_store(data_home), read_full(path))
+    assert (read_store(data_home, "pays").granularite == "pays").all()
+
+    # Nothing new to ingest
+    assert ingest_daily_case(str(path), data_home=data_home)["rows"] == 0
+
+
+def test_rewritten_file_is_ingested_again(tmp_path):
+    path = tmp_path / "cases.csv"
+    data_home = str(tmp_path)
+    make_cases(pd.date_range("2020-03-25", "2020-04-05")).to_csv(path, index=False)
+    ingest_daily_case(str(path), data_home=data_home)
+
+    # File rewritten upstream with other values, and longer than the ingested part
+    make_cases(pd.date_range("2020-03-25", "2020-04-20"), seed=2).to_csv(path, index=False)
+    ingest_daily_case(str(path), data_home=data_home)
+    pd.testing.assert_frame_equal(read_store(data_home), read_full(path))
@@ -0,0 +1,51 @@
+"""Equivalence of ObservationLoss on raw solver outputs with the previous custom_loss on States dataframes
+"""
+
+import numpy as np
+import pytest
+
+from pyepidemics.models import SEIR, COVID19Category
+from pyepidemics.params.metrics import ObservationLoss, custom_loss
+
+PLACES = ["domicile", "ecoles", "travailClos", "chezProchesLieuxClos", "autresLieuxClos(resto..)", "transport", "ouvert"]
+
+
+def make_observations(states, cols, seed=0):
+    """Noisy daily observations of the given columns, from a few days after the start of the epidemic"""
+    rng = np.random.default_rng(seed)
+    return states[cols].iloc[10:] * rng.uniform(0.8, 1.2, (len(states) - 10, len(cols)))
+
+
+def previous_loss(model, true, init_state):
+    """Previous loss of model.objective, on the full States dataframe"""
+    states = model.predict(true, init_state=init_state, as_array=False)
+    return custom_loss(states.loc[true.index], true, cols=true.columns.tolist())
+
+
+@pytest.mark.parametrize("cols", [["I"], ["E", "I", "R"]])
+def test_observation_loss_matches_custom_loss_seir(cols):
+    model = SEIR(1e6, 0.5, 0.2, 0.25)
+    init_state = {"S": 1e6 - 10, "I": 10}
+    states = model.solve(120, init_state=init_state, start_date="2020-03-01")
+    true = make_observations(states, cols)
+
+    expected, expected_dict = previous_loss(model, true, init_state)
+    loss, loss_dict = ObservationLoss(true)(model.predict(true, init_state=init_state, outputs=cols))
+
+    assert loss == pytest.approx(expected, rel=1e-10)
+    assert loss_dict == pytest.approx(expected_dict, rel=1e-10)
+
+
+def test_observation_loss_matches_custom_loss_aggregated():
+    coeffs = {k: {"dates": [0, 53], "values": [1, 0.3]} for k in PLACES}
+    model = COVID19Category(N=[1.4e7, 3.6e7, 1.7e7], beta=[0.3, 0.25, 0.2], contact_coeffs=coeffs)
+    init_state = {"S_young": 1.4e7, "S_adult": 3.6e7 - 10, "S_senior": 1.7e7, "E_adult": 10}
+    states = model.solve(150, init_state=init_state, start_date="2020-03-01")
+    cols = ["D", "H", "ICU"]
+    true = make_observations(states, cols)
+
+    expected, expected_dict = previous_loss(model, true, init_state)
+    loss, loss_dict = ObservationLoss(true)(model.predict(true, init_state=init_state, outputs=cols))
+
+    assert loss == pytest.approx(expected, rel=1e-8)
+    assert loss_dict == pytest.approx(expected_dict, rel=1e-8)
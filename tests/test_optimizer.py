@@ -0,0 +1,33 @@
+"""Reproducibility of the parallel calibration with a seeded sampler
+"""
+
+import random
+import time
+
+import optuna
+from optuna.samplers import TPESampler
+
+from pyepidemics.models import SIR
+from pyepidemics.params.optimizer import ParamsOptimizer
+
+
+def objective(params):
+    """Loss of a quadratic bowl, with a random duration so that trials complete in a different order on each run"""
+    time.sleep(random.SystemRandom().uniform(0, 0.03))
+    return (params["beta"] - 0.5) ** 2 + (params["gamma"] - 0.1) ** 2
+
+
+def run_parallel(seed):
+    optimizer = ParamsOptimizer(SIR(1e6, 0.5, 0.1))
+    optimizer.study = optuna.create_study(direction="minimize", sampler=TPESampler(seed=seed, n_startup_trials=5))
+    optimizer._optimize_parallel(objective, {"beta": (0.1, 1.0), "gamma": (0.05, 0.5)}, n_trials=20, n_jobs=3)
+    return optimizer.study.trials
+
+
+def test_parallel_optimization_is_reproducible():
+    first, second = run_parallel(seed=0), run_parallel(seed=0)
+
+    assert len(first) == len(second) == 20
+    assert all(trial.state == optuna.trial.TrialState.COMPLETE for trial in first)
+    assert [trial.params for trial in first] == [trial.params for trial in second]
+    assert [trial.value for trial in first] == [trial.value for trial in second]
@@ -0,0 +1,99 @@
+"""Equivalence of the vectorized contact survey parsing with the previous row by row parser
+"""
+
+import numpy as np
+import pandas as pd
+
+from pyepidemics.dataset._fetch import _process_contact
+
+
+def parse_one_line(line):
+    """Previous parser of one line of the survey, kept as reference"""
+    if line[1184] == 0:
+        return pd.DataFrame()
+
+    data_frames = []
+    departement, age1, sex1 = line[27], line[4], line[6]
+    for day_index in [54, 619]:
+        week_day, vacation = line[day_index+2], line[day_index+3]
+        contact = 0
+        contact_index = day_index + 5 + contact * 14
+        while contact<40 and not sum(line[contact_index+4: contact_index+11])==0\
+            and not pd.isnull(line[contact_index+2]):
+            df = pd.DataFrame({"ID": line[1],
+                               "departement": departement,
+                               "week_day": week_day, "vacation": vacation,
+                               "age1": age1, "sex1": sex1,
+                               "age2": line[contact_index+2],
+                               "sex2": line[contact_index+3],
+                               "domicile": line[contact_index+4],
+                               "ecoles": line[contact_index+5],
+                               "travailClos": line[contact_index+6],
+                               "chezProchesLieuxClos": line[contact_index+7],
+                               "autresLieuxClos(resto..)": line[contact_index+8],
+                               "transport": line[contact_index+9],
+                               "ouvert": line[contact_index+10],
+                               "duration": line[contact_index+13]},
+                              index=[0])
+
+            data_frames.append(df)
+            contact+=1
+            contact_index = day_index + 5 + contact * 14
+
+    if len(data_frames) > 0:
+        return pd.concat(data_frames)
+    return pd.DataFrame()
+
+
+def process_contact_rows(raw_data):
+    """Previous implementation of _process_contact"""
+    data = pd.concat([parse_one_line(raw_data.loc[i,:]) for i in range(raw_data.shape[0])])
+    data = data.dropna(axis=0).astype(int)
+
+    data.departement = data.departement.astype("object")
+    data.week_day = data.week_day.astype("object")
+    data.vacation = data.vacation.replace({1: "oui", 2: "non"})
+    data.sex1 = data.sex1.replace({1: "homme", 2: "femme"})
+    data.sex2 = data.sex2.replace({1: "homme", 2: "femme"})
+    data.duration = data.duration.replace({1: "<5", 2: "5-15", 3: "15-1h",
+                                          4: "1h-4h", 5: ">4h"})
+    return data
+
+
+def make_survey(n_lines=60, seed=0):
+    """Synthetic survey sheet with integer codes in every column read by the parsers
+    Contacts have random places, missing ages, sexes or places, and empty blocks followed by other contacts
+    """
+    rng = np.random.default_rng(seed)
+    raw = np.full((n_lines, 1185), np.nan)
+    raw[:, 1] = np.arange(n_lines)
+    raw[:, 27] = rng.integers(1, 96, n_lines)
+    raw[:, 4] = rng.integers(0, 90, n_lines)
+    raw[:, 6] = rng.integers(1, 3, n_lines)
+    raw[:, 1184] = rng.choice([0, 1], n_lines, p=[0.1, 0.9])
+
+    for day_index in [54, 619]:
+        raw[:, day_index + 2] = rng.integers(1, 8, n_lines)
+        raw[:, day_index + 3] = rng.integers(1, 3, n_lines)
+        for i in range(n_lines):
+            for contact in range(rng.integers(0, 41)):
+                index = day_index + 5 + contact * 14
+                raw[i, index + 2] = rng.integers(0, 90) if rng.random() > 0.03 else np.nan
+                raw[i, index + 3] = rng.integers(1, 3) if rng.random() > 0.03 else np.nan
+                raw[i, index + 4:index + 11] = rng.random(7) < 0.3 if rng.random() > 0.05 else 0
+                if rng.random() < 0.05:
+                    raw[i, index + 4:index + 11] = np.nan
+                raw[i, index + 13] = rng.integers(1, 6)
+
+    return pd.DataFrame(raw)
+
+
+def test_process_contact_matches_row_parser():
+    raw_data = make_survey()
+    expected = process_contact_rows(raw_data).reset_index(drop=True)
+    result = _process_contact(raw_data)
+
+    assert len(result) > 0
+    assert set(result.vacation) == {"oui", "non"}
+    assert set(result.duration) == {"<5", "5-15", "15-1h", "1h-4h", ">4h"}
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,54 @@
+"""Equivalence of the batched Hodrick Prescott smoothing with the previous per series statsmodels filter
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyepidemics.utils import clean_frame, clean_series, smooth_block
+
+sm = pytest.importorskip("statsmodels.api")
+
+
+def clean_series_statsmodels(y, smooth=False, p=6.25, logsmooth=True):
+    """Previous implementation of clean_series, kept as reference"""
+    y = y.replace(0.0, np.nan).interpolate().fillna(0.0)
+    if smooth:
+        y = sm.tsa.filters.hpfilter(y, p)[1]
+        y.loc[(y < 1) & (y > 0)] = 1
+    if logsmooth:
+        y = y.map(lambda x: np.log(1 + x))
+        y = sm.tsa.filters.hpfilter(y, p)[1]
+        y = y.map(lambda x: np.exp(x) - 1)
+        y.loc[(y < 1) & (y > 0)] = 1
+        y.loc[y < 0] = 0
+    return y
+
+
+def make_cases(n_days=90, n_series=5, seed=0):
+    """Synthetic daily cases with leading zeros and missing days"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2020-03-01", periods=n_days)
+    values = rng.poisson(np.linspace(1, 200, n_days)[:, None] * rng.uniform(0.5, 2, n_series)).astype(float)
+    values[:5, 0] = 0
+    values[rng.random(values.shape) < 0.05] = 0
+    return pd.DataFrame(values, index=index, columns=[f"dep{i}" for i in range(n_series)])
+
+
+@pytest.mark.parametrize("smooth", [False, True])
+def test_clean_frame_matches_statsmodels(smooth):
+    df = make_cases()
+    result = clean_frame(df, smooth=smooth)
+    for column in df.columns:
+        expected = clean_series_statsmodels(df[column], smooth=smooth)
+        np.testing.assert_allclose(result[column].values, expected.values, rtol=1e-7, atol=1e-9)
+        pd.testing.assert_series_equal(clean_series(df[column], smooth=smooth), result[column], check_exact=False)
+
+
+@pytest.mark.parametrize("n_days", [1, 2])
+def test_short_series_are_unchanged(n_days):
+    df = make_cases(n_days=n_days) + 3
+    np.testing.assert_array_equal(smooth_block(df.values), df.values)
+    np.testing.assert_allclose(clean_frame(df, smooth=True).values, df.values)
+    if n_days == 2:
+        np.testing.assert_allclose(clean_series(df.iloc[:, 0]).values, clean_series_statsmodels(df.iloc[:, 0]).values)